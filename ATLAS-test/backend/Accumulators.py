@@ -0,0 +1,105 @@
+import pickle
+import zlib
+import hist
+
+# An Accumulator is a dict of partial results (e.g. the histograms and cutflow of each sample)
+# that can be combined with '+'. Values are added key by key: numbers (counts, sums of weights)
+# and Hist objects are summed, nested dicts are added recursively and a key found on one side
+# only is copied. '+' is associative, so the results of many workers can be added in any grouping
+# Example: Accumulator({'histograms' : {'Zee' : {'mass' : Hist}}, 'cutflows' : {'Zee' : {'Events read' : 10}}})
+class Accumulator(dict):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Nested dicts are made accumulators too
+        for key, value in self.items():
+            if isinstance(value, dict) and not isinstance(value, Accumulator):
+                self[key] = Accumulator(value)
+
+    def __add__(self, other):
+        if not isinstance(other, dict):
+            return NotImplemented
+        result = self.copy()
+        result += other
+        return result
+
+    # Allow sum() of accumulators (sum starts from 0)
+    def __radd__(self, other):
+        if isinstance(other, (int, float)) and other == 0:
+            return self.copy()
+        return NotImplemented
+
+    def __iadd__(self, other):
+        if not isinstance(other, dict):
+            return NotImplemented
+        for key, value in other.items():
+            if key not in self:
+                self[key] = copy_value(value)
+            else:
+                self[key] = add_values(key, self[key], value)
+        return self
+
+    # Copy of the accumulator that doesn't share any Hist or nested dict with it
+    def copy(self):
+        return Accumulator({key : copy_value(value) for key, value in self.items()})
+
+# Copy one value of an accumulator
+def copy_value(value):
+    if isinstance(value, dict):
+        return Accumulator(value).copy()
+    if isinstance(value, hist.Hist):
+        return value.copy()
+    return value
+
+# Add two values of an accumulator found with the same key
+def add_values(key, left, right):
+    if isinstance(left, dict) and isinstance(right, dict):
+        if not isinstance(left, Accumulator):
+            left = Accumulator(left).copy()
+        left += right
+        return left
+    if isinstance(left, hist.Hist) and isinstance(right, hist.Hist):
+        return left + right
+    if (isinstance(left, (int, float)) and isinstance(right, (int, float))
+        and not isinstance(left, bool) and not isinstance(right, bool)):
+        return left + right
+    raise TypeError(f"Cannot add the values of key '{key}': {type(left).__name__} and {type(right).__name__}. "
+                    'Expect numbers, Hist objects or dicts.')
+
+# User call this function to combine the accumulators returned by workers with a tree reduction:
+# neighbouring accumulators are added in pairs, then the sums in pairs, and so on
+# If an executor (e.g. concurrent.futures.ProcessPoolExecutor) is given, the additions of each
+# round are done in parallel. Accumulators given as bytes (see accumulator_to_bytes()) are loaded first
+def merge_accumulators(accumulators, executor=None):
+    accumulators = [accumulator_from_bytes(i) if isinstance(i, bytes) else Accumulator(i)
+                    for i in accumulators]
+    if not accumulators:
+        return Accumulator()
+    while len(accumulators) > 1:
+        pairs = list(zip(accumulators[0::2], accumulators[1::2]))
+        if executor is not None:
+            merged = list(executor.map(add_pair, pairs))
+        else:
+            merged = [add_pair(pair) for pair in pairs]
+        if len(accumulators) % 2: # The last accumulator has no pair in this round
+            merged.append(accumulators[-1])
+        accumulators = merged
+    return accumulators[0]
+
+# Add a pair of accumulators (a function of the module so that it can be sent to a process pool)
+def add_pair(pair):
+    left, right = pair
+    return left + right
+
+# This function serialises an accumulator to compressed bytes, to be returned by a worker process
+# or sent between nodes. Hist objects keep their binning, storage and metadata
+def accumulator_to_bytes(accumulator, level=1):
+    return zlib.compress(pickle.dumps(Accumulator(accumulator), protocol=pickle.HIGHEST_PROTOCOL), level)
+
+# This function loads an accumulator serialised by accumulator_to_bytes()
+def accumulator_from_bytes(data):
+    return pickle.loads(zlib.decompress(data))
+
+# This function makes an accumulator from the histograms and cutflows returned by analysis_parquet()
+# or analysis_uproot() (with histograms booked), so that the results of several runs can be added
+def analysis_accumulator(histograms, cutflows):
+    return Accumulator({'histograms' : histograms, 'cutflows' : cutflows})
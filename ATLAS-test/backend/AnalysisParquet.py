@@ -6,34 +6,36 @@ from zoneinfo import ZoneInfo
 import re
 import awkward as ak
 import numpy as np
-import pyarrow.parquet as pq
-from .ParquetDict import PARQUET_DICT, STR_CODE_COMBO, VALID_STR_CODE # String code and sample filepath
+from .ParquetDict import PARQUET_STR_CODES, STR_CODE_COMBO, VALID_STR_CODE # String codes of the samples
+from .ColumnCache import read_metadata, read_schema_names, read_row_group, read_column, sum_column, use_column_cache
+from .ArrowCache import enable_arrow_cache, arrow_cache_info, restore_arrow_cache, DEFAULT_ARROW_CACHE_LIMIT
+from .ParquetOutput import (open_sample_writer, write_sample_chunk, close_sample_writer, abort_sample_writer,
+                            DEFAULT_ROW_GROUP_SIZE, DEFAULT_ROWS_PER_FILE)
+from .RangeIndex import parse_key, overlapping_row_groups, range_mask
+from .CompactSample import compact_sample
+from .SampleCatalogue import select_files
+from .HistogramBooking import validate_bookings, make_sample_histograms, new_cutflow, update_cutflow, fill_chunk
 
 # This function counts total number of events or sum of weights of the data accessed using a string code
-def count_num_events(string_code):
-    if string_code not in PARQUET_DICT:
-        raise ValueError(f'{string_code} not found in PARQUET_DICT.')
-
-    # Use the string code to get the corresponding filepath for parquet files
-    read_directory = PARQUET_DICT[string_code]
-    if not os.path.isdir(read_directory):
-        raise FileNotFoundError(f"Folder '{read_directory}' does not exist")
-
-    # Get all parquet files in the directory as a list
-    files = sorted(glob.glob(f'{read_directory}/*.parquet'))
+def count_num_events(string_code, skim=None):
+    if string_code not in PARQUET_STR_CODES:
+        raise ValueError(f'{string_code} not found in PARQUET_STR_CODES.')
+
+    # Use the catalogue of the parquet directory to get the parquet files of the string code
+    files = select_files([string_code], skim)[string_code]
+    if not files:
+        raise FileNotFoundError(f"No .parquet files found with the string code '{string_code}'")
     
     # Use the first parquet file in the list to see if the data has 'totalWeight'
-    pq_file = pq.ParquetFile(files[0])
-    has_totalWeight = 'totalWeight' in pq_file.schema.names
+    has_totalWeight = 'totalWeight' in read_schema_names(files[0])
 
     # Get total number of events / sum of weights for a given string code
     num_events = 0 # Initialise the number of events / sum of weights
     for file in files:
-        pq_file = pq.ParquetFile(file)
         if has_totalWeight: # Get the sum of weigths if the data has the 'totalWeight' column
-            num_events += ak.sum(ak.from_parquet(file, columns=['totalWeight'])['totalWeight'])
+            num_events += sum_column(file, 'totalWeight')
         else: # Get the number of events if the data doesn't have 'totalWeight'
-            num_events += pq_file.metadata.num_rows
+            num_events += read_metadata(file).num_rows
     return num_events
     # End of count_num_events() function
 
@@ -62,22 +64,110 @@ def parse_var(input_var, parsed_variables):
                     (input_var, base_var, index)])
 # End of parse_var() function
 
+# Valid options for the sampling argument of analysis_parquet()
+VALID_SAMPLING = ['sequential', 'random', 'exact']
+
+# This function returns the weight a row group counts towards max_num_events: the sum of weights
+# if the file has 'totalWeight' and not all events have totalWeight = 1, otherwise the number of events.
+# Also returns the weights of the row group (None if the number of events is used)
+# Only the 'totalWeight' column is decoded (and it is served from the column cache)
+def row_group_weight(file, group):
+    num_rows = read_metadata(file).row_group(group).num_rows
+    if 'totalWeight' in read_schema_names(file):
+        weights = ak.to_numpy(read_column(file, 'totalWeight', group))
+        sum_weights = weights.sum()
+        if sum_weights != num_rows: # totalWeight of each event != 1
+            return sum_weights, weights
+    return num_rows, None
+
+# This function selects the row groups of files to read so that the number of events / sum of weights
+# reaches max_num_events. Returns a list of (file, row group, stop) where stop is the number of events
+# to read from the start of the row group (None to read all events)
+# sampling = 'sequential' : Read row groups in file order (the head of the first files)
+# sampling = 'random' : Read whole row groups chosen in a random order (set by seed) - this may
+#                       read up to one row group more than max_num_events
+# sampling = 'exact' : Same as 'random', but the last row group is cut so that max_num_events is reached
+# With range_query = (key, lower, upper), row groups that can't hold events with lower <= key < upper
+# (known from their recorded min/max of key) are not read. They still count towards max_num_events,
+# so the events read are the same as reading everything and then applying the range
+# group_weight(file, group) returns the weight of a row group and the weights of its events, as row_group_weight()
+def plan_row_groups(files, max_num_events, sampling='sequential', seed=None, range_query=None,
+                    group_weight=row_group_weight):
+    if sampling not in VALID_SAMPLING:
+        raise ValueError(f'Invalid sampling: {sampling}. Valid options are: {VALID_SAMPLING}')
+
+    overlapping = {} # Whether each row group of each file overlaps with the range query
+    for file in files:
+        if range_query is not None:
+            overlapping[file] = overlapping_row_groups(file, *range_query)
+        else:
+            overlapping[file] = [True] * read_metadata(file).num_row_groups
+
+    row_groups = [(file, group) for file in files
+                  for group in range(read_metadata(file).num_row_groups)]
+    if sampling != 'sequential': # Shuffle the row groups (reproducible with seed)
+        order = np.random.default_rng(seed).permutation(len(row_groups))
+        row_groups = [row_groups[i] for i in order]
+
+    plan = [] # Hold (file, row group, stop)
+    num_events_read = 0
+    for file, group in row_groups:
+        if num_events_read >= max_num_events:
+            break
+        weight, weights = group_weight(file, group)
+        stop = None
+        # Can't read all events in this row group (except with 'random' sampling that reads whole row groups)
+        if (num_events_read + weight) > max_num_events and sampling != 'random':
+            if weights is not None: # Weighted events
+                cum_weights = np.cumsum(weights) # Cumulative sum of weight
+                # See where the place the cut off index
+                stop = int(np.searchsorted(cum_weights, max_num_events - num_events_read)) + 1
+                num_events_read += cum_weights[min(stop, len(cum_weights)) - 1]
+            else: # Can read these events
+                stop = int(max_num_events - num_events_read)
+                num_events_read = max_num_events
+        else: # Can read all events in this row group
+            num_events_read += weight
+        if overlapping[file][group]:
+            plan.append((file, group, stop))
+
+    # Read the selected row groups in file order
+    if sampling != 'sequential':
+        file_order = {file : i for i, file in enumerate(files)}
+        plan.sort(key=lambda entry: (file_order[entry[0]], entry[1]))
+    return plan
+# End of plan_row_groups() function
+
 # This function loops through all parquet files for a given directory or string code
 # Reads variables based on parsed_variables. Store 'totalWeight' if the column is found in the Parquet file
 # Reads files up to a max_num_events calculated in analysis_pq() or read_parquet()
+# The row groups to read are selected by plan_row_groups() using sampling, seed and range_query
 # Is able to write the data read from the parquet files to new parquet files
 # Is able to apply selection cuts
 # Can choose not to store data in memory
-def concatenate_chunks(files, parsed_variables, cut_function, write_parquet, sample_out_dir, max_num_events, return_output):
+# Can fill booked histograms (sample_hists) and a cutflow with the events passing the selection cut
+def concatenate_chunks(files, parsed_variables, cut_function, write_parquet, sample_writer, max_num_events, return_output,
+                       sampling='sequential', seed=None, range_query=None, bookings=None, sample_hists=None, cutflow=None):
 
     sample_data_list = [] # hold data from each file
-    chunk_count = 0
-    num_events_read = 0
+
+    # Columns read to fill the booked histograms (removed after filling if not in parsed_variables)
+    booked_columns = []
+    if bookings is not None:
+        booked_columns = list(dict.fromkeys(parse_key(variable)[0] for booking in bookings
+                                            for variable in booking['variables']))
+
+    # Select the row groups to read. Only the weight column is decoded to do this
+    plan = plan_row_groups(files, max_num_events, sampling, seed, range_query)
     
     for file in files:
+        # Row groups to read in this file and the number of events to read from each
+        file_plan = [(group, stop) for plan_file, group, stop in plan if plan_file == file]
+        if not file_plan:
+            continue
+
         # Get all columns in the file
-        parquet_file = pq.ParquetFile(file)
-        all_columns = parquet_file.schema.names
+        all_columns = read_schema_names(file)
         
         # Update parsed_variables with 'totalWeight' if it is present in the file
         # but not in parsed_variables (to be read from the files and stored)
@@ -87,50 +177,29 @@ def concatenate_chunks(files, parsed_variables, cut_function, write_parquet, sam
         elif 'totalWeight' not in all_columns and 'totalWeight' in parsed_variables[:, 1]:
             rows_to_delete = np.any(parsed_variables == 'totalWeight', axis=1)
             parsed_variables = parsed_variables[~rows_to_delete] # to avoid reading and storing a non-existent column
-        
-        chunk_data_list = [] # Hold data from each row group in one file
-        num_row_groups = parquet_file.num_row_groups # Number of row groups in the file
-        has_totalWeight = 'totalWeight' in parsed_variables[:, 1] # See if the data is MC
 
         # Read certain columns from parquet file and store as Awkward arrays row group by row group
-        for group in range(num_row_groups):
-            if num_events_read >= max_num_events:
-                break
-            arr = ak.from_parquet(file, columns=parsed_variables[:, 1], row_groups={group})
+        for group, stop in file_plan:
+            # Decoded columns are shared through the process-wide column cache
+            arr = read_row_group(file, list(parsed_variables[:, 1]) + booked_columns, group)
 
             # Skip to the next row group if no data found
             if len(arr) == 0:
                 print(f'No data found for {parsed_variables[:, 1]} in {file}')
                 continue
 
-            # If 'totalWeight' column present in the file, update the num_events using the sum of weights
-            # if not all events have totalWeight = 1. Otherwise, just count the number of events
-            if has_totalWeight:
-                sum_weights = ak.sum(arr['totalWeight'])
-                if sum_weights != len(arr): # totalWeight of each event != 1
-                    if (num_events_read + sum_weights) > max_num_events: # Can't read all events in this row group
-                        weights = ak.to_numpy(arr["totalWeight"])
-                        cum_weights = np.cumsum(weights) # Cumulative sum of weight
-                        # See where the place the cut off index and slice the array
-                        cutoff_idx = np.searchsorted(cum_weights, max_num_events - num_events_read) + 1
-                        arr = arr[:cutoff_idx]
-                        num_events_read += weights[:cutoff_idx].sum()
-                    else: # Can read all events in this row group
-                        num_events_read += sum_weights
-                else: # totalWeight of each event == 1
-                    if (num_events_read + len(arr)) > max_num_events: # Can't read all events in this row group
-                        num_events_to_read = max_num_events - num_events_read # Can read these events
-                        arr = arr[:num_events_to_read]
-                        num_events_read = max_num_events
-                    else: # Can read all events in this row group
-                        num_events_read += len(arr)
-            else: # No 'totalWeight' column, just count number of events
-                if (num_events_read + len(arr)) > max_num_events: # Can't read all events in this row group
-                    num_events_to_read = max_num_events - num_events_read # Can read these events
-                    arr = arr[:num_events_to_read]
-                    num_events_read = max_num_events
-                else: # Can read all events in this row group
-                    num_events_read += len(arr)
+            # Can't read all events in this row group
+            if stop is not None:
+                arr = arr[:stop]
+
+            # Only keep events with lower <= key < upper
+            if range_query is not None:
+                arr = arr[range_mask(file, group, *range_query)[:len(arr)]]
+                # Skip to the next row group if no event is in the range
+                if len(arr) == 0:
+                    continue
+
+            num_events_read = len(arr) # Number of events before the selection cut
 
             # Selection cut
             if cut_function is not None:
@@ -140,13 +209,23 @@ def concatenate_chunks(files, parsed_variables, cut_function, write_parquet, sam
                     print(f'cut_function is a function that takes one argument and returns it.\nException occurred : {e}\n')
                     raise
 
-                # Skip to the next row group if all data has been filtered
-                if len(arr) == 0:
-                    print(f'No data found for {parsed_variables[:, 1]} in {file} after selection cut')
-                    continue
+            # Fill the booked histograms and the cutflow
+            if bookings is not None:
+                update_cutflow(cutflow, num_events_read, arr)
+                fill_chunk(bookings, arr, sample_hists)
+                # Remove the columns only read for the histograms (derived fields are kept)
+                for column in booked_columns:
+                    if column in all_columns and column in arr.fields and column not in parsed_variables[:, 1]:
+                        arr = ak.without_field(arr, column)
+
+            # Skip to the next row group if all data has been filtered
+            if cut_function is not None and len(arr) == 0:
+                print(f'No data found for {parsed_variables[:, 1]} in {file} after selection cut')
+                continue
 
             if write_parquet:
-                chunk_data_list.append(arr) # Add data of this row group to write to disk for this file
+                # Stream data of this row group to disk (written as soon as a row group is filled)
+                write_sample_chunk(sample_writer, arr)
 
             # Add any derived field to parsed_variables (these are the ones that will be saved) if not already in it
             for field in arr.fields:
@@ -193,19 +272,11 @@ def concatenate_chunks(files, parsed_variables, cut_function, write_parquet, sam
             if return_output:
                 sample_data_list.append(arr)
         # End of loop through row groups in one file
-        if chunk_data_list:
-            if len(chunk_data_list) > 1: # Multiple row groups have data, need concatenation
-                chunk_data_ak = ak.concatenate(chunk_data_list)
-            else: # Only one row group has data, take the only element in the list
-                chunk_data_ak = chunk_data_list[0]
-
-            # Write to parquet file and update chunk_count (for filename)
-            ak.to_parquet(chunk_data_ak, f'{sample_out_dir}/chunk{chunk_count}.parquet')
-            chunk_count += 1
-            
-        if num_events_read >= max_num_events:
-            break
     # End of loop through all parquet files
+
+    if write_parquet:
+        # Write the remaining data and the _metadata file of the sample
+        close_sample_writer(sample_writer)
     
     if return_output:
         if sample_data_list:
@@ -218,60 +289,91 @@ def concatenate_chunks(files, parsed_variables, cut_function, write_parquet, sam
 # End of concatenate_chunks() function
 
 
+# This function returns the string codes in PARQUET_STR_CODES that make up str_code and the
+# parquet files for those string codes. str_code may be a string code in PARQUET_STR_CODES,
+# a string code in STR_CODE_COMBO or string codes combined with '+'
+# The files of all string codes are selected with one read of the catalogue (only from skim if given)
+def get_str_code_files(str_code, skim=None):
+    if str_code in PARQUET_STR_CODES:
+        physics_processes = [str_code]
+    else:
+        # For example, str_code may be 'Wlepnu'. It's not in PARQUET_STR_CODES, but in STR_CODE_COMBO
+        # as it is actually 'Wenu+Wmunu+Wtaunu' - each of them is in PARQUET_STR_CODES
+        if str_code in STR_CODE_COMBO:
+            str_code = STR_CODE_COMBO[str_code]
+        # If user combine string codes with '+', then get the string code components
+        physics_processes = [code.strip() for code in str_code.split('+')]
+
+    # Validate the string codes
+    for i in physics_processes:
+        if i not in PARQUET_STR_CODES: # String code neither in PARQUET_STR_CODES nor STR_CODE_COMBO
+            raise ValueError(f'Invalid string code: {i}. Available string codes: {VALID_STR_CODE}')
+
+    files = [] # Hold parquet files for this string code
+    # Add the corresponding parquet files to list
+    selected = select_files(physics_processes, skim)
+    for i in physics_processes:
+        pq_files = selected[i]
+        if not pq_files:
+            raise FileNotFoundError(f"No .parquet files found with the string code '{i}'")
+        files.extend(pq_files)
+    return physics_processes, files
+# End of get_str_code_files() function
+
+# This function returns the key of the data read for a string code (or a subdirectory of read_directory)
+# with a fraction, e.g. 'Zee_0_5' for 'Zee' and 0.5, or 'Zee x0_5' for the subdirectory 'Zee'
+# Any decimal point (and '+') is replaced to create a valid path
+def string_code_sample_key(str_code, fraction):
+    return f'{str_code}_{fraction}'.replace('.', '_').replace('+', '_')
+
+def directory_sample_key(subdirectory_name, fraction):
+    return f'{subdirectory_name} x{fraction}'.replace('.', '_')
+
 # This function gets a list of parquet files based on string_code_list, then call concatenate_chunks() to process data from each file
-def analysis_pq(string_code_list, fraction, parsed_variables, cut_function, write_parquet, output_directory, return_output):
+def analysis_pq(string_code_list, fraction, parsed_variables, cut_function, write_parquet, output_directory, return_output,
+                sampling='sequential', seed=None, row_group_size=DEFAULT_ROW_GROUP_SIZE,
+                max_rows_per_file=DEFAULT_ROWS_PER_FILE, range_query=None, cluster_by=None, skim=None,
+                bookings=None, histograms=None, cutflows=None):
     all_data = {} # Hode data for each entry in string_code_list
     
     for str_code in string_code_list:
         str_code = str(str_code)
-        sample_key = str_code
 
-        files = [] # Hold parquet files for this string code
+        physics_processes, files = get_str_code_files(str_code, skim)
+        # Update max_num_events with a fraction of total number of events from each string code
         max_num_events = 0
-        if str_code in PARQUET_DICT:
-            sample_directory = PARQUET_DICT[str_code]
-            pq_files = sorted(glob.glob(f'{sample_directory}/*.parquet'))
-            if not pq_files:
-                raise FileNotFoundError(f"No .parquet files found with the string code '{str_code}'") 
-            files.extend(pq_files) 
-            # Update max_num_events with a fraction of total number of events from each file
-            max_num_events += count_num_events(str_code) * fraction
-        else:
-            # For example, str_code may be 'Wlepnu'. It's not in PARQUET_DICT, but in STR_CODE_COMBO
-            # as it is actually 'Wenu+Wmunu+Wtaunu' - each of them is in PARQUET_DICT
-            if str_code in STR_CODE_COMBO:
-                str_code = STR_CODE_COMBO[str_code]
-
-            # If user combine string codes with '+', then get the string code components
-            # validate and then add the corresponding parquet files to list
-            physics_processes = [code.strip() for code in str_code.split('+')]
-            for i in physics_processes:
-                if i in PARQUET_DICT:
-                    sample_directory =  PARQUET_DICT[i]
-                    pq_files = sorted(glob.glob(f'{sample_directory}/*.parquet'))
-                    if not pq_files:
-                        raise FileNotFoundError(f"No .parquet files found with the string code '{i}'")
-                    files.extend(pq_files)
-                    # Update max_num_events with a fraction of total number of events from each file         
-                    max_num_events += count_num_events(i) * fraction
-                else: # String code neither in PARQUET_DICT nor STR_CODE_COMBO
-                    raise ValueError(f'Invalid string code: {i}. Available string codes: {VALID_STR_CODE}')
-
-        # Update sample key with fraction used, replace any decimal point to create a valid path
-        sample_key = f'{sample_key}_{fraction}'
-        sample_key = sample_key.replace('.', '_')
-        sample_key = sample_key.replace('+', '_')
+        for i in physics_processes:
+            max_num_events += count_num_events(i, skim) * fraction
+
+        # Update sample key with fraction used
+        sample_key = string_code_sample_key(str_code, fraction)
 
         if write_parquet:
             # Create directory to save data to
             sample_out_dir = f'{output_directory}/{sample_key}'
             os.makedirs(sample_out_dir)
+            # One writer per sample: row groups are appended as they are produced
+            sample_writer = open_sample_writer(sample_out_dir, row_group_size, max_rows_per_file)
         else:
-            sample_out_dir = None
+            sample_writer = None
+
+        # Histograms and cutflow to fill for this sample
+        sample_hists, cutflow = None, None
+        if bookings is not None:
+            sample_hists = histograms[sample_key] = make_sample_histograms(bookings, sample_key)
+            cutflow = cutflows[sample_key] = new_cutflow()
 
         # Process data file by file
-        all_data[sample_key] = concatenate_chunks(files, parsed_variables, cut_function,
-                                                  write_parquet, sample_out_dir, max_num_events, return_output)
+        try:
+            all_data[sample_key] = concatenate_chunks(files, parsed_variables, cut_function,
+                                                      write_parquet, sample_writer, max_num_events, return_output,
+                                                      sampling, seed, range_query, bookings, sample_hists, cutflow)
+        except BaseException:
+            abort_sample_writer(sample_writer) # Don't leave the output file open
+            raise
+        if write_parquet and cluster_by is not None:
+            # Sort the written events by cluster_by and record its min/max for each row group
+            compact_sample(sample_out_dir, row_group_size, max_rows_per_file, sort_by=cluster_by)
         
     if return_output:
         return all_data
@@ -280,7 +382,9 @@ def analysis_pq(string_code_list, fraction, parsed_variables, cut_function, writ
 # This function gets a list of parquet files for each subdirectory_names in read_directory,
 # then call concatenate_chunks() to process data from each file
 def read_parquet(read_directory, subdirectory_names, fraction, parsed_variables, cut_function,
-                 write_parquet, output_directory, return_output):
+                 write_parquet, output_directory, return_output, sampling='sequential', seed=None,
+                 row_group_size=DEFAULT_ROW_GROUP_SIZE, max_rows_per_file=DEFAULT_ROWS_PER_FILE,
+                 range_query=None, cluster_by=None, bookings=None, histograms=None, cutflows=None):
     all_data = {} # Hold data for each subdirectory in read_directory
 
     # Get all subdirectories name in the read_directory if not provided
@@ -300,34 +404,66 @@ def read_parquet(read_directory, subdirectory_names, fraction, parsed_variables,
 
         num_events = 0 # Get total number of events from all files this subdirectory
         for file in files:
-            pq_file = pq.ParquetFile(file)
             # Get the sum of weights in the file if 'totalWeight' column exists
-            if 'totalWeight' in pq_file.schema.names:
-                num_events += ak.sum(ak.from_parquet(file, columns=['totalWeight'])['totalWeight'])
+            if 'totalWeight' in read_schema_names(file):
+                num_events += sum_column(file, 'totalWeight')
             else: # If 'totalWeight' column doesn't exist, simply count number of events
-                num_events += pq_file.metadata.num_rows
+                num_events += read_metadata(file).num_rows
                 
         max_num_events = num_events * fraction
 
-        # Update sample key with fraction, create valid path by replacing decimal point
-        sample_key = f'{sample_key} x{fraction}'
-        sample_key = sample_key.replace('.', '_')
+        # Update sample key with fraction
+        sample_key = directory_sample_key(sample_key, fraction)
         
         if write_parquet:
             sample_out_dir = f'{output_directory}/{sample_key}'
             os.makedirs(sample_out_dir)
+            # One writer per sample: row groups are appended as they are produced
+            sample_writer = open_sample_writer(sample_out_dir, row_group_size, max_rows_per_file)
         else:
-            sample_out_dir = None
+            sample_writer = None
+
+        # Histograms and cutflow to fill for this sample
+        sample_hists, cutflow = None, None
+        if bookings is not None:
+            sample_hists = histograms[sample_key] = make_sample_histograms(bookings, sample_key)
+            cutflow = cutflows[sample_key] = new_cutflow()
 
         # Process data file by file 
-        all_data[sample_key] = concatenate_chunks(files, parsed_variables, cut_function,
-                                                  write_parquet, sample_out_dir, max_num_events, return_output)
+        try:
+            all_data[sample_key] = concatenate_chunks(files, parsed_variables, cut_function,
+                                                      write_parquet, sample_writer, max_num_events, return_output,
+                                                      sampling, seed, range_query, bookings, sample_hists, cutflow)
+        except BaseException:
+            abort_sample_writer(sample_writer) # Don't leave the output file open
+            raise
+        if write_parquet and cluster_by is not None:
+            # Sort the written events by cluster_by and record its min/max for each row group
+            compact_sample(sample_out_dir, row_group_size, max_rows_per_file, sort_by=cluster_by)
         
     if return_output:
         return all_data
 # End of read_parquet() function
         
 
+# Validate range_query = (key, lower, upper) of analysis_parquet()
+def validate_range_query(range_query):
+    if (not isinstance(range_query, (list, tuple)) or len(range_query) != 3
+        or not isinstance(range_query[0], str)
+        or not all(isinstance(value, (int, float)) for value in range_query[1:])):
+        raise TypeError(f'range_query must be a tuple (key, lower, upper). Got {range_query}')
+    if range_query[2] <= range_query[1]:
+        raise ValueError(f'The upper edge of range_query must be greater than the lower edge. Got {range_query}')
+
+# Whether decoded columns are kept in the in-memory column cache during analysis_parquet()
+# It only helps when the same columns are read again, e.g. exploring a fraction of the data with repeated
+# calls, so by default it is used for fraction < 1 with return_output=True, and bypassed when streaming
+# the full dataset or with return_output=False
+def column_cache_enabled(column_cache, fraction, return_output):
+    if column_cache is None:
+        return fraction < 1 and return_output
+    return bool(column_cache)
+
 # User call this function to read a fraction of data from parquet files
 # accessed by string_code_list or read_directory.
 # Can apply selection cut; can write the data to disk; can avoid storing data in memory
@@ -339,7 +475,19 @@ def analysis_parquet(read_variables, # Read these variables from the files
                      cut_function=None, # A callable that accepts an argument and return it
                      write_parquet=False, # Set to True to write data to parquet files
                      output_directory=None, # Specify the parquet file output location
-                     return_output=True # Set to False to not store data in memory (not return the data)
+                     return_output=True, # Set to False to not store data in memory (not return the data)
+                     cache_directory=None, # Directory of the on-disk Arrow cache for decoded columns, used for this call only
+                                           # (use enable_arrow_cache() to enable it for all calls)
+                     histograms=None, # List of histograms booked with book_histogram()/book_histogram_2d() to fill
+                     sampling='sequential', # How row groups are selected for fraction < 1: 'sequential', 'random' or 'exact'
+                     seed=None, # Random seed for sampling='random' or 'exact'
+                     row_group_size=DEFAULT_ROW_GROUP_SIZE, # Number of events per row group in the output files
+                     max_rows_per_file=DEFAULT_ROWS_PER_FILE, # Number of events per output file
+                     cluster_by=None, # Sort the output files by this key (e.g. 'mass') and record its min/max per row group
+                     range_query=None, # (key, lower, upper) to only read events with lower <= key < upper
+                     skim=None, # Only use the string code(s) from this skim of the partitioned parquet directory
+                     column_cache=None # Keep decoded columns in the in-memory column cache: True, False or None
+                                       # (default: only for fraction < 1 with return_output=True)
                     ):
     if string_code_list is None and read_directory is None:
         raise ValueError('Either string_code_list or read_directory must be provided.')
@@ -347,8 +495,25 @@ def analysis_parquet(read_variables, # Read these variables from the files
     if isinstance(read_variables, str):
         raise TypeError(f'read_variables must be a list. Got a string: {read_variables}')
 
+    if sampling not in VALID_SAMPLING:
+        raise ValueError(f'Invalid sampling: {sampling}. Valid options are: {VALID_SAMPLING}')
+
+    # Validate the booked histograms
+    bookings = validate_bookings(histograms) if histograms is not None else None
+    filled_histograms = {} # Hold the histograms of each sample
+    cutflows = {} # Hold the cutflow of each sample
+
+    # Validate range_query
+    if range_query is not None:
+        validate_range_query(range_query)
+
     time_start = time.time()
 
+    # Store decoded columns in (and memory-map them from) the on-disk cache during this call
+    previous_arrow_cache = arrow_cache_info()
+    if cache_directory is not None:
+        enable_arrow_cache(cache_directory)
+
     # Parse input variales in read_variables
     parsed_variables = np.zeros((0, 3))
     for input_var in read_variables:
@@ -364,17 +529,75 @@ def analysis_parquet(read_variables, # Read these variables from the files
         print(f'Write data to output_directory: {output_directory}')
 
     # Access data using string_code_list or read_directory by calling analysis_pq() or read_parquet()
-    if string_code_list:
-        print('Input string_code_list found. Data samples will be accessed by the string code(s).')
-        all_data = analysis_pq(string_code_list, fraction, parsed_variables, cut_function, write_parquet, output_directory, return_output)
-    elif read_directory:
-        print(f'Input read_directory found. Data will be read from {read_directory}.')
-        all_data = read_parquet(read_directory, subdirectory_names, fraction, parsed_variables, cut_function, write_parquet, output_directory, return_output)
-    # else statement handled at the start of function
+    previous_column_cache = use_column_cache(column_cache_enabled(column_cache, fraction, return_output))
+    try:
+        if string_code_list:
+            print('Input string_code_list found. Data samples will be accessed by the string code(s).')
+            all_data = analysis_pq(string_code_list, fraction, parsed_variables, cut_function, write_parquet, output_directory, return_output,
+                                   sampling, seed, row_group_size, max_rows_per_file, range_query, cluster_by, skim,
+                                   bookings, filled_histograms, cutflows)
+        elif read_directory:
+            print(f'Input read_directory found. Data will be read from {read_directory}.')
+            all_data = read_parquet(read_directory, subdirectory_names, fraction, parsed_variables, cut_function, write_parquet, output_directory, return_output,
+                                    sampling, seed, row_group_size, max_rows_per_file, range_query, cluster_by,
+                                    bookings, filled_histograms, cutflows)
+        # else statement handled at the start of function
+    finally:
+        # cache_directory and column_cache only apply to this call
+        restore_arrow_cache(previous_arrow_cache)
+        use_column_cache(previous_column_cache)
         
     elapsed_time = time.time() - time_start 
     print("Elapsed time = " + str(round(elapsed_time, 1)) + "s") # Print the time elapsed
     
+    # Return the filled histograms and the cutflow of each sample if histograms are booked
+    if bookings is not None:
+        if return_output:
+            return all_data, filled_histograms, cutflows
+        return filled_histograms, cutflows
     if return_output:
         return all_data
 # End of analysis_parquet() function
+
+
+# User call this function to fill the on-disk Arrow cache for string_code_list ahead of time,
+# so that later calls of analysis_parquet only memory-map the decoded columns.
+# If read_variables is None, all columns are cached
+def warm_arrow_cache(string_code_list, # A list of string codes
+                     read_variables=None, # Column names to cache
+                     cache_directory=None, # Directory of the on-disk cache, used for this call only (if not already enabled)
+                     limit=DEFAULT_ARROW_CACHE_LIMIT, # Size limit of the cache in bytes
+                     compression='lz4' # 'lz4' or 'uncompressed'
+                    ):
+    if isinstance(read_variables, str):
+        raise TypeError(f'read_variables must be a list. Got a string: {read_variables}')
+    previous_arrow_cache = arrow_cache_info()
+    if cache_directory is not None:
+        enable_arrow_cache(cache_directory, limit, compression)
+    elif previous_arrow_cache['directory'] is None:
+        raise ValueError('The on-disk cache is not enabled. Provide cache_directory.')
+
+    time_start = time.time()
+    previous_column_cache = use_column_cache(False) # Every column is only read once
+    try:
+        for str_code in string_code_list:
+            _, files = get_str_code_files(str(str_code))
+            for file in files:
+                all_columns = read_schema_names(file)
+                if read_variables is None:
+                    columns = all_columns
+                else: # Cache the base variables, e.g. 'lep_pt' for 'lep_pt[0]'
+                    columns = [var.split('[')[0] for var in read_variables]
+                    columns = [column for column in columns if column in all_columns]
+                for group in range(read_metadata(file).num_row_groups):
+                    read_row_group(file, columns, group)
+            print(f'Cached {len(files)} file(s) for the string code {str_code}')
+        cache_info = arrow_cache_info()
+    finally:
+        restore_arrow_cache(previous_arrow_cache)
+        use_column_cache(previous_column_cache)
+
+    elapsed_time = time.time() - time_start
+    print("Elapsed time = " + str(round(elapsed_time, 1)) + "s") # Print the time elapsed
+    return cache_info
+# End of warm_arrow_cache() function
@@ -0,0 +1,423 @@
+import os
+import glob
+import time
+import pyarrow as pa
+from .DataSetsMagic import DIDS_DICT
+from .ColumnCache import read_metadata, read_schema_names, sum_column, column_cache_info
+from .RangeIndex import parse_key
+from .HistogramBooking import validate_bookings
+from .EventWeights import validate_weight_variations
+from .AnalysisParquet import (VALID_SAMPLING, count_num_events, plan_row_groups, get_str_code_files,
+                              string_code_sample_key, directory_sample_key, validate_range_query, column_cache_enabled)
+from .AnalysisUproot import (get_samples_magic, string_code_dids, local_file_path, validate_read_variables,
+                             remove_duplicated_entry)
+
+# The planners estimate what analysis_parquet() / analysis_uproot() would read from the file metadata only
+# (parquet footers, TTree branch and basket sizes, the catalogue and DIDS_DICT): no event data is read,
+# except the 'totalWeight' column of the parquet files with exact=True (see plan_analysis_parquet())
+
+# Rough throughputs used to estimate the time taken (override with read_rate / network_rate)
+PARQUET_READ_RATE = 250e6 # Bytes of decoded columns per second (measured on the ZSTD parquet files, one core)
+UPROOT_READ_RATE = 50e6 # Bytes of decompressed branches per second
+NETWORK_RATE = 10e6 # Bytes per second downloaded or streamed from the open data portal
+# Memory size of a chunk read by tree.iterate() in analysis_uproot() (default step_size)
+UPROOT_STEP_BYTES = 100e6
+# The recommended chunk size is the number of events whose decoded columns take TARGET_CHUNK_BYTES
+TARGET_CHUNK_BYTES = 128 * 1024**2 # 128 MiB
+MIN_CHUNK_SIZE = 10_000
+# Memory budget used if the available memory of the machine can't be found
+DEFAULT_MEMORY_BUDGET = 4 * 1024**3 # 4 GiB
+
+# This function returns the memory available to the process in bytes (DEFAULT_MEMORY_BUDGET if unknown)
+def available_memory():
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (ValueError, OSError, AttributeError):
+        return DEFAULT_MEMORY_BUDGET
+
+# Format a number of bytes for the printed plan
+def format_bytes(num_bytes):
+    if num_bytes >= 1e9:
+        return f'{num_bytes / 1e9:.2f} GB'
+    return f'{num_bytes / 1e6:.1f} MB'
+
+# Format the row groups read from a file, e.g. [(0, None), (1, None), (2, None), (5, 1234)] gives '0-2, 5[:1234]'
+def format_row_groups(row_groups):
+    parts = []
+    first = last = None
+    for group, stop in row_groups + [(None, None)]:
+        if group is not None and stop is None and last is not None and group == last + 1:
+            last = group
+            continue
+        if first is not None:
+            parts.append(str(first) if first == last else f'{first}-{last}')
+            first = last = None
+        if group is None:
+            break
+        if stop is None:
+            first = last = group
+        else: # Only the first stop events of this row group are read
+            parts.append(f'{group}[:{stop}]')
+    return ', '.join(parts)
+
+# This function returns a new sample entry of a plan
+def new_sample_plan(**description):
+    return dict(description, files={}, columns={}, num_events=0,
+                compressed_bytes=0, decoded_bytes=0, max_chunk_bytes=0)
+
+# Add the sizes {column : [compressed bytes, decoded bytes]} of one chunk (row group or file) to a sample entry
+def add_chunk_sizes(sample_plan, sizes):
+    chunk_bytes = 0
+    for column, (compressed_bytes, decoded_bytes) in sizes.items():
+        size = sample_plan['columns'].setdefault(column, [0, 0])
+        size[0] += compressed_bytes
+        size[1] += decoded_bytes
+        sample_plan['compressed_bytes'] += compressed_bytes
+        sample_plan['decoded_bytes'] += decoded_bytes
+        chunk_bytes += decoded_bytes
+    sample_plan['max_chunk_bytes'] = max(sample_plan['max_chunk_bytes'], chunk_bytes)
+
+# This function returns the size of a column of num_rows events and num_values values once decoded
+# as an Awkward Array: the values and the offsets of each list (64-bit for large_list, 32-bit for list)
+# Returns None for values that aren't fixed-width (e.g. strings or records)
+def decoded_column_bytes(arrow_type, num_rows, num_values):
+    num_bytes = 0
+    num_lists = num_rows # Number of lists at this depth (approximated by num_values below the first)
+    while pa.types.is_list(arrow_type) or pa.types.is_large_list(arrow_type):
+        num_bytes += (num_lists + 1) * (8 if pa.types.is_large_list(arrow_type) else 4)
+        num_lists = num_values
+        arrow_type = arrow_type.value_type
+    if pa.types.is_boolean(arrow_type): # Decoded as one byte per value
+        return num_bytes + num_values
+    try:
+        return num_bytes + num_values * arrow_type.bit_width // 8
+    except ValueError:
+        return None
+
+# This function returns {column : [compressed bytes, decoded bytes]} of one row group of a parquet file
+# for the given columns, from its footer. Nested columns (e.g. 'lep_pt.list.element') count towards
+# their top-level column. The encoded size is used for columns whose decoded size isn't known
+def row_group_sizes(file, group, columns):
+    metadata = read_metadata(file)
+    schema = metadata.schema.to_arrow_schema()
+    row_group = metadata.row_group(group)
+    sizes = {}
+    for i in range(row_group.num_columns):
+        column_chunk = row_group.column(i)
+        column = column_chunk.path_in_schema.split('.')[0]
+        if column in columns:
+            decoded_bytes = decoded_column_bytes(schema.field(column).type, row_group.num_rows,
+                                                 column_chunk.num_values)
+            size = sizes.setdefault(column, [0, 0])
+            size[0] += column_chunk.total_compressed_size
+            size[1] += decoded_bytes if decoded_bytes is not None else column_chunk.total_uncompressed_size
+    return sizes
+
+# This function returns the weight of a row group as its number of events, so that plan_row_groups()
+# selects row groups from the footers only (used instead of row_group_weight() if exact is False)
+def row_group_rows(file, group):
+    return read_metadata(file).row_group(group).num_rows, None
+
+# This function returns the number of events / sum of weights of parquet files (as read_parquet())
+def files_num_events(files):
+    num_events = 0
+    for file in files:
+        if 'totalWeight' in read_schema_names(file):
+            num_events += sum_column(file, 'totalWeight')
+        else:
+            num_events += read_metadata(file).num_rows
+    return num_events
+
+# This function returns the columns analysis_parquet() reads from the parquet files: the base variables
+# of read_variables, 'totalWeight', the variables of the booked histograms and the key of range_query
+# (columns not found in a file, e.g. fields computed in cut_function, are not read)
+def parquet_columns(read_variables, bookings=None, range_query=None):
+    columns = [parse_key(variable)[0] for variable in read_variables] + ['totalWeight']
+    if bookings is not None:
+        columns += [parse_key(variable)[0] for booking in bookings for variable in booking['variables']]
+    if range_query is not None:
+        columns.append(parse_key(range_query[0])[0])
+    return list(dict.fromkeys(columns))
+
+# This function plans the reading of the parquet files of one sample with plan_row_groups()
+# max_num_events is the number of events / sum of weights to read, or None to apply fraction
+# to the number of events in the footers
+def plan_parquet_sample(sample_plan, files, fraction, columns, sampling, seed, range_query, max_num_events=None):
+    if max_num_events is None:
+        max_num_events = sum(read_metadata(file).num_rows for file in files) * fraction
+        plan = plan_row_groups(files, max_num_events, sampling, seed, range_query, group_weight=row_group_rows)
+    else:
+        plan = plan_row_groups(files, max_num_events, sampling, seed, range_query)
+
+    sample_plan['num_row_groups'] = sum(read_metadata(file).num_row_groups for file in files)
+    for file, group, stop in plan:
+        num_rows = read_metadata(file).row_group(group).num_rows
+        num_events = num_rows if stop is None else min(stop, num_rows)
+        file_plan = sample_plan['files'].setdefault(file, {'row_groups' : [], 'num_events' : 0})
+        file_plan['row_groups'].append((group, stop))
+        file_plan['num_events'] += num_events
+        sample_plan['num_events'] += num_events
+        # The whole row group is decoded, even if only the first stop events are kept
+        add_chunk_sizes(sample_plan, row_group_sizes(file, group, columns))
+    return sample_plan
+
+# This function adds the totals, the estimates of memory and time and the recommended chunk size and number
+# of workers to a plan. kept_bytes is the size of the data returned (0 if return_output is False)
+def estimate_plan(plan, kept_bytes, extra_seconds, memory_budget, read_rate):
+    samples = plan['samples'].values()
+    for total in ['num_events', 'compressed_bytes', 'decoded_bytes']:
+        plan[total] = sum(sample_plan[total] for sample_plan in samples)
+    plan['num_files'] = sum(len(sample_plan['files']) for sample_plan in samples)
+    max_chunk_bytes = max([sample_plan['max_chunk_bytes'] for sample_plan in samples], default=0)
+
+    # Peak memory: the largest chunk, the decoded columns kept by the column cache (parquet, if used) and
+    # the data returned, held twice when the chunks are concatenated. Events removed by cut_function
+    # are not known, so this is an upper bound
+    cache_bytes = min(plan['decoded_bytes'], column_cache_info()['limit']) if plan['arguments'].get('column_cache') else 0
+    plan['memory_bytes'] = max_chunk_bytes + cache_bytes + 2 * kept_bytes
+    plan['memory_budget'] = memory_budget
+    plan['time'] = plan['decoded_bytes'] / read_rate + extra_seconds
+
+    # Chunk size: number of events with TARGET_CHUNK_BYTES of decoded columns
+    bytes_per_event = plan['decoded_bytes'] / max(plan['num_events'], 1)
+    chunk_size = MIN_CHUNK_SIZE
+    if plan['num_events']:
+        chunk_size = min(max(MIN_CHUNK_SIZE, int(TARGET_CHUNK_BYTES / max(bytes_per_event, 1))), plan['num_events'])
+    plan['chunk_size'] = chunk_size
+
+    # Workers (e.g. processes each given a share of the files): each holds about two chunks at a time,
+    # on top of the data returned. No more workers than cores or files
+    worker_bytes = max(2 * chunk_size * bytes_per_event, 1)
+    num_workers = int((memory_budget - 2 * kept_bytes) // worker_bytes)
+    plan['num_workers'] = max(1, min(num_workers, os.cpu_count() or 1, max(plan['num_files'], 1)))
+
+    if plan['memory_bytes'] > memory_budget:
+        plan['warnings'].append(f"The estimated memory ({format_bytes(plan['memory_bytes'])}) is larger than "
+                                f'the memory budget ({format_bytes(memory_budget)}). Use a smaller fraction, '
+                                'or return_output=False with write_parquet=True or booked histograms.')
+    return plan
+
+# This function prints a plan, listing the files, row groups (or entries) and columns read
+def print_plan(plan):
+    arguments = ', '.join(f'{key}={value!r}' for key, value in plan['arguments'].items())
+    print(f"Plan of {plan['function']}({arguments})")
+    for sample_key, sample_plan in plan['samples'].items():
+        description = ', '.join(f'{key}: {value}' for key, value in sample_plan.items()
+                                if key in ['string_codes', 'dids', 'source'])
+        print(f"Sample '{sample_key}' ({description})")
+        for file, file_plan in sample_plan['files'].items():
+            if 'row_groups' in file_plan:
+                print(f"\t{file} : row group(s) {format_row_groups(file_plan['row_groups'])}"
+                      f" - {file_plan['num_events']:,} events")
+            else:
+                print(f"\t{file} ({file_plan['source']}) : entries 0 to {file_plan['num_events']:,}"
+                      f" of {file_plan['num_entries']:,} - {file_plan['num_baskets']} basket(s)")
+        if sample_plan['columns']:
+            columns = ', '.join(f'{column} {format_bytes(size[0])} ({format_bytes(size[1])} decoded)'
+                                for column, size in sample_plan['columns'].items())
+            print(f'\tcolumns : {columns}')
+        row_groups = (f", {sum(len(f['row_groups']) for f in sample_plan['files'].values())} of "
+                      f"{sample_plan['num_row_groups']} row group(s)") if 'num_row_groups' in sample_plan else ''
+        print(f"\ttotal : {len(sample_plan['files'])} file(s){row_groups}, {sample_plan['num_events']:,} events, "
+              f"{format_bytes(sample_plan['compressed_bytes'])} read, {format_bytes(sample_plan['decoded_bytes'])} decoded")
+
+    print(f"Total : {plan['num_files']} file(s), {plan['num_events']:,} events, "
+          f"{format_bytes(plan['compressed_bytes'])} read, {format_bytes(plan['decoded_bytes'])} decoded")
+    print(f"Estimated peak memory : {format_bytes(plan['memory_bytes'])} (budget {format_bytes(plan['memory_budget'])})")
+    print(f"Estimated time : {plan['time']:.1f}s with one worker")
+    print(f"Recommended : chunk size {plan['chunk_size']:,} events, {plan['num_workers']} worker(s)")
+    for note in plan['notes']:
+        print(f'Note : {note}')
+    for warning in plan['warnings']:
+        print(f'Warning : {warning}')
+
+# User call this function to see what analysis_parquet() would read, without reading event data
+# Takes the same arguments as analysis_parquet() (those that change what is read) and returns a plan
+# dict {'samples' : {sample key : {'files' : {file : {'row_groups' : [(group, stop)], 'num_events'}},
+# 'columns' : {column : [compressed bytes, decoded bytes]}, ...}}, 'num_events', 'compressed_bytes',
+# 'decoded_bytes', 'memory_bytes', 'time', 'chunk_size', 'num_workers', ...}
+# If fraction < 1, the row groups are selected with fraction applied to the number of events in the footers.
+# Set exact=True to select them from the sum of weights as analysis_parquet() does (only the 'totalWeight'
+# column is read, and it is kept in the column cache for analysis_parquet())
+# The recommended chunk size can be used as row_group_size to write the data
+def plan_analysis_parquet(read_variables, # Read these variables from the files
+                          string_code_list=None, # A list of string codes
+                          read_directory=None, # Directory to read data from
+                          subdirectory_names=None, # Subdirectory names to read from
+                          fraction=1, # Fraction of data to read
+                          return_output=True, # Whether the data is returned (kept in memory)
+                          histograms=None, # List of booked histograms to fill
+                          sampling='sequential', # 'sequential', 'random' or 'exact', as in analysis_parquet()
+                          seed=None, # Random seed for sampling='random' or 'exact'
+                          range_query=None, # (key, lower, upper) to only read events with lower <= key < upper
+                          skim=None, # Only use the string code(s) from this skim of the partitioned parquet directory
+                          column_cache=None, # Whether the column cache is used, as in analysis_parquet()
+                          exact=False, # Set to True to select the row groups from the sum of weights
+                          memory_budget=None, # Memory available in bytes (default: available memory)
+                          read_rate=PARQUET_READ_RATE, # Bytes of decoded columns per second
+                          verbose=True # Set to False to not print the plan
+                         ):
+    if string_code_list is None and read_directory is None:
+        raise ValueError('Either string_code_list or read_directory must be provided.')
+    if isinstance(read_variables, str):
+        raise TypeError(f'read_variables must be a list. Got a string: {read_variables}')
+    if sampling not in VALID_SAMPLING:
+        raise ValueError(f'Invalid sampling: {sampling}. Valid options are: {VALID_SAMPLING}')
+    if range_query is not None:
+        validate_range_query(range_query)
+    bookings = validate_bookings(histograms) if histograms is not None else None
+    memory_budget = memory_budget if memory_budget is not None else available_memory()
+
+    time_start = time.time()
+    columns = parquet_columns(read_variables, bookings, range_query)
+    plan = {'function' : 'analysis_parquet',
+            'arguments' : {'fraction' : fraction, 'sampling' : sampling, 'skim' : skim, 'range_query' : range_query,
+                           'column_cache' : column_cache_enabled(column_cache, fraction, return_output)},
+            'samples' : {}, 'notes' : [], 'warnings' : []}
+    all_files = []
+    if string_code_list:
+        for str_code in string_code_list:
+            str_code = str(str_code)
+            physics_processes, files = get_str_code_files(str_code, skim)
+            max_num_events = None
+            if exact: # Sum of weights, as analysis_parquet()
+                max_num_events = sum(count_num_events(i, skim) for i in physics_processes) * fraction
+            sample_plan = new_sample_plan(string_codes=physics_processes,
+                                          dids=[did for i in physics_processes for did in DIDS_DICT.get(i, [])])
+            plan['samples'][string_code_sample_key(str_code, fraction)] = plan_parquet_sample(
+                sample_plan, files, fraction, columns, sampling, seed, range_query, max_num_events)
+            all_files.extend(files)
+    else:
+        if subdirectory_names is None:
+            subdirectory_names = [name for name in os.listdir(read_directory)
+                                  if os.path.isdir(os.path.join(read_directory, name))]
+        for name in subdirectory_names:
+            sample_directory = f'{read_directory}/{name}'
+            if not os.path.isdir(sample_directory):
+                raise FileNotFoundError(f"Folder '{sample_directory}' does not exist")
+            files = sorted(glob.glob(f'{sample_directory}/*.parquet'))
+            max_num_events = files_num_events(files) * fraction if exact else None
+            plan['samples'][directory_sample_key(name, fraction)] = plan_parquet_sample(
+                new_sample_plan(), files, fraction, columns, sampling, seed, range_query, max_num_events)
+            all_files.extend(files)
+
+    # Variables of read_variables not found in any file (analysis_parquet() would raise an error)
+    found = set(column for file in all_files for column in read_schema_names(file))
+    missing = [variable for variable in read_variables if parse_key(variable)[0] not in found]
+    if missing:
+        plan['warnings'].append(f'Variable(s) {missing} not found in the parquet files.')
+    if fraction < 1 and not exact:
+        plan['notes'].append('Row groups selected with fraction applied to the number of events. '
+                             'Set exact=True to use the sum of weights (reads the totalWeight column only).')
+    if range_query is not None:
+        plan['notes'].append('Only row groups that may hold events in range_query are listed; '
+                             'the number of events is counted before range_query and cut_function.')
+
+    # The data returned holds the read_variables columns and 'totalWeight'
+    kept_columns = parquet_columns(read_variables)
+    kept_bytes = sum(size[1] for sample_plan in plan['samples'].values()
+                     for column, size in sample_plan['columns'].items() if column in kept_columns) if return_output else 0
+    estimate_plan(plan, kept_bytes, 0, memory_budget, read_rate)
+    plan['planning_time'] = time.time() - time_start
+    if verbose:
+        print_plan(plan)
+    return plan
+
+# This function plans the reading of one sample file by analysis_uproot() from the sizes of the baskets
+# of its branches (TTree metadata). Returns (file plan, {branch : [compressed bytes, decoded bytes]},
+# branches not found, number of bytes downloaded)
+def plan_uproot_file(path, source, fraction, read_var):
+    import uproot # Optional dependency, only needed to plan analysis_uproot()
+    tree = uproot.open(path + ": analysis") # Only the TTree metadata is read
+    entry_stop = tree.num_entries * fraction # As in process_sample()
+    sizes = {}
+    missing = []
+    num_baskets = 0
+    for variable in read_var:
+        if variable not in tree:
+            missing.append(variable)
+            continue
+        branch = tree[variable]
+        # Baskets holding entries before entry_stop
+        baskets = [i for i in range(branch.num_baskets) if branch.entry_offsets[i] < entry_stop]
+        sizes[variable] = [sum(branch.basket_compressed_bytes(i) for i in baskets),
+                           sum(branch.basket_uncompressed_bytes(i) for i in baskets)]
+        num_baskets += len(baskets)
+    # The whole file is downloaded before it is read
+    download_bytes = sum(branch.compressed_bytes for branch in tree.branches) if source == 'download' else 0
+    file_plan = {'source' : source, 'num_entries' : tree.num_entries,
+                 'num_events' : min(int(entry_stop), tree.num_entries), 'num_baskets' : num_baskets}
+    return file_plan, sizes, missing, download_bytes
+
+# User call this function to see what analysis_uproot() would read, without reading event data
+# Takes the same arguments as analysis_uproot() (those that change what is read) and returns a plan
+# dict as plan_analysis_parquet(), with the source of each file ('local', 'download' or 'stream')
+# The sample files are listed by atlasopenmagic from DIDS_DICT and only the TTree metadata of each file
+# is read (remote files are not downloaded). The recommended chunk size can be used as step_size
+def plan_analysis_uproot(skim, # Skim for the dataset
+                         string_code_dict, # A dict which value is a string code
+                         fraction, # Fraction of data to be read from database
+                         read_variables, # Variables to read from database
+                         save_variables, # Variables to save in memory or to Parquet files
+                         local_files=True, # Access local sample files. Set to False to stream the files
+                         sample_path='../backend/datasets', # Path to access or download the local files to
+                         return_output=True, # Whether the data is returned (kept in memory)
+                         weight_variations=None, # Weight variations computed with totalWeight for MC
+                         memory_budget=None, # Memory available in bytes (default: available memory)
+                         read_rate=UPROOT_READ_RATE, # Bytes of decompressed branches per second
+                         network_rate=NETWORK_RATE, # Bytes per second downloaded or streamed
+                         verbose=True # Set to False to not print the plan
+                        ):
+    if weight_variations is not None:
+        validate_weight_variations(weight_variations, skim)
+    memory_budget = memory_budget if memory_budget is not None else available_memory()
+
+    time_start = time.time()
+    samples = get_samples_magic(skim, string_code_dict, local_files) or {}
+    data_read_variables, mc_read_variables = validate_read_variables(samples, read_variables, skim, weight_variations)
+    save_variables = remove_duplicated_entry(save_variables)
+
+    plan = {'function' : 'analysis_uproot',
+            'arguments' : {'skim' : skim, 'fraction' : fraction, 'local_files' : local_files},
+            'samples' : {}, 'notes' : [], 'warnings' : []}
+    missing = set()
+    network_bytes = 0
+    kept_bytes = 0
+    for sample_key, value in samples.items():
+        is_Data = 'Data' in sample_key
+        read_var = data_read_variables if is_Data else mc_read_variables
+        sample_plan = plan['samples'][sample_key] = new_sample_plan(dids=string_code_dids(string_code_dict[sample_key]))
+        for url in value['list']:
+            # Open remote files without caching them (only the metadata is read)
+            if url.startswith("simplecache::"):
+                url = url.split("simplecache::", 1)[1]
+            _, file_path = local_file_path(url, skim, sample_path)
+            if local_files and os.path.exists(file_path):
+                path, source = file_path, 'local'
+            else:
+                path, source = url, 'download' if local_files else 'stream'
+            file_plan, sizes, file_missing, download_bytes = plan_uproot_file(path, source, fraction, read_var)
+            sample_plan['files'][path] = file_plan
+            sample_plan['num_events'] += file_plan['num_events']
+            missing.update(file_missing)
+            # A chunk of tree.iterate() holds up to UPROOT_STEP_BYTES of the file
+            add_chunk_sizes(sample_plan, sizes)
+            sample_plan['max_chunk_bytes'] = min(sample_plan['max_chunk_bytes'], UPROOT_STEP_BYTES)
+            network_bytes += download_bytes
+            if source == 'stream':
+                network_bytes += sum(size[0] for size in sizes.values())
+            if return_output:
+                # Variables saved, and the weights computed for MC (totalWeight and each variation)
+                kept_bytes += sum(size[1] for variable, size in sizes.items() if variable in save_variables)
+                if not is_Data:
+                    kept_bytes += 8 * file_plan['num_events'] * (1 + (len(weight_variations) if weight_variations else 0))
+
+    if missing:
+        plan['warnings'].append(f'Variable(s) {sorted(missing)} not found in the sample files.')
+    if network_bytes:
+        plan['notes'].append(f'{format_bytes(network_bytes)} to be downloaded or streamed.')
+    estimate_plan(plan, kept_bytes, network_bytes / network_rate, memory_budget, read_rate)
+    plan['planning_time'] = time.time() - time_start
+    if verbose:
+        print_plan(plan)
+    return plan
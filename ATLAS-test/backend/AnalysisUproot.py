@@ -1,16 +1,39 @@
-import atlasopenmagic as atom
 import os
-import requests
 import re
-import uproot
 import time
 import awkward as ak # for handling complex and nested data structures efficiently
 import datetime
 from zoneinfo import ZoneInfo
-from .EventWeights import WEIGHT_VAR, calculate_weight
-atom.set_release('2025e-13tev-beta')
+from .EventWeights import (WEIGHT_VAR, VARIATION_FIELD, NOMINAL, calculate_weight, calculate_weight_variations,
+                           validate_weight_variations, variation_variables)
+from .HistogramBooking import validate_bookings, make_sample_histograms, new_cutflow, update_cutflow, fill_chunk
 from .DataSetsMagic import VALID_SKIMS, DIDS_DICT
 
+OPEN_DATA_RELEASE = '2025e-13tev-beta'
+_release_state = {'set': False}
+
+# atlasopenmagic, requests and uproot are only imported when analysis_uproot() needs them, so the rest of
+# the backend (parquet analysis, plotting) can be used without them
+# This function imports atlasopenmagic and sets the open data release on first use
+def open_data_magic():
+    import atlasopenmagic as atom
+    if not _release_state['set']:
+        atom.set_release(OPEN_DATA_RELEASE)
+        _release_state['set'] = True
+    return atom
+
+# This function returns the folder and the path of the local copy of a sample file (url) in sample_path
+def local_file_path(url, skim, sample_path):
+    # Remove the parent directory path to only get the filename
+    fileString = url.split("/")[-1]
+
+    # MC and real data are kept in separate folders
+    if 'mc' in fileString:
+        folder = f'{sample_path}/{skim}/MC'
+    else:
+        folder = f'{sample_path}/{skim}/Data'
+    return folder, f'{folder}/{fileString}'
+
 # This function accesses data from local sample files. If not found in sample_path, downloads them
 # This function returns a dict (Key: samples' key, Value: corresponding filepath list)
 def validate_files(samples, skim, sample_path):
@@ -20,20 +43,13 @@ def validate_files(samples, skim, sample_path):
         # value is made using atom.build_dataset, so it is a dict where a key is 'list' and its value
         # is a list of url
         for val in value['list']: 
-            # Remove the parent directory path to only get the filename
-            fileString = val.split("/")[-1]
-
             # Validate / Download to the correct folder
-            if 'mc' in fileString:
-                folder = f'{sample_path}/{skim}/MC'
-            else:
-                folder = f'{sample_path}/{skim}/Data'
+            folder, file_path = local_file_path(val, skim, sample_path)
+            fileString = file_path.split("/")[-1]
 
             # Make directory
             os.makedirs(folder, exist_ok=True)
             
-            file_path = f'{folder}/{fileString}'
-            
             # Download the file if file_path not found
             if os.path.exists(file_path):
                 print(f"File {fileString} already exists in {folder}. Skipping download.")
@@ -44,6 +60,7 @@ def validate_files(samples, skim, sample_path):
                 if val.startswith("simplecache::"):
                     val = val.split("simplecache::", 1)[1]
                     
+                import requests
                 with requests.get(val, stream=True) as r:
                     r.raise_for_status()
                     with open(file_path, "wb") as f:
@@ -56,6 +73,26 @@ def validate_files(samples, skim, sample_path):
     return filepath_dict
 # End of validate_files() function
 
+# This function returns the dataset ids of a value of string_code_dict (['data'] for real data)
+# e.g. 'Zee + ttbar' gives the dids of 'Zee' then 'ttbar' in DIDS_DICT
+def string_code_dids(string_codes):
+    if 'Data' in string_codes:
+        return ["data"]
+    # Split the input string that uses '+' to combine the string code of
+    # different physics processes. Strip / remove any white spaces
+    physics_processes = [string_code.strip() for string_code in string_codes.split('+')] 
+    # string_codes = 'H+ZZllll+ttbar'
+    # e.g. physics_processes = ['H','ZZllll','ttbar']
+
+    dataset_id_list = [] # Hold the dataset ids
+
+    for i in physics_processes:
+        if i in DIDS_DICT:    
+            dataset_id_list.extend(DIDS_DICT[i])
+        else:
+            raise ValueError(f'The string code: {i} was not found.')
+    return dataset_id_list
+
 # This function builds a dict where keys are string_code_dict's keys and values are urls of sample files
 # Those urls can be used to download or access local files via validate_files(), or can be used
 # directly by tree.open(url + ': analysis') to stream the files
@@ -77,24 +114,7 @@ def get_samples_magic(skim, string_code_dict, local_files):
             if not isinstance(string_codes, str):
                 raise TypeError('The value of the input string_code_dict must be a str.')
             
-            if 'Data' in string_codes:
-                samples_defs[key] = {'dids': ["data"]} 
-            else:    
-                # Split the input string that uses '+' to combine the string code of
-                # different physics processes. Strip / remove any white spaces
-                physics_processes = [string_code.strip() for string_code in string_codes.split('+')] 
-                # string_codes = 'H+ZZllll+ttbar'
-                # e.g. physics_processes = ['H','ZZllll','ttbar']
-
-                dataset_id_list = [] # Hold the dataset ids
-
-                for i in physics_processes:
-                    if i in DIDS_DICT:    
-                        dataset_id_list.extend(DIDS_DICT[i])
-                    else:
-                        raise ValueError(f'The string code: {i} was not found.')
-
-                samples_defs[key] = {'dids': dataset_id_list}
+            samples_defs[key] = {'dids': string_code_dids(string_codes)}
 
         # If the list returned by atom.build_dataset is the same as atom.get_urls for each key,
         # then there's no need for the if-else statement here. 
@@ -111,6 +131,7 @@ def get_samples_magic(skim, string_code_dict, local_files):
         #             url_list = atom.get_urls(did, skim, protocol='https', cache=True)
         #             samples[key].extend(url_list)
         
+        atom = open_data_magic()
         samples = atom.build_dataset(samples_defs, skim=skim, protocol='https', cache=True)
         return samples
 # End of get_samples_magic() function
@@ -123,10 +144,13 @@ def calc_sum_of_weights(data):
         return len(data)
 
 # Process the data accessed by the filepath/url list for one key in string_code_dict
+# Can fill booked histograms (sample_hists) and a cutflow with the events passing the selection cut
+# For MC, the weight of each variation in weight_variations is computed with the nominal weight
 def process_sample(fraction, luminosity, skim, cut_function, sample_key, 
                    filepath_list, read_variables, save_variables, 
                    write_txt, txt_filename, write_parquet, output_directory, 
-                   return_output):
+                   return_output, bookings=None, sample_hists=None, cutflow=None, weight_variations=None,
+                   step_size='100 MB'):
     
     is_Data = 'Data' in sample_key
 
@@ -143,6 +167,7 @@ def process_sample(fraction, luminosity, skim, cut_function, sample_key,
         print(f"\t{filestring} :") 
         
         # Open file
+        import uproot
         tree = uproot.open(filestring + ": analysis")
 
         # Store data for all chunks in this filestring to be concatenated at the end of filestring loop
@@ -155,6 +180,7 @@ def process_sample(fraction, luminosity, skim, cut_function, sample_key,
         # Loop over data in the tree - each data is a dictionary of Awkward Arrays
         for data in tree.iterate(read_variables, # Read these variables
                                  library="ak", # Return data as awkward arrays
+                                 step_size=step_size, # Number of entries or memory size of each chunk
                                  # Process up to a fraction of total number of events
                                  entry_stop=tree.num_entries * fraction):
 
@@ -172,12 +198,25 @@ def process_sample(fraction, luminosity, skim, cut_function, sample_key,
                     
             # Skip to next chunk if no data       
             if len(data) == 0:
+                if bookings is not None:
+                    update_cutflow(cutflow, number_of_events_before, data)
                 continue
 
             # Store Monte Carlo weights
             if 'Data' not in sample_key:
-                # Use calculate_weight function from EventWeights.py
-                data['totalWeight'] = calculate_weight(data, luminosity, skim)
+                if weight_variations:
+                    # Nominal weight and the weight of each variation in one pass
+                    variation_weights = calculate_weight_variations(data, luminosity, skim, weight_variations)
+                    data['totalWeight'] = variation_weights[NOMINAL]
+                    data[VARIATION_FIELD] = variation_weights
+                else:
+                    # Use calculate_weight function from EventWeights.py
+                    data['totalWeight'] = calculate_weight(data, luminosity, skim)
+
+            # Fill the booked histograms and the cutflow (before removing the fields not saved)
+            if bookings is not None:
+                update_cutflow(cutflow, number_of_events_before, data)
+                fill_chunk(bookings, data, sample_hists)
 
             # Update keep_fields with derived field (computed in cut_function)
             for field in data.fields:
@@ -248,7 +287,8 @@ def remove_duplicated_entry(variable_list):
     
 # Validate input variables to be read from tree
 # Update the variable list with weight-related variables for MC
-def validate_read_variables(samples, read_variables, skim):
+# (and the variables used by the weight variations, if any)
+def validate_read_variables(samples, read_variables, skim, weight_variations=None):
     # Check if real data and MC are present
     has_Data = any('Data' in key for key in samples)
     has_mc = any('Data' not in key for key in samples)
@@ -260,6 +300,8 @@ def validate_read_variables(samples, read_variables, skim):
     # For MC, weight variables (defined by WEIGHT_VAR in EventWeights) and sum of 
     # weights need to be read too
     mc_read_variables = validated + WEIGHT_VAR[skim] + ["sum_of_weights"] if has_mc else None
+    if has_mc and weight_variations:
+        mc_read_variables = remove_duplicated_entry(mc_read_variables + variation_variables(weight_variations))
 
     return data_read_variables, mc_read_variables
 
@@ -284,11 +326,24 @@ def analysis_uproot(skim, # Skim for the dataset.
                     output_directory=None, # Output directory to write Parquet files to
                     write_txt=False, # Set to True to write a summary log in a txt file
                     txt_filename=None, # Filename to write summary log to
-                    return_output=True # Set to False to avoid storing data in memory
+                    return_output=True, # Set to False to avoid storing data in memory
+                    histograms=None, # List of histograms booked with book_histogram()/book_histogram_2d() to fill
+                    weight_variations=None, # Weight variations computed with totalWeight for MC, saved as
+                                            # 'weightVariations' (see calculate_weight_variations() in EventWeights)
+                    step_size='100 MB' # Number of entries (e.g. the chunk size recommended by plan_analysis_uproot())
+                                       # or memory size of each chunk read from the files
                    ):
     
     time_start = time.time()
 
+    if weight_variations is not None:
+        validate_weight_variations(weight_variations, skim)
+
+    # Validate the booked histograms. Their variables must be in read_variables or computed in cut_function
+    bookings = validate_bookings(histograms) if histograms is not None else None
+    filled_histograms = {} # Hold the histograms of each sample
+    cutflows = {} # Hold the cutflow of each sample
+
     # Get filepath list if local_files, else get url list for each key
     samples = get_samples_magic(skim, string_code_dict, local_files)
     if local_files:
@@ -300,6 +355,8 @@ def analysis_uproot(skim, # Skim for the dataset.
         samples = {key : value['list'] for key, value in samples.items()}
    
     if not samples:
+        if bookings is not None:
+            return ({}, {}, {}) if return_output else ({}, {})
         return {} # Empty samples - no analysis needed
 
     now = datetime.datetime.now(ZoneInfo("Europe/London"))
@@ -339,7 +396,7 @@ def analysis_uproot(skim, # Skim for the dataset.
     all_data = {}
     
     # Remove duplicated entry in read_variables and save_variables
-    data_read_variables, mc_read_variables = validate_read_variables(samples, read_variables, skim)
+    data_read_variables, mc_read_variables = validate_read_variables(samples, read_variables, skim, weight_variations)
     save_variables = remove_duplicated_entry(save_variables)
     
     # Loop over samples
@@ -356,8 +413,15 @@ def analysis_uproot(skim, # Skim for the dataset.
         # Print which sample is being processed
         print(f'Processing "{sample_key}" samples') 
 
+        # Histograms and cutflow to fill for this sample
+        sample_hists, cutflow = None, None
+        if bookings is not None:
+            sample_hists = filled_histograms[sample_key] = make_sample_histograms(bookings, sample_key)
+            cutflow = cutflows[sample_key] = new_cutflow()
+
         # Process data file by file
-        sample_data = process_sample(fraction, luminosity, skim, cut_function, sample_key, filepath_list, read_var, save_variables, write_txt, txt_filename, write_parquet, output_directory, return_output)
+        sample_data = process_sample(fraction, luminosity, skim, cut_function, sample_key, filepath_list, read_var, save_variables, write_txt, txt_filename, write_parquet, output_directory, return_output,
+                                     bookings, sample_hists, cutflow, weight_variations, step_size)
 
         if return_output:
             if sample_data: 
@@ -372,6 +436,11 @@ def analysis_uproot(skim, # Skim for the dataset.
     time_elapsed = time.time() - time_start
     print(f'\n\nElapsed time: {round(time_elapsed, 1)}s')
     
+    # Return the filled histograms and the cutflow of each sample if histograms are booked
+    if bookings is not None:
+        if return_output:
+            return all_data, filled_histograms, cutflows
+        return filled_histograms, cutflows
     if return_output:
         return all_data
 # End of analysis_uproot() function
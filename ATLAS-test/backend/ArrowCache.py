@@ -0,0 +1,118 @@
+import os
+import glob
+import hashlib
+import shutil
+import awkward as ak
+import pyarrow.feather as feather
+
+# Default size limit of the on-disk cache (20 GiB)
+DEFAULT_ARROW_CACHE_LIMIT = 20 * 1024**3
+VALID_COMPRESSION = ['lz4', 'uncompressed']
+
+# State of the opt-in on-disk cache. Decoded columns are stored as Arrow IPC (Feather v2)
+# files in <directory>/<source fingerprint>/rg<row group>_<column>.arrow
+_arrow_cache = {'directory' : None, 'limit' : DEFAULT_ARROW_CACHE_LIMIT,
+                'compression' : 'lz4', 'bytes' : 0,
+                'hits' : 0, 'misses' : 0, 'evictions' : 0}
+
+# This function returns a fingerprint of a source parquet file
+# The file size and mtime are included so that a rewritten file gets a new fingerprint
+def source_fingerprint(path, mtime):
+    size = os.path.getsize(path)
+    return hashlib.sha1(f'{path}:{size}:{mtime}'.encode()).hexdigest()[:20]
+
+# This function returns the path of the cache file for one column of one row group
+def cache_filename(path, mtime, row_group, column):
+    return f"{_arrow_cache['directory']}/{source_fingerprint(path, mtime)}/rg{row_group}_{column}.arrow"
+
+# This function returns all cache files sorted from the least to the most recently used
+def list_cache_files():
+    files = glob.glob(f"{_arrow_cache['directory']}/*/*.arrow")
+    return sorted(files, key=os.path.getmtime)
+
+# Delete least recently used cache files until the cache fits in the size limit
+def evict_arrow_cache():
+    if _arrow_cache['bytes'] <= _arrow_cache['limit']:
+        return
+    for file in list_cache_files():
+        if _arrow_cache['bytes'] <= _arrow_cache['limit']:
+            break
+        _arrow_cache['bytes'] -= os.path.getsize(file)
+        os.remove(file)
+        _arrow_cache['evictions'] += 1
+    # Remove fingerprint folders left empty
+    for folder in glob.glob(f"{_arrow_cache['directory']}/*/"):
+        if not os.listdir(folder):
+            os.rmdir(folder)
+
+# This function loads columns of one row group from the on-disk cache
+# Returns a dict (Key: column, Value: Awkward Array) holding the columns found in the cache
+def load_cached_columns(path, mtime, row_group, columns):
+    found = {}
+    if _arrow_cache['directory'] is None: # Cache not enabled
+        return found
+    for column in columns:
+        filename = cache_filename(path, mtime, row_group, column)
+        if not os.path.exists(filename):
+            _arrow_cache['misses'] += 1
+            continue
+        # Memory-map the file instead of reading it into memory
+        table = feather.read_table(filename, memory_map=True)
+        found[column] = ak.from_arrow(table)[column]
+        os.utime(filename) # Mark as most recently used for eviction
+        _arrow_cache['hits'] += 1
+    return found
+
+# This function stores the columns of an Arrow table (one row group of a source file) in the on-disk cache
+def store_cached_columns(path, mtime, row_group, table):
+    if _arrow_cache['directory'] is None: # Cache not enabled
+        return
+    for column in table.column_names:
+        filename = cache_filename(path, mtime, row_group, column)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        # Write to a temporary file then rename, so that a crashed write or another
+        # process never sees a partial file
+        tmp_filename = f'{filename}.tmp{os.getpid()}'
+        feather.write_feather(table.select([column]), tmp_filename,
+                              compression=_arrow_cache['compression'])
+        os.replace(tmp_filename, filename)
+        _arrow_cache['bytes'] += os.path.getsize(filename)
+    evict_arrow_cache()
+
+# Enable the on-disk cache. Decoded columns read by analysis_parquet are stored in directory
+# and memory-mapped on later reads (also in later sessions). Stays enabled for all calls until disable_arrow_cache()
+# compression: 'lz4' (smaller files) or 'uncompressed' (zero-copy memory-mapping)
+def enable_arrow_cache(directory, limit=DEFAULT_ARROW_CACHE_LIMIT, compression='lz4'):
+    if compression not in VALID_COMPRESSION:
+        raise ValueError(f'Invalid compression: {compression}. Valid options are: {VALID_COMPRESSION}')
+    if not isinstance(limit, int) or limit < 0:
+        raise ValueError(f'limit must be a non-negative int (number of bytes). Got {limit}')
+    os.makedirs(directory, exist_ok=True)
+    _arrow_cache.update(directory=str(directory), limit=limit, compression=compression)
+    # Get the current size of the cache (it may have been filled in an earlier session)
+    _arrow_cache['bytes'] = sum(os.path.getsize(file) for file in list_cache_files())
+    evict_arrow_cache()
+
+# Disable the on-disk cache. Files already written are kept
+def disable_arrow_cache():
+    _arrow_cache['directory'] = None
+
+# Return the cache settings and counters as a dict
+def arrow_cache_info():
+    return dict(_arrow_cache)
+
+# Set the on-disk cache back to the settings in info (returned by arrow_cache_info() earlier)
+# Used by the functions that enable the cache for one call only
+def restore_arrow_cache(info):
+    if info['directory'] is None:
+        disable_arrow_cache()
+    elif any(info[key] != _arrow_cache[key] for key in ['directory', 'limit', 'compression']):
+        enable_arrow_cache(info['directory'], info['limit'], info['compression'])
+
+# Delete all files in the on-disk cache
+def clear_arrow_cache():
+    if _arrow_cache['directory'] is None:
+        return
+    for folder in glob.glob(f"{_arrow_cache['directory']}/*/"):
+        shutil.rmtree(folder)
+    _arrow_cache.update(bytes=0, hits=0, misses=0, evictions=0)
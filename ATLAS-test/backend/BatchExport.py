@@ -0,0 +1,187 @@
+import os
+import re
+import json
+import time
+import warnings
+import traceback
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import awkward as ak
+import hist
+import matplotlib.pyplot as plt
+from .PlotHistogram import (plot_stacked_hist, plot_histograms, histogram_2d, sample_histogram,
+                            fill_histogram_2d, validate_num_bins, validate_xmin_xmax)
+from .PlotErrorBar import plot_errorbars
+from .MaskedFill import fill_masked
+
+# Plotting functions that can be used in a plot spec
+PLOT_FUNCTIONS = {'plot_stacked_hist' : plot_stacked_hist,
+                  'plot_histograms' : plot_histograms,
+                  'histogram_2d' : histogram_2d,
+                  'plot_errorbars' : plot_errorbars}
+VALID_FORMATS = ['png', 'pdf', 'svg']
+# Name of the manifest written in the output directory
+MANIFEST_FILE = 'manifest.json'
+
+# A plot spec is a dict with
+# 'name' : file name of the plot, without extension (unique within a batch)
+# 'function' : one of PLOT_FUNCTIONS
+# 'kwargs' : dict of keyword arguments of the function (e.g. data_dict, plot_variable, color_list, ...)
+# Example: {'name' : 'mass', 'function' : 'plot_stacked_hist',
+#           'kwargs' : {'data_dict' : data, 'plot_variable' : 'mass', 'color_list' : ['k', 'r'],
+#                       'num_bins' : 50, 'xmin' : 100, 'xmax' : 160, 'x_label' : 'mass [GeV]'}}
+def validate_plot_specs(plot_specs, formats):
+    if not isinstance(plot_specs, (list, tuple)) or not all(isinstance(spec, dict) for spec in plot_specs):
+        raise TypeError('plot_specs must be a list of dicts.')
+    names = []
+    for spec in plot_specs:
+        if set(spec) != {'name', 'function', 'kwargs'}:
+            raise ValueError(f"Expect each plot spec to have the keys ['name', 'function', 'kwargs']. Got {list(spec)}")
+        if spec['function'] not in PLOT_FUNCTIONS:
+            raise ValueError(f"Invalid function '{spec['function']}'. Valid function: {list(PLOT_FUNCTIONS)}")
+        if not isinstance(spec['kwargs'], dict):
+            raise TypeError(f"Plot spec '{spec['name']}' : kwargs must be a dict.")
+        names.append(file_stem(spec['name']))
+    duplicated = {name for name in names if names.count(name) > 1}
+    if duplicated:
+        raise ValueError(f'Plot spec names must be unique. Got duplicated name(s): {sorted(duplicated)}')
+    if isinstance(formats, str):
+        raise TypeError("formats must be a list of str, e.g. ['png', 'pdf'].")
+    for file_format in formats:
+        if file_format not in VALID_FORMATS:
+            raise ValueError(f"Invalid format '{file_format}'. Valid format: {VALID_FORMATS}")
+
+# Return a name that can be used as a file name
+def file_stem(name):
+    return re.sub(r'[^\w.-]+', '_', str(name))
+
+# This function returns the histograms of the samples of a data_dict for some variables
+# {sample key : {variable : Hist}}. Samples already holding filled Hist objects are rebinned if needed
+def prefill_data_dict(data_dict, variables, num_bins_list, xmin_xmax_list):
+    if not isinstance(data_dict, dict):
+        raise TypeError('data_dict must be a dict.')
+    prefilled = {}
+    for key, value in data_dict.items():
+        if isinstance(value, dict):
+            valid_var = list(value.keys())
+        elif isinstance(value, ak.Array):
+            valid_var = value.fields
+        else:
+            raise TypeError(f'Key "{key}" : Unexpected type of dict value. Expect dict or Awkward Array.')
+        prefilled[key] = {variable : sample_histogram(key, value, variable, valid_var, xmin, xmax, num_bins)
+                          for variable, num_bins, (xmin, xmax) in zip(variables, num_bins_list, xmin_xmax_list)}
+    return prefilled
+
+# This function returns a copy of a plot spec in which the event arrays are replaced by filled
+# histograms, so that only histograms are sent to the worker processes
+def prefill_spec(spec):
+    kwargs = dict(spec['kwargs'])
+    function = spec['function']
+    if function == 'plot_stacked_hist':
+        kwargs['data_dict'] = prefill_data_dict(kwargs['data_dict'], [kwargs['plot_variable']],
+                                                [kwargs['num_bins']], [(kwargs['xmin'], kwargs['xmax'])])
+    elif function == 'plot_histograms':
+        variables = kwargs['plot_variables']
+        if not isinstance(variables, (list, tuple)):
+            variables = [variables]
+        num_bins_list = validate_num_bins(kwargs['num_bins_list'], len(variables))
+        xmin_xmax_list = validate_xmin_xmax(kwargs['xmin_xmax_list'], len(variables))
+        kwargs['data_dict'] = prefill_data_dict(kwargs['data_dict'], variables, num_bins_list, xmin_xmax_list)
+    elif function == 'histogram_2d':
+        if not isinstance(kwargs['data'], hist.Hist):
+            h, label_x, label_y = fill_histogram_2d(kwargs['data'], kwargs.get('num_bins'),
+                                                    kwargs.get('min_max'), kwargs.get('label'),
+                                                    kwargs.pop('weight', None), kwargs.pop('histogram', None))
+            kwargs.update(data=h, label=[label_x, label_y])
+            kwargs.pop('num_bins', None)
+            kwargs.pop('min_max', None)
+    elif function == 'plot_errorbars':
+        data_dict = {}
+        for key, value in kwargs['data_dict'].items():
+            value = dict(value)
+            if not isinstance(value.get('array'), hist.Hist):
+                # Fill in the same way as plt_errorbar()
+                h = hist.Hist.new.Reg(kwargs['num_bins'], kwargs['xmin'], kwargs['xmax'], name=key)
+                h = h.Weight() if value.get('weight') is not None else h.Double()
+                fill_masked(h, value['array'], value.get('weight'))
+                value.update(array=h, weight=None)
+            data_dict[key] = value
+        kwargs['data_dict'] = data_dict
+    return {'name' : spec['name'], 'function' : function, 'kwargs' : kwargs}
+
+# Set the Agg backend in a worker process, so that no display is needed
+def init_worker():
+    plt.switch_backend('Agg')
+
+# This function renders one plot spec and saves its figure(s) in output_directory
+# Returns the manifest entry of the spec. An error is recorded in the entry instead of stopping the batch
+def render_spec(spec, output_directory, formats, dpi):
+    time_start = time.time()
+    entry = {'name' : spec['name'], 'function' : spec['function'], 'files' : [], 'error' : None}
+    try:
+        with warnings.catch_warnings():
+            # plt.show() warns that the Agg backend is non-interactive
+            warnings.filterwarnings('ignore', message='.*non-interactive.*')
+            output = PLOT_FUNCTIONS[spec['function']](**spec['kwargs'])
+        figures = output[0] if isinstance(output[0], list) else [output[0]]
+        stem = file_stem(spec['name'])
+        if spec['function'] == 'plot_histograms' and len(figures) > 1:
+            variables = spec['kwargs']['plot_variables']
+            stems = [f'{stem}_{file_stem(variable)}' for variable in variables]
+        else:
+            stems = [stem]
+        for fig, fig_stem in zip(figures, stems):
+            for file_format in formats:
+                filename = os.path.join(output_directory, f'{fig_stem}.{file_format}')
+                fig.savefig(filename, dpi=dpi)
+                entry['files'].append(os.path.basename(filename))
+            plt.close(fig)
+    except Exception:
+        entry['error'] = traceback.format_exc()
+    entry['elapsed'] = round(time.time() - time_start, 3)
+    return entry
+
+# User call this function to render many plots without a display and save them as files
+# plot_specs is a list of plot specs (see validate_plot_specs()). Event arrays in the specs are
+# filled into histograms in this process first, then the figures are drawn on the Agg backend by
+# num_workers processes, so only histograms are sent to the workers. plt.show() is not called
+# Files are written to output_directory as <name>.<format> (<name>_<variable>.<format> for each
+# variable of plot_histograms()), with a manifest.json that lists the files and errors of each spec
+# Returns the manifest
+def export_plots(plot_specs, # See above
+                 output_directory, # Folder for the plots and the manifest
+                 formats=('png',), # File formats, from VALID_FORMATS
+                 dpi=200, # Resolution of raster formats
+                 num_workers=4 # Number of worker processes
+                ):
+    validate_plot_specs(plot_specs, formats)
+    if not isinstance(num_workers, int) or num_workers < 1:
+        raise ValueError(f'num_workers must be a positive int. Got {num_workers}')
+    os.makedirs(output_directory, exist_ok=True)
+
+    time_start = time.time()
+    specs = [prefill_spec(spec) for spec in plot_specs]
+
+    # Fork where available so that the workers don't import the notebook's modules again
+    if 'fork' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('fork')
+    else:
+        context = multiprocessing.get_context()
+    with ProcessPoolExecutor(max_workers=min(num_workers, len(specs)) or 1,
+                             mp_context=context, initializer=init_worker) as executor:
+        futures = [executor.submit(render_spec, spec, output_directory, list(formats), dpi) for spec in specs]
+        entries = [future.result() for future in futures]
+
+    manifest = {'created' : time.strftime('%Y-%m-%d %H:%M:%S'),
+                'output_directory' : os.path.abspath(output_directory),
+                'formats' : list(formats),
+                'plots' : entries}
+    with open(os.path.join(output_directory, MANIFEST_FILE), 'w') as f:
+        json.dump(manifest, f, indent=1)
+
+    num_failed = sum(entry['error'] is not None for entry in entries)
+    if num_failed:
+        print(f'{num_failed} of {len(entries)} plot(s) failed. See the errors in {MANIFEST_FILE}')
+    elapsed_time = time.time() - time_start
+    print("Elapsed time = " + str(round(elapsed_time, 1)) + "s") # Print the time elapsed
+    return manifest
@@ -0,0 +1,399 @@
+import io
+import time
+import contextlib
+import numpy as np
+import hist
+
+VALID_COST = ['chi2', 'poisson']
+# A fit is failed if a parameter moves from its initial value by more than this factor times
+# max(|initial value|, 1), e.g. a Gaussian centre sent to 1e83 to switch the peak off
+RUNAWAY_FACTOR = 1e6
+SQRT_2PI = np.sqrt(2 * np.pi)
+
+# A model component is a dict with
+# 'params' : list of parameter names
+# 'function' : function(x, *params) returning the model values, where x has shape (num_bins,) and
+#              each parameter has shape (num_fits, 1), so that all fits are evaluated at once
+# 'gradient' : function(x, *params) returning the derivative of the model with respect to each parameter
+# 'bounds' : {parameter : (lower, upper)} for the parameters that must stay in a range
+# 'lmfit' : (name of the lmfit model, keyword arguments) of the same shape, or None (used by benchmark_fit())
+# Parameter names and conventions follow lmfit (e.g. the amplitude of a Gaussian is its area)
+
+# Polynomial c0 + c1 x + ... + c_degree x^degree
+def polynomial(degree, prefix=''):
+    if not isinstance(degree, int) or degree < 0:
+        raise ValueError(f'degree must be a non-negative int. Got {degree}')
+    def function(x, *c):
+        return sum(c[i] * x**i for i in range(degree + 1))
+    def gradient(x, *c):
+        return [np.broadcast_to(x**i, np.broadcast_shapes(c[0].shape, x.shape)) for i in range(degree + 1)]
+    return {'params' : [f'{prefix}c{i}' for i in range(degree + 1)],
+            'function' : function, 'gradient' : gradient, 'bounds' : {},
+            'lmfit' : ('PolynomialModel', {'degree' : degree, 'prefix' : prefix})}
+
+# Gaussian amplitude / (sigma sqrt(2 pi)) * exp(-(x - center)^2 / (2 sigma^2))
+def gaussian(prefix=''):
+    def function(x, amplitude, center, sigma):
+        return amplitude / (sigma * SQRT_2PI) * np.exp(-0.5 * ((x - center) / sigma)**2)
+    def gradient(x, amplitude, center, sigma):
+        t = (x - center) / sigma
+        shape = np.exp(-0.5 * t**2) / (sigma * SQRT_2PI)
+        value = amplitude * shape
+        return [shape, value * t / sigma, value * (t**2 - 1) / sigma]
+    return {'params' : [f'{prefix}amplitude', f'{prefix}center', f'{prefix}sigma'],
+            'function' : function, 'gradient' : gradient,
+            'bounds' : {f'{prefix}sigma' : (0, np.inf)},
+            'lmfit' : ('GaussianModel', {'prefix' : prefix})}
+
+# Exponential amplitude * exp(-x / decay)
+def exponential(prefix=''):
+    def function(x, amplitude, decay):
+        return amplitude * np.exp(-x / decay)
+    def gradient(x, amplitude, decay):
+        shape = np.exp(-x / decay)
+        return [shape, amplitude * shape * x / decay**2]
+    return {'params' : [f'{prefix}amplitude', f'{prefix}decay'],
+            'function' : function, 'gradient' : gradient, 'bounds' : {},
+            'lmfit' : ('ExponentialModel', {'prefix' : prefix})}
+
+# Crystal Ball amplitude * f(t), t = (x - center) / sigma, with a Gaussian core
+# f(t) = exp(-t^2 / 2) for t > -alpha and a power-law tail
+# f(t) = (n / alpha)^n exp(-alpha^2 / 2) (n / alpha - alpha - t)^(-n) below it
+# amplitude is the height of the peak
+def crystal_ball(prefix=''):
+    def parts(x, center, sigma, alpha, n):
+        t = (x - center) / sigma
+        tail = t <= -alpha
+        b = n / alpha - alpha
+        # Use a safe value of (b - t) in the core, where the tail formula isn't used
+        b_minus_t = np.where(tail, b - t, 1.0)
+        log_tail = n * np.log(n / alpha) - 0.5 * alpha**2 - n * np.log(b_minus_t)
+        f = np.where(tail, np.exp(log_tail), np.exp(-0.5 * t**2))
+        return t, tail, b_minus_t, f
+    def function(x, amplitude, center, sigma, alpha, n):
+        return amplitude * parts(x, center, sigma, alpha, n)[3]
+    def gradient(x, amplitude, center, sigma, alpha, n):
+        t, tail, b_minus_t, f = parts(x, center, sigma, alpha, n)
+        value = amplitude * f
+        # d(log f)/dt, then the chain rule for center and sigma
+        dlog_dt = np.where(tail, n / b_minus_t, -t)
+        dlog_dalpha = np.where(tail, -n / alpha - alpha + n * (n / alpha**2 + 1) / b_minus_t, 0.0)
+        dlog_dn = np.where(tail, np.log(n / alpha) + 1 - np.log(b_minus_t) - n / (alpha * b_minus_t), 0.0)
+        return [np.broadcast_to(f, value.shape), value * dlog_dt * (-1 / sigma), value * dlog_dt * (-t / sigma),
+                value * dlog_dalpha, value * dlog_dn]
+    return {'params' : [f'{prefix}amplitude', f'{prefix}center', f'{prefix}sigma', f'{prefix}alpha', f'{prefix}n'],
+            'function' : function, 'gradient' : gradient,
+            'bounds' : {f'{prefix}sigma' : (0, np.inf), f'{prefix}alpha' : (0, np.inf), f'{prefix}n' : (1, np.inf)},
+            'lmfit' : None} # No Crystal Ball model in lmfit
+
+# User call this function to add model components, e.g. composite_model(polynomial(4), gaussian())
+# as PolynomialModel(4) + GaussianModel() in lmfit
+def composite_model(*components):
+    params = [param for component in components for param in component['params']]
+    duplicated = {param for param in params if params.count(param) > 1}
+    if duplicated:
+        raise ValueError(f'Parameter names must be unique. Got duplicated name(s): {sorted(duplicated)}. '
+                         'Set a prefix for the components.')
+    bounds = {}
+    for component in components:
+        bounds.update(component['bounds'])
+    return {'params' : params, 'components' : list(components), 'bounds' : bounds}
+
+# Return the components of a model (a component on its own is a model of one component)
+def model_components(model):
+    return model.get('components', [model])
+
+# This function evaluates a model for each set of parameters
+# params has shape (num_fits, num_params) in the order of model['params']; returns (num_fits, num_bins)
+def evaluate_model(model, x, params):
+    values = 0
+    start = 0
+    for component in model_components(model):
+        num = len(component['params'])
+        values = values + component['function'](x, *(params[:, [i]] for i in range(start, start + num)))
+        start += num
+    return np.broadcast_to(values, (params.shape[0], len(x)))
+
+# This function returns the derivatives of a model, shape (num_fits, num_bins, num_params)
+def model_jacobian(model, x, params):
+    columns = []
+    start = 0
+    for component in model_components(model):
+        num = len(component['params'])
+        columns.extend(component['gradient'](x, *(params[:, [i]] for i in range(start, start + num))))
+        start += num
+    return np.stack([np.broadcast_to(column, (params.shape[0], len(x))) for column in columns], axis=-1)
+
+# This function returns the bin values (num_fits, num_bins), the variances (or None) and the bin centres
+# data can be a 1D Hist, a list of 1D Hist objects with the same binning, or a tuple
+# (value, variance, bin_centres) as returned by get_histogram(), where value may hold one row per fit
+def histogram_arrays(data):
+    if isinstance(data, hist.Hist):
+        data = [data]
+    if isinstance(data, (list, tuple)) and data and all(isinstance(h, hist.Hist) for h in data):
+        if any(len(h.axes) != 1 for h in data):
+            raise ValueError('Expect 1D histograms.')
+        edges = data[0].axes[0].edges
+        if any(len(h.axes[0].edges) != len(edges) or not np.allclose(h.axes[0].edges, edges) for h in data):
+            raise ValueError('All histograms must have the same binning.')
+        values = np.stack([h.values(flow=False) for h in data])
+        variances = [h.variances(flow=False) for h in data]
+        variances = np.stack(variances) if all(v is not None for v in variances) else None
+        return values, variances, data[0].axes[0].centers
+    if isinstance(data, tuple) and len(data) == 3:
+        value, variance, bin_centres = data
+        values = np.atleast_2d(np.asarray(value, dtype=float))
+        variances = np.broadcast_to(np.asarray(variance, dtype=float), values.shape) if variance is not None else None
+        return values, variances, np.asarray(bin_centres, dtype=float)
+    raise TypeError('data must be a Hist, a list of Hist objects or a tuple (value, variance, bin_centres).')
+
+# This function returns the cost of each fit and the terms of the damped Gauss-Newton step
+# chi2 : sum of ((y - model) / sigma)^2 over bins with a non-zero variance
+# poisson : 2 * sum of (model - y + y log(y / model)), the Poisson deviance (Baker-Cousins)
+# The step solves (A + lambda diag(A)) delta = b, with A = J^T W J and b the descent direction
+def cost_terms(cost, y, weights, model_values, jacobian):
+    if cost == 'chi2':
+        residual = (y - model_values) * weights
+        chi2 = np.sum(weights * (y - model_values)**2, axis=1)
+        jw = jacobian * weights[..., None]
+        return chi2, np.einsum('kbp,kb->kp', jacobian, residual), np.einsum('kbp,kbq->kpq', jw, jacobian)
+    # Poisson
+    with np.errstate(divide='ignore', invalid='ignore'):
+        safe = np.where(model_values > 0, model_values, np.nan)
+        log_term = np.where(y > 0, y * np.log(y / safe), 0.0)
+        deviance = 2 * np.sum(safe - y + log_term, axis=1)
+        inverse = np.where(model_values > 0, 1 / safe, 0.0)
+    deviance = np.where(np.isnan(deviance), np.inf, deviance) # Model <= 0 somewhere
+    b = np.einsum('kbp,kb->kp', jacobian, y * inverse - 1)
+    a = np.einsum('kbp,kbq->kpq', jacobian * (inverse * weights)[..., None], jacobian)
+    return deviance, b, a
+
+# Solve a stack of linear systems, using the pseudo-inverse if some are singular
+def solve_stack(a, b):
+    try:
+        return np.linalg.solve(a, b[..., None])[..., 0]
+    except np.linalg.LinAlgError:
+        return np.einsum('kpq,kq->kp', np.linalg.pinv(a), b)
+
+# Invert a stack of matrices, scaled by their diagonal as in damped_step()
+def inverse_stack(a):
+    diagonal = np.einsum('kpp->kp', a)
+    scale = np.where(diagonal > 0, np.sqrt(np.abs(diagonal)), 1.0)
+    a_scaled = a / (scale[:, :, None] * scale[:, None, :])
+    try:
+        inverse = np.linalg.inv(a_scaled)
+    except np.linalg.LinAlgError:
+        inverse = np.linalg.pinv(a_scaled)
+    with np.errstate(over='ignore', invalid='ignore'): # Fits that ran away
+        return inverse / (scale[:, :, None] * scale[:, None, :])
+
+# This function returns the Levenberg-Marquardt step of each fit, solving (A + damping diag(A)) step = b
+# The system is scaled by the diagonal of A first: parameters of very different sizes (e.g. c0 and c4
+# of a polynomial in mass) would otherwise make it too badly conditioned to solve
+# Fixed parameters (free is False) don't move
+def damped_step(a, b, damping, free):
+    diagonal = np.einsum('kpp->kp', a)
+    scale = np.where(free & (diagonal > 0), np.sqrt(np.abs(diagonal)), 1.0)
+    # Scaled A has 1 on the diagonal (or 0 if a parameter has no effect), damped to 1 + damping
+    a_scaled = a * np.outer(free, free) / (scale[:, :, None] * scale[:, None, :])
+    index = np.arange(len(free))
+    a_scaled[:, index, index] = 1 + damping[:, None]
+    step = solve_stack(a_scaled, np.where(free, b, 0.0) / scale)
+    return np.where(free, step / scale, 0.0)
+
+# User call this function to fit a model to one or many histograms at once
+# All fits are done together: each iteration evaluates the model and its analytic derivatives for
+# every histogram in one array operation and takes one Levenberg-Marquardt step per fit
+# Returns a dict with, for each fit, the best-fit parameters and their uncertainties, the covariance,
+# the cost (chi2 or Poisson deviance), the number of degrees of freedom and the best-fit model values
+# 'converged' is False and 'failed' is True for fits that found no minimum, whose covariance is not
+# finite or whose parameters ran away (see RUNAWAY_FACTOR)
+# For a single histogram the values are numbers (and 1D arrays) instead of one entry per fit
+def fit_histograms(model, # Model made with polynomial(), gaussian(), ..., or composite_model()
+                   data, # A Hist, a list of Hist objects or (value, variance, bin_centres)
+                   initial, # Initial parameter values {name : number or array with one value per fit}
+                   cost='chi2', # 'chi2' or 'poisson' (for counts, e.g. Data histograms)
+                   fit_range=None, # (xmin, xmax) - only the bins with centres in this range are fitted
+                   fixed=None, # List of parameter names kept at their initial value
+                   bounds=None, # {name : (lower, upper)}, added to the bounds of the model
+                   max_iterations=200,
+                   tolerance=1e-8, # Stop when the relative change of the cost is smaller than this
+                   scale_covariance=True # Scale the chi2 covariance by chi2 / ndf, as lmfit does
+                  ):
+    if cost not in VALID_COST:
+        raise ValueError(f'Invalid cost "{cost}". Valid cost: {VALID_COST}')
+    single = isinstance(data, hist.Hist) or (isinstance(data, tuple) and np.ndim(data[0]) == 1)
+    values, variances, x = histogram_arrays(data)
+    num_fits = values.shape[0]
+    names = model['params']
+    missing = [name for name in names if name not in initial]
+    if missing:
+        raise ValueError(f'Initial values missing for parameter(s): {missing}')
+    fixed = set(fixed or [])
+    unknown = fixed.difference(names) | set(bounds or {}).difference(names)
+    if unknown:
+        raise ValueError(f'Unknown parameter(s): {sorted(unknown)}. Model parameters: {names}')
+
+    # Bins used in the fit and their weights
+    in_range = np.ones(len(x), dtype=bool)
+    if fit_range is not None:
+        in_range = (x >= fit_range[0]) & (x <= fit_range[1])
+    x = x[in_range]
+    y = values[:, in_range]
+    if cost == 'chi2':
+        # Use the variances if any, otherwise the counts (Poisson); bins with no variance are not used
+        var = variances[:, in_range] if variances is not None else y
+        with np.errstate(divide='ignore'):
+            weights = np.where(var > 0, 1 / var, 0.0)
+    else:
+        weights = np.ones_like(y)
+
+    all_bounds = dict(model['bounds'])
+    all_bounds.update(bounds or {})
+    lower = np.array([all_bounds.get(name, (-np.inf, np.inf))[0] for name in names], dtype=float)
+    upper = np.array([all_bounds.get(name, (-np.inf, np.inf))[1] for name in names], dtype=float)
+    params = np.column_stack([np.broadcast_to(np.asarray(initial[name], dtype=float), (num_fits,))
+                              for name in names])
+    outside = np.any((params <= lower) | (params >= upper), axis=0)
+    if outside.any():
+        raise ValueError(f'Initial values must be inside the bounds. Got {[n for n, o in zip(names, outside) if o]}')
+    free = np.array([name not in fixed for name in names])
+    initial_params = params.copy()
+
+    time_start = time.time()
+    damping = np.full(num_fits, 1e-3)
+    current, b, a = cost_terms(cost, y, weights, evaluate_model(model, x, params), model_jacobian(model, x, params))
+    converged = np.zeros(num_fits, dtype=bool)
+    failed = np.zeros(num_fits, dtype=bool)
+    iterations = np.zeros(num_fits, dtype=int)
+    for iteration in range(max_iterations):
+        # Only the fits still running are evaluated
+        active = np.flatnonzero(~(converged | failed))
+        if not len(active):
+            break
+        trial = params[active] + damped_step(a[active], b[active], damping[active], free)
+        # Steps that leave the bounds are rejected without evaluating the model
+        inside = np.all((trial > lower) & (trial < upper), axis=1)
+        trial, evaluated = trial[inside], active[inside]
+        trial_cost, trial_b, trial_a = cost_terms(cost, y[evaluated], weights[evaluated],
+                                                  evaluate_model(model, x, trial), model_jacobian(model, x, trial))
+        # Accept the steps that lower the cost, and reduce the damping for them
+        # Otherwise try again with a larger damping (a shorter step closer to the gradient)
+        lower_cost = np.isfinite(trial_cost) & (trial_cost <= current[evaluated])
+        accepted = evaluated[lower_cost]
+        change = current[accepted] - trial_cost[lower_cost]
+        params[accepted] = trial[lower_cost]
+        current[accepted] = trial_cost[lower_cost]
+        b[accepted], a[accepted] = trial_b[lower_cost], trial_a[lower_cost]
+        better = np.isin(active, accepted)
+        converged[accepted] = change <= tolerance * np.maximum(current[accepted], 1.0)
+        damping[active] = np.where(better, np.maximum(damping[active] / 10, 1e-15), damping[active] * 10)
+        iterations[active] += 1
+        # A fit whose damping becomes huge can't lower its cost any more
+        # It is at a minimum if the gradient is zero, otherwise the fit failed
+        stuck = active[damping[active] > 1e10]
+        gradient = np.abs(np.where(free, b[stuck], 0.0)) / np.sqrt(np.maximum(np.einsum('kpp->kp', a[stuck]), 1e-300))
+        converged[stuck] = np.all(gradient < 1e-6 * np.sqrt(np.maximum(current[stuck], 1.0))[:, None], axis=1)
+        failed[stuck] = ~converged[stuck]
+
+    # Covariance from the curvature of the cost at the minimum
+    ndf = np.count_nonzero(weights, axis=1) - np.count_nonzero(free)
+    a_free = a[:, free][:, :, free]
+    covariance = np.full((num_fits, len(names), len(names)), np.nan)
+    inverse = inverse_stack(a_free)
+    if cost == 'chi2' and scale_covariance:
+        inverse = inverse * (current / np.maximum(ndf, 1))[:, None, None]
+    covariance[:, free[:, None] & free[None, :]] = inverse.reshape(num_fits, -1)
+    variances = np.einsum('kpp->kp', covariance)
+    errors = np.sqrt(np.where(variances >= 0, variances, np.nan)) # NaN for fixed parameters
+
+    # A fit that stopped with a covariance that is not finite (or negative variances), or with a parameter
+    # that ran away from its initial value, found no usable minimum: it is failed, not converged
+    invalid_covariance = ~np.all(np.isfinite(inverse), axis=(1, 2)) | ~np.all(np.isfinite(errors[:, free]), axis=1)
+    runaway = np.any(np.abs(params - initial_params) > RUNAWAY_FACTOR * np.maximum(np.abs(initial_params), 1.0), axis=1)
+    failed |= invalid_covariance | runaway
+    converged &= ~failed
+
+    result = {'params' : {name : params[:, i] for i, name in enumerate(names)},
+              'errors' : {name : errors[:, i] for i, name in enumerate(names)},
+              'covariance' : covariance,
+              'cost' : current,
+              'ndf' : ndf,
+              'converged' : converged,
+              'failed' : failed,
+              'iterations' : iterations,
+              'bin_centres' : x,
+              'best_fit' : evaluate_model(model, x, params)}
+    if single: # One fit - numbers instead of arrays of one entry
+        result['params'] = {name : float(value[0]) for name, value in result['params'].items()}
+        result['errors'] = {name : float(value[0]) for name, value in result['errors'].items()}
+        for key in ('covariance', 'best_fit'):
+            result[key] = result[key][0]
+        for key in ('cost', 'ndf', 'converged', 'failed', 'iterations'):
+            result[key] = result[key][0].item()
+
+    elapsed_time = time.time() - time_start
+    print("Elapsed time = " + str(round(elapsed_time, 1)) + "s") # Print the time elapsed
+    return result
+
+# This function returns the equivalent lmfit model and parameters, or None if a component has no lmfit model
+def lmfit_model(model, initial, bounds):
+    import lmfit.models
+    lmfit_components = []
+    for component in model_components(model):
+        if component['lmfit'] is None:
+            return None
+        name, kwargs = component['lmfit']
+        lmfit_components.append(getattr(lmfit.models, name)(**kwargs))
+    combined = lmfit_components[0]
+    for component in lmfit_components[1:]:
+        combined = combined + component
+    parameters = combined.make_params(**{name : float(np.ravel(initial[name])[0]) for name in model['params']})
+    for name, (lower, upper) in bounds.items():
+        parameters[name].set(min=lower, max=upper)
+    return combined, parameters
+
+# User call this function to compare the time per fit of
+# - fit_histograms() on all histograms at once
+# - fit_histograms() on one histogram at a time
+# - lmfit (model.fit() with numerical derivatives, one histogram at a time, as in the notebooks), if installed
+# data and the other arguments are as for fit_histograms(), e.g. toy replicas of one histogram
+# Returns {method : time per fit in ms}
+def benchmark_fit(model, data, initial, cost='chi2', fit_range=None, max_single_fits=100):
+    values, variances, x = histogram_arrays(data)
+    num_fits = values.shape[0]
+    timings = {}
+    with contextlib.redirect_stdout(io.StringIO()): # Don't print the time of each fit
+        time_start = time.time()
+        batch = fit_histograms(model, (values, variances, x), initial, cost=cost, fit_range=fit_range)
+        timings['batch'] = (time.time() - time_start) / num_fits * 1000
+
+        num_single = min(num_fits, max_single_fits)
+        time_start = time.time()
+        for i in range(num_single):
+            fit_histograms(model, (values[i], None if variances is None else variances[i], x),
+                           {name : np.ravel(value)[i % np.size(value)] for name, value in initial.items()},
+                           cost=cost, fit_range=fit_range)
+        timings['single'] = (time.time() - time_start) / num_single * 1000
+
+    try:
+        lmfit_setup = lmfit_model(model, initial, model['bounds']) if cost == 'chi2' else None
+    except ImportError:
+        lmfit_setup = None
+        print('lmfit is not installed, skipping the lmfit benchmark.')
+    if lmfit_setup is not None:
+        combined, parameters = lmfit_setup
+        selected = np.ones(len(x), dtype=bool) if fit_range is None else (x >= fit_range[0]) & (x <= fit_range[1])
+        time_start = time.time()
+        for i in range(num_single):
+            y = values[i, selected]
+            var = y if variances is None else variances[i, selected]
+            weights = np.where(var > 0, 1 / np.sqrt(np.where(var > 0, var, 1)), 0.0)
+            combined.fit(y, parameters, x=x[selected], weights=weights)
+        timings['lmfit'] = (time.time() - time_start) / num_single * 1000
+
+    print(f'{num_fits} fit(s), {np.count_nonzero(batch["converged"])} converged, '
+          f'{np.count_nonzero(batch["failed"])} failed (no minimum, covariance not finite or runaway parameters)')
+    for method, milliseconds in timings.items():
+        print(f'{method} : {milliseconds:.3f} ms per fit')
+    return timings
@@ -0,0 +1,143 @@
+import time
+from math import exp, factorial
+import numpy as np
+import hist
+from .MaskedFill import value_blocks
+
+# Name of the replica axis of bootstrap histograms
+REPLICA_AXIS = 'replica'
+# The Poisson weights are drawn for RANDOM_EVENTS events and RANDOM_REPLICAS replicas at a time, each draw
+# from its own generator seeded with (seed, block of events, group of replicas). The weight of an event
+# in a replica therefore only depends on the seed and the position of the event, so the replicas of
+# histograms of different variables of the same events use the same weights (e.g. for a ratio), and
+# the memory used doesn't depend on the number of events or replicas
+RANDOM_EVENTS = 4096
+RANDOM_REPLICAS = 32
+
+# Number of bits of the uniform random numbers turned into Poisson(1) weights
+POISSON_BITS = 16
+
+# This function returns the table that turns a uniform random integer in [0, 2^bits) into a Poisson(1)
+# weight (inverse of the cumulative distribution). Looking up 16-bit random numbers is several times
+# faster than drawing Poisson numbers; the probabilities are exact to 2^-17 and the mean is exactly 1
+def poisson_table(bits=POISSON_BITS):
+    cdf = np.cumsum([exp(-1) / factorial(k) for k in range(20)])
+    return np.searchsorted(np.round(cdf * 2**bits), np.arange(2**bits), side='right').astype(np.uint8)
+
+_poisson_table = poisson_table()
+
+# This function returns the Poisson(1) weights of num_events events starting at block_index * RANDOM_EVENTS
+# for num_replicas replicas starting at group_index * RANDOM_REPLICAS, shape (num_replicas, num_events)
+# The raw 64-bit output of the generator is split into four 16-bit numbers, one row of RANDOM_EVENTS
+# numbers per replica, so the first replicas of a group are the same whatever num_replicas is
+def poisson_weights(seed, block_index, group_index, num_events, num_replicas):
+    bit_generator = np.random.PCG64([seed, block_index, group_index])
+    random = bit_generator.random_raw(num_replicas * RANDOM_EVENTS // 4).view(np.uint16)
+    return np.take(_poisson_table, random.reshape(num_replicas, RANDOM_EVENTS)[:, :num_events])
+
+# This function returns the index of the bin of each value in the flow view of an axis
+# and a mask of the values that are filled (values in a missing flow bin are dropped)
+def flow_index(axis, values):
+    index = np.asarray(axis.index(values))
+    underflow, overflow = axis.traits.underflow, axis.traits.overflow
+    filled = np.ones(len(index), dtype=bool)
+    if not underflow:
+        filled &= index >= 0
+    if not overflow:
+        filled &= index < len(axis)
+    return index + int(underflow), filled
+
+# User call this function to fill bootstrap replicas into a Hist whose axes are a variable axis and
+# a replica axis (see bootstrap_histogram()). Each event is filled in every replica with its weight
+# times a Poisson(1) weight, drawn from the seed as described above, all replicas in one pass over the
+# events. None values are counted in the overflow bin and None weights count as 0, as in fill_masked()
+def fill_bootstrap(h, values, weight=None, seed=0):
+    if len(h.axes) != 2 or h.axes[1].name != REPLICA_AXIS:
+        raise ValueError(f"Expect a Hist with a variable axis and a '{REPLICA_AXIS}' axis. Use bootstrap_histogram().")
+    if weight is not None and len(weight) != len(values):
+        raise ValueError(f'weight has to have the same length as values. Got {len(weight)} and {len(values)}')
+    axis = h.axes[0]
+    num_replicas = len(h.axes[1])
+    num_bins = len(h.axes[0].edges) - 1 + int(axis.traits.underflow) + int(axis.traits.overflow)
+    weighted = h.storage_type is hist.storage.Weight
+    values_block = value_blocks(values)
+    weight_block = value_blocks(weight) if weight is not None else None
+
+    # Sums of weights (and of squared weights) of each replica, in the flow bins
+    sum_w = np.zeros(num_replicas * num_bins)
+    sum_w2 = np.zeros(num_replicas * num_bins) if weighted else None
+    for block_index, start in enumerate(range(0, len(values), RANDOM_EVENTS)):
+        stop = min(start + RANDOM_EVENTS, len(values))
+        x, x_valid = values_block(start, stop)
+        bins, filled = flow_index(axis, x)
+        if x_valid is not None: # None goes to the overflow bin
+            bins = np.where(x_valid, bins, num_bins - 1)
+            filled = np.where(x_valid, filled, axis.traits.overflow)
+        w = None
+        if weight_block is not None:
+            w, w_valid = weight_block(start, stop)
+            w = np.where(w_valid, w, 0) if w_valid is not None else w
+            w = np.where(filled, w, 0)
+        elif not filled.all():
+            w = filled.astype(float)
+
+        # One bincount per group of replicas, with the index of (replica in the group, bin) of each weight
+        replica_bins = (np.arange(min(RANDOM_REPLICAS, num_replicas))[:, None] * num_bins + bins).ravel()
+        for group, first in enumerate(range(0, num_replicas, RANDOM_REPLICAS)):
+            num = min(RANDOM_REPLICAS, num_replicas - first)
+            poisson = poisson_weights(seed, block_index, group, stop - start, num)
+            index = replica_bins[:poisson.size]
+            block_w = poisson if w is None else poisson * w
+            group_slice = slice(first * num_bins, (first + num) * num_bins)
+            sum_w[group_slice] += np.bincount(index, weights=block_w.ravel(), minlength=num * num_bins)
+            if weighted:
+                sum_w2[group_slice] += np.bincount(index, weights=np.square(block_w, dtype=float).ravel(),
+                                                   minlength=num * num_bins)
+
+    # Add to the bin contents (replica axis without flow bins)
+    view = h.view(flow=True)
+    replica_slice = slice(int(h.axes[1].traits.underflow), int(h.axes[1].traits.underflow) + num_replicas)
+    if weighted:
+        view.value[:, replica_slice] += sum_w.reshape(num_replicas, num_bins).T
+        view.variance[:, replica_slice] += sum_w2.reshape(num_replicas, num_bins).T
+    else:
+        view[:, replica_slice] += sum_w.reshape(num_replicas, num_bins).T
+    return h
+
+# User call this function to make a histogram of num_replicas bootstrap replicas of a variable
+# The Hist has a Regular axis for the variable and an Integer axis 'replica' (0 to num_replicas - 1), with
+# Weight storage if weight is given (Double otherwise), as the histograms filled by get_histogram()
+# Use h[:, i] for replica i, bootstrap_errors(h) for the uncertainty of each bin, and
+# fit_histograms(model, replica_data(h), initial) to fit all replicas at once
+# For 10^7 events and 1000 replicas, only the histogram and a few MB of weights are in memory
+def bootstrap_histogram(values, # Awkward Array or NumPy array of values (None allowed)
+                        num_bins, xmin, xmax,
+                        weight=None, # Weight of each event, e.g. totalWeight
+                        num_replicas=100,
+                        seed=0, # Same seed and events give the same replicas
+                        name='x', label=None # Name and label of the variable axis
+                       ):
+    if not isinstance(num_replicas, int) or num_replicas < 1:
+        raise ValueError(f'num_replicas must be a positive int. Got {num_replicas}')
+    time_start = time.time()
+    h = hist.Hist.new.Reg(num_bins, xmin, xmax, name=name, label=label).Integer(
+        0, num_replicas, name=REPLICA_AXIS, label='Replica', underflow=False, overflow=False)
+    h = h.Weight() if weight is not None else h.Double()
+    fill_bootstrap(h, values, weight, seed)
+    elapsed_time = time.time() - time_start
+    print("Elapsed time = " + str(round(elapsed_time, 1)) + "s") # Print the time elapsed
+    return h
+
+# This function returns the bin values of each replica, shape (num_replicas, num_bins)
+def replica_values(h, flow=False):
+    return h.values(flow=flow).T
+
+# This function returns the standard deviation of each bin over the replicas of a bootstrap histogram
+def bootstrap_errors(h, flow=False):
+    return np.std(replica_values(h, flow), axis=0, ddof=1)
+
+# This function returns (value, variance, bin_centres) of the replicas, with one row per replica,
+# as used by fit_histograms()
+def replica_data(h):
+    variances = h.variances(flow=False)
+    return replica_values(h), None if variances is None else variances.T, h.axes[0].centers
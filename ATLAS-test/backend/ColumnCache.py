@@ -0,0 +1,145 @@
+import os
+from collections import OrderedDict
+import awkward as ak
+import pyarrow.parquet as pq
+from .ArrowCache import load_cached_columns, store_cached_columns
+
+# Default byte limit of the process-wide column cache (2 GiB)
+DEFAULT_CACHE_LIMIT = 2 * 1024**3
+# Maximum number of parquet footers kept in the metadata cache
+MAX_METADATA_ENTRIES = 4096
+
+# Decoded columns, keyed by (file path, mtime, row group, column). The order of the
+# entries is the order of use, so the first entry is the least recently used one
+_column_cache = OrderedDict()
+# Parquet footers (schema and row group metadata) and column names, keyed by (file path, mtime),
+# in order of use as the column cache
+_metadata_cache = OrderedDict()
+# Hit/miss counters and the current size of the column cache
+_cache_stats = {'hits' : 0, 'misses' : 0, 'evictions' : 0,
+                'bytes' : 0, 'limit' : DEFAULT_CACHE_LIMIT}
+# Whether decoded columns are stored in the column cache (see use_column_cache())
+_cache_state = {'store' : True}
+
+# This function returns the absolute path and the modification time of a file
+# The mtime is part of every cache key so that rewritten files are never served from the cache
+def file_key(file):
+    path = os.path.abspath(file)
+    return path, os.stat(path).st_mtime_ns
+
+# This function returns (parquet metadata, column names) of a file, parsing the footer only once per
+# file version. Only the MAX_METADATA_ENTRIES most recently used files are kept
+def metadata_entry(file):
+    key = file_key(file)
+    if key in _metadata_cache:
+        _metadata_cache.move_to_end(key) # Mark as most recently used
+    else:
+        metadata = pq.ParquetFile(key[0]).metadata
+        _metadata_cache[key] = (metadata, metadata.schema.to_arrow_schema().names)
+        if len(_metadata_cache) > MAX_METADATA_ENTRIES:
+            _metadata_cache.popitem(last=False)
+    return _metadata_cache[key]
+
+# This function returns the parquet metadata (footer) of a file
+def read_metadata(file):
+    return metadata_entry(file)[0]
+
+# This function returns the column names of a parquet file
+def read_schema_names(file):
+    return metadata_entry(file)[1]
+
+# Remove least recently used columns until the cache fits in the byte limit
+def evict_columns():
+    while _column_cache and _cache_stats['bytes'] > _cache_stats['limit']:
+        _, arr = _column_cache.popitem(last=False)
+        _cache_stats['bytes'] -= arr.nbytes
+        _cache_stats['evictions'] += 1
+
+# This function stores a decoded column in the cache (unless it is larger than the limit on its own
+# or storing is turned off)
+def store_column(key, arr):
+    if not _cache_state['store'] or arr.nbytes > _cache_stats['limit']:
+        return
+    _column_cache[key] = arr
+    _cache_stats['bytes'] += arr.nbytes
+    evict_columns()
+
+# This function reads some columns of one row group in a parquet file and returns them
+# as a record Awkward Array. Columns already decoded are taken from the cache, then from
+# the on-disk Arrow cache (if enabled), the others are read from the file in a single call
+# and added to both caches. Like ak.from_parquet, columns not found in the file are skipped
+# If none of the columns is in the file, an empty array is returned
+def read_row_group(file, columns, row_group):
+    path, mtime = file_key(file)
+    all_columns = read_schema_names(file)
+    # Remove duplicated entry and columns not in the file, keep order
+    columns = [column for column in dict.fromkeys(columns) if column in all_columns]
+    if not columns:
+        return ak.Array(ak.contents.RecordArray([], [], length=0))
+
+    fields = {} # Hold the array for each column
+    missing = [] # Columns not found in the cache
+    for column in columns:
+        key = (path, mtime, row_group, column)
+        if key in _column_cache:
+            _column_cache.move_to_end(key) # Mark as most recently used
+            fields[column] = _column_cache[key]
+            _cache_stats['hits'] += 1
+        else:
+            missing.append(column)
+            _cache_stats['misses'] += 1
+
+    if missing:
+        # Memory-map the columns found in the on-disk cache
+        found = load_cached_columns(path, mtime, row_group, missing)
+        to_read = [column for column in missing if column not in found]
+        if to_read:
+            # Reuse the cached footer instead of parsing it again
+            parquet_file = pq.ParquetFile(path, metadata=read_metadata(file))
+            table = parquet_file.read_row_group(row_group, columns=to_read)
+            store_cached_columns(path, mtime, row_group, table)
+            arr = ak.from_arrow(table)
+            for column in to_read:
+                found[column] = arr[column]
+        for column in missing:
+            fields[column] = found[column]
+            store_column((path, mtime, row_group, column), found[column])
+
+    return ak.zip({column : fields[column] for column in columns}, depth_limit=1)
+
+# This function returns one column of one row group in a parquet file
+def read_column(file, column, row_group):
+    return read_row_group(file, [column], row_group)[column]
+
+# This function returns the sum of a column (e.g. 'totalWeight') over all row groups of a parquet file
+def sum_column(file, column):
+    num_row_groups = read_metadata(file).num_row_groups
+    return sum(ak.sum(read_column(file, column, group)) for group in range(num_row_groups))
+
+# Turn storing decoded columns in the column cache on or off (columns already cached are still used)
+# Returns the previous setting, to restore it. analysis_parquet() turns it off when every column is only
+# read once (e.g. fraction=1 or return_output=False), so that it doesn't hold up to the limit for nothing
+def use_column_cache(store):
+    previous = _cache_state['store']
+    _cache_state['store'] = bool(store)
+    return previous
+
+# Set the byte limit of the column cache. Least recently used columns are evicted
+# straight away if the cache is already larger than the new limit
+def set_column_cache_limit(limit):
+    if not isinstance(limit, int) or limit < 0:
+        raise ValueError(f'limit must be a non-negative int (number of bytes). Got {limit}')
+    _cache_stats['limit'] = limit
+    evict_columns()
+
+# Return the cache counters and size as a dict
+def column_cache_info():
+    info = dict(_cache_stats)
+    info['entries'] = len(_column_cache)
+    return info
+
+# Empty the column and metadata caches and reset the counters
+def clear_column_cache():
+    _column_cache.clear()
+    _metadata_cache.clear()
+    _cache_stats.update(hits=0, misses=0, evictions=0, bytes=0)
@@ -0,0 +1,211 @@
+import os
+import glob
+import time
+import shutil
+import argparse
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+import awkward as ak
+from .RangeIndex import RANGE_INDEX_FILE, parse_key, sort_values, sort_order, read_range_index
+from .SchemaRegistry import SCHEMA_FILE
+from .ParquetOutput import (open_sample_writer, write_sample_table, close_sample_writer, abort_sample_writer,
+                            DEFAULT_ROW_GROUP_SIZE, DEFAULT_ROWS_PER_FILE)
+
+# Files in a sample directory that are rebuilt by the compaction (or, for SCHEMA_FILE, written by
+# older versions) and so not copied over
+REBUILT_FILES = ['_metadata', '_common_metadata', RANGE_INDEX_FILE, SCHEMA_FILE]
+# Smallest number of events read at a time from each sorted run when sorting a sample
+MIN_MERGE_BATCH_SIZE = 1024
+
+# This function returns the number of events, the sum of weights (None if there is no
+# 'totalWeight' column) and the schema of the parquet files in a list
+# Raise error if the files don't have the same schema
+def sample_totals(files):
+    num_events = 0
+    sum_weights = None
+    schema = None
+    for file in files:
+        parquet_file = pq.ParquetFile(file)
+        file_schema = parquet_file.schema_arrow
+        if schema is None:
+            schema = file_schema
+        elif not file_schema.remove_metadata().equals(schema.remove_metadata()):
+            raise ValueError(f'The schema of {file} is different from the schema of {files[0]}. '
+                             'Files with different schemas cannot be compacted together.')
+        num_events += parquet_file.metadata.num_rows
+        if 'totalWeight' in file_schema.names:
+            weights = parquet_file.read(columns=['totalWeight'])['totalWeight']
+            # Through Awkward, as files written by analysis_parquet/analysis_uproot store the columns
+            # with an Awkward extension type that pyarrow.compute can't sum
+            sum_weights = (sum_weights or 0) + float(ak.sum(ak.from_arrow(weights)))
+    return num_events, sum_weights, schema
+
+# This function returns the events of one parquet file sorted by sort_by (a column name or e.g. 'photon_pt[0]')
+# Events without a value (e.g. no second photon for 'photon_pt[1]') are put at the end
+def read_sorted_file(file, sort_by):
+    table = pq.read_table(file)
+    base_var, _ = parse_key(sort_by)
+    if base_var not in table.column_names:
+        raise ValueError(f'sort_by column "{base_var}" not found. Available column(s): {table.column_names}')
+    return table.take(sort_order(ak.from_arrow(table.select([base_var])), sort_by))
+
+# This function yields the row groups (batches) of a sorted run file one at a time
+# (iter_batches() reads ahead, up to the whole file)
+def run_batches(run_parquet_file):
+    for group in range(run_parquet_file.num_row_groups):
+        yield run_parquet_file.read_row_group(group)
+
+# This function reads the next batch of events of a sorted run and their sort_by values
+# Returns None when all events of the run have been read
+def read_run_batch(batches, sort_by):
+    base_var, _ = parse_key(sort_by)
+    for table in batches:
+        if len(table):
+            return table, sort_values(ak.from_arrow(table.select([base_var])), sort_by)
+    return None
+
+# This function merges sorted run files (k-way merge) and writes the events through a sample writer
+# Only one batch (row group of the run file) per run is held in memory. At each step, the events up to
+# the smallest last value of the batches are written. Events with equal values keep the order of the runs
+def merge_sorted_runs(run_files, state, sort_by):
+    run_parquet_files = [pq.ParquetFile(run_file) for run_file in run_files]
+    try:
+        all_batches = [run_batches(run_parquet_file) for run_parquet_file in run_parquet_files]
+        buffers = [read_run_batch(batches, sort_by) for batches in all_batches] # Events not written yet
+        while any(buffer is not None for buffer in buffers):
+            active = [run for run, buffer in enumerate(buffers) if buffer is not None]
+            # Run whose batch ends with the smallest value: all its events can be written
+            last_run = min(active, key=lambda run: buffers[run][1][-1])
+            upper = buffers[last_run][1][-1]
+            tables, values = [], []
+            for run in active:
+                table, run_values = buffers[run]
+                # Events equal to upper in a later run wait, as the batch of last_run may be followed by more
+                side = 'right' if run <= last_run else 'left'
+                stop = len(run_values) if run == last_run else int(np.searchsorted(run_values, upper, side=side))
+                if stop:
+                    tables.append(table.slice(0, stop))
+                    values.append(run_values[:stop])
+                if stop == len(run_values):
+                    buffers[run] = read_run_batch(all_batches[run], sort_by)
+                else:
+                    buffers[run] = (table.slice(stop), run_values[stop:])
+            order = np.argsort(np.concatenate(values), kind='stable')
+            write_sample_table(state, pa.concat_tables(tables).take(order))
+    finally:
+        for run_parquet_file in run_parquet_files:
+            run_parquet_file.close()
+
+# This function writes all events of files through a sample writer
+# Without sort_by, events are streamed one row group at a time
+# With sort_by (a column name or e.g. 'photon_pt[0]'), each file is sorted on its own and written
+# to a temporary run file, then the runs are merged by merge_sorted_runs(). At most one file of the
+# sample is held in memory, at the cost of writing the events twice
+def write_compacted(files, state, sort_by):
+    if sort_by is None:
+        for file in files:
+            parquet_file = pq.ParquetFile(file)
+            for group in range(parquet_file.num_row_groups):
+                write_sample_table(state, parquet_file.read_row_group(group))
+    elif len(files) == 1:
+        write_sample_table(state, read_sorted_file(files[0], sort_by))
+    else:
+        run_directory = f"{state['directory']}/_sort_runs"
+        os.makedirs(run_directory)
+        # Runs are written in row groups of one merge batch, uncompressed as they are only read once
+        batch_size = max(MIN_MERGE_BATCH_SIZE, state['row_group_size'] // len(files))
+        try:
+            run_files = []
+            for i, file in enumerate(files):
+                run_files.append(f'{run_directory}/run{i}.parquet')
+                pq.write_table(read_sorted_file(file, sort_by), run_files[-1], row_group_size=batch_size,
+                               compression='none')
+            merge_sorted_runs(run_files, state, sort_by)
+        finally:
+            shutil.rmtree(run_directory, ignore_errors=True)
+    return close_sample_writer(state)
+
+# User call this function to rewrite a sample directory (e.g. one in PARQUET_STR_CODES or written by
+# analysis_parquet/analysis_uproot) that holds many small parquet files into a few files with
+# uniform row groups, optionally sorted by a key. The number of events, sum of weights and
+# schema are verified before the new files replace the old ones
+# The min/max of sort_by and of the keys already in the range index of the sample is recorded for
+# every row group, so that range queries on sorted keys only read a few row groups
+def compact_sample(sample_directory, # Directory holding the parquet files of one sample
+                   row_group_size=DEFAULT_ROW_GROUP_SIZE, # Number of events per row group
+                   max_rows_per_file=DEFAULT_ROWS_PER_FILE, # Number of events per file
+                   sort_by=None # Key to sort the events by, e.g. 'mass' or 'photon_pt[0]'
+                  ):
+    sample_directory = os.path.normpath(sample_directory)
+    if not os.path.isdir(sample_directory):
+        raise FileNotFoundError(f"Folder '{sample_directory}' does not exist")
+    files = sorted(glob.glob(f'{sample_directory}/*.parquet'))
+    if not files:
+        raise FileNotFoundError(f'No .parquet files found in {sample_directory}')
+
+    time_start = time.time()
+    num_events, sum_weights, schema = sample_totals(files)
+
+    # Write the compacted files next to the sample directory
+    tmp_directory = f'{sample_directory}.compact{os.getpid()}'
+    os.makedirs(tmp_directory)
+    try:
+        # Keys to record in the range index of the compacted sample
+        index_keys = list(read_range_index(sample_directory))
+        if sort_by is not None and sort_by not in index_keys:
+            index_keys.append(sort_by)
+        state = open_sample_writer(tmp_directory, row_group_size, max_rows_per_file, index_keys)
+        try:
+            num_files = write_compacted(files, state, sort_by)
+        except BaseException:
+            abort_sample_writer(state) # Close the file before the directory is removed
+            raise
+
+        # Verify the compacted files before replacing the sample
+        new_files = sorted(glob.glob(f'{tmp_directory}/*.parquet'))
+        new_num_events, new_sum_weights, new_schema = sample_totals(new_files)
+        if new_num_events != num_events:
+            raise RuntimeError(f'Number of events changed from {num_events} to {new_num_events}')
+        if (sum_weights is not None
+            and not np.isclose(new_sum_weights, sum_weights, rtol=1e-9, atol=0)):
+            raise RuntimeError(f'Sum of weights changed from {sum_weights} to {new_sum_weights}')
+        if not new_schema.remove_metadata().equals(schema.remove_metadata()):
+            raise RuntimeError(f'Schema changed from\n{schema}\nto\n{new_schema}')
+
+        # Keep any other file of the sample directory
+        for file in os.listdir(sample_directory):
+            path = f'{sample_directory}/{file}'
+            if os.path.isfile(path) and not file.endswith('.parquet') and file not in REBUILT_FILES:
+                shutil.copy2(path, f'{tmp_directory}/{file}')
+    except BaseException:
+        shutil.rmtree(tmp_directory, ignore_errors=True)
+        raise
+
+    # Swap the directories. Each rename is atomic, and the old files are put back if the second one fails
+    old_directory = f'{sample_directory}.old{os.getpid()}'
+    os.rename(sample_directory, old_directory)
+    try:
+        os.rename(tmp_directory, sample_directory)
+    except BaseException:
+        os.rename(old_directory, sample_directory)
+        raise
+    shutil.rmtree(old_directory)
+
+    elapsed_time = time.time() - time_start
+    print(f'Compacted {len(files)} file(s) into {num_files} file(s) in {sample_directory}: '
+          f'{num_events} events' + (f', sum of weights {sum_weights:.6g}' if sum_weights is not None else ''))
+    print("Elapsed time = " + str(round(elapsed_time, 1)) + "s") # Print the time elapsed
+    return num_files
+# End of compact_sample() function
+
+# Command line usage: python -m backend.CompactSample <sample_directory> [<sample_directory> ...]
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compact parquet sample directories.')
+    parser.add_argument('sample_directories', nargs='+')
+    parser.add_argument('--row-group-size', type=int, default=DEFAULT_ROW_GROUP_SIZE)
+    parser.add_argument('--max-rows-per-file', type=int, default=DEFAULT_ROWS_PER_FILE)
+    parser.add_argument('--sort-by', default=None)
+    args = parser.parse_args()
+    for directory in args.sample_directories:
+        compact_sample(directory, args.row_group_size, args.max_rows_per_file, args.sort_by)
@@ -0,0 +1,124 @@
+from collections import OrderedDict
+import awkward as ak
+import numpy as np
+from .HistogramCache import array_fingerprint
+
+# Default byte limit of the derived column cache (512 MiB)
+DEFAULT_DERIVED_CACHE_LIMIT = 512 * 1024**2
+
+# Derived columns (e.g. the values of 'photon_pt[0]'), keyed by (fingerprint of the jagged array, index)
+# Each entry is (Awkward Array, number of bytes it holds). The order of the entries is
+# the order of use, so the first entry is the least recently used one
+_derived_cache = OrderedDict()
+# Hit/miss counters and the current size of the derived column cache
+_derived_cache_stats = {'hits' : 0, 'misses' : 0, 'evictions' : 0,
+                        'bytes' : 0, 'limit' : DEFAULT_DERIVED_CACHE_LIMIT}
+
+# This function returns the start and stop of the list of each event and the flat values of a
+# jagged array of numbers, using the buffers of the array (no copy)
+# Returns None for other layouts (e.g. lists of lists, strings or lists that can be None)
+def list_bounds(array):
+    layout = ak.to_layout(array)
+    if isinstance(layout, ak.contents.ListOffsetArray):
+        offsets = np.asarray(layout.offsets.data)
+        starts, stops = offsets[:-1], offsets[1:]
+    elif isinstance(layout, ak.contents.ListArray):
+        starts, stops = np.asarray(layout.starts.data), np.asarray(layout.stops.data)
+    elif isinstance(layout, ak.contents.RegularArray):
+        starts = np.arange(layout.length, dtype=np.int64) * layout.size
+        stops = starts + layout.size
+    else:
+        return None
+    content = layout.content
+    if (layout.parameter('__array__') is not None or not isinstance(content, ak.contents.NumpyArray)
+        or content.data.ndim != 1):
+        return None
+    return starts, stops, content
+
+# This function returns the entry at index of the list of each event of a jagged array, as
+# ak.pad_none(array, index + 1)[:, index] would, e.g. the leading photon pT for index 0
+# Events without an entry at index give None. Instead of padding every list, the flat values of the
+# array are indexed directly: one value per event is gathered, with a byte mask if some events are
+# too short. The result owns its buffers, so it doesn't keep the jagged array alive
+# A negative index counts from the end of each list
+# If check_range is True, raise error if no event has an entry at index
+def element_at(array, index, check_range=False):
+    bounds = list_bounds(array)
+    if bounds is None: # Other layouts - pad as before
+        if check_range:
+            check_index(ak.num(array, axis=1), index)
+        if index < 0: # Lists shorter than -index give None
+            return ak.mask(array, ak.num(array, axis=1) >= -index)[:, index]
+        return ak.pad_none(array, index + 1, axis=1)[:, index]
+
+    starts, stops, content = bounds
+    if check_range:
+        check_index(stops - starts, index)
+    if index >= 0:
+        positions = starts + index
+        valid = positions < stops
+    else:
+        positions = stops + index
+        valid = positions >= starts
+    if valid.all():
+        return ak.Array(content.data[positions])
+    if len(content) == 0: # Only empty lists
+        data = np.zeros(len(positions), dtype=content.data.dtype)
+    else:
+        data = content.data[np.where(valid, positions, 0)]
+    return ak.Array(ak.contents.ByteMaskedArray(ak.index.Index8(valid.view(np.int8)),
+                                                ak.contents.NumpyArray(data), valid_when=True))
+
+# Raise error if no list is long enough to have an entry at index
+def check_index(counts, index):
+    max_num = int(np.max(counts)) if len(counts) else 0
+    if (index >= 0 and index >= max_num) or (index < 0 and -index > max_num):
+        raise IndexError(f'Input index should be less than {max_num}.')
+
+# Number of bytes held by a derived column, including any buffer it shares with its array
+# (e.g. the content of a padded array), so that the cache limit bounds the memory it keeps alive
+def derived_nbytes(values):
+    return values.layout.nbytes
+
+# Remove least recently used derived columns until the cache fits in the byte limit
+def evict_derived_columns():
+    while _derived_cache and _derived_cache_stats['bytes'] > _derived_cache_stats['limit']:
+        _, (_, nbytes) = _derived_cache.popitem(last=False)
+        _derived_cache_stats['bytes'] -= nbytes
+        _derived_cache_stats['evictions'] += 1
+
+# This function returns element_at(array, index), computed once per (array, index)
+# Plotting 'photon_pt[0]' for several binnings or figures then extracts the column once
+def cached_element_at(array, index, check_range=False):
+    key = (array_fingerprint(array), index)
+    if key in _derived_cache:
+        _derived_cache.move_to_end(key) # Mark as most recently used
+        _derived_cache_stats['hits'] += 1
+        return _derived_cache[key][0]
+    _derived_cache_stats['misses'] += 1
+    values = element_at(array, index, check_range)
+    nbytes = derived_nbytes(values)
+    if nbytes <= _derived_cache_stats['limit']:
+        _derived_cache[key] = (values, nbytes)
+        _derived_cache_stats['bytes'] += nbytes
+        evict_derived_columns()
+    return values
+
+# Set the byte limit of the derived column cache (0 turns the cache off). Least recently used
+# columns are evicted straight away if the cache is already larger than the new limit
+def set_derived_cache_limit(limit):
+    if not isinstance(limit, int) or limit < 0:
+        raise ValueError(f'limit must be a non-negative int (number of bytes). Got {limit}')
+    _derived_cache_stats['limit'] = limit
+    evict_derived_columns()
+
+# Return the cache counters and size as a dict
+def derived_cache_info():
+    info = dict(_derived_cache_stats)
+    info['entries'] = len(_derived_cache)
+    return info
+
+# Empty the derived column cache and reset the counters
+def clear_derived_cache():
+    _derived_cache.clear()
+    _derived_cache_stats.update(hits=0, misses=0, evictions=0, bytes=0)
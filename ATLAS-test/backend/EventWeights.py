@@ -1,4 +1,5 @@
 import awkward as ak
+import numpy as np
 
 # Relevant weight variables for different skim
 WEIGHT_VAR = {
@@ -20,4 +21,81 @@ def calculate_weight(events, luminosity, skim):
 
     if ak.all(total_weight == 0): # Assume real data
         total_weight = ak.Array([1] * len(total_weight)) 
-    return total_weight
\ No newline at end of file
+    return total_weight
+
+# Name of the field holding the weight of every variation (a record with one field per variation)
+VARIATION_FIELD = 'weightVariations'
+# Name of the nominal weight in VARIATION_FIELD (the same as totalWeight)
+NOMINAL = 'nominal'
+
+# A weight variation is a dict {weight variable : replacement} that changes some of the WEIGHT_VAR[skim]
+# factors of the nominal weight. replacement is the name of the variable used instead of the weight
+# variable, or a number the weight variable is multiplied by. variations = {variation name : weight variation}
+# Example: {'PILEUP_UP' : {'ScaleFactor_PILEUP' : 'ScaleFactor_PILEUP_UP'},
+#           'ELE_UP' : {'ScaleFactor_ELE' : 1.02}, 'ELE_DOWN' : {'ScaleFactor_ELE' : 0.98}}
+def validate_weight_variations(variations, skim):
+    if not isinstance(variations, dict) or not variations:
+        raise TypeError('weight_variations must be a non-empty dict {variation name : {weight variable : replacement}}.')
+    for name, variation in variations.items():
+        if not isinstance(name, str) or name == NOMINAL:
+            raise ValueError(f'Variation names must be str other than "{NOMINAL}". Got {name}')
+        if not isinstance(variation, dict) or not variation:
+            raise TypeError(f'Variation "{name}" must be a non-empty dict {{weight variable : replacement}}. Got {variation}')
+        for weight_var, replacement in variation.items():
+            if weight_var not in WEIGHT_VAR[skim]:
+                raise ValueError(f'Variation "{name}" : {weight_var} is not a weight variable of skim {skim}. '
+                                 f'Valid weight variables: {WEIGHT_VAR[skim]}')
+            if not isinstance(replacement, (str, int, float)) or isinstance(replacement, bool):
+                raise TypeError(f'Variation "{name}" : expect a variable name or a number for {weight_var}. Got {replacement}')
+
+# Return the variables that the weight variations read in addition to WEIGHT_VAR[skim]
+def variation_variables(variations):
+    variables = []
+    for variation in variations.values():
+        for replacement in variation.values():
+            if isinstance(replacement, str) and replacement not in variables:
+                variables.append(replacement)
+    return variables
+
+# Calculate the nominal weight (as calculate_weight()) and the weight of every variation in one pass
+# Each weight variable is converted to NumPy once, the factors that no variation changes are multiplied
+# once for all variations, and only the changed factors are multiplied for each of them
+# Returns a record array {'nominal' : weight, variation name : weight, ...} (see VARIATION_FIELD)
+def calculate_weight_variations(events, luminosity, skim, variations):
+    validate_weight_variations(variations, skim)
+    if "sum_of_weights" not in events.fields:
+        raise KeyError('Variable "sum_of_weights" was not found.')
+    for weight_var in WEIGHT_VAR[skim] + variation_variables(variations):
+        if weight_var not in events.fields:
+            raise KeyError(f'Weight variable {weight_var} was not found.')
+
+    columns = {} # abs() of each weight variable as a NumPy array
+    def column(weight_var):
+        if weight_var not in columns:
+            columns[weight_var] = np.abs(ak.to_numpy(events[weight_var]).astype(np.float64))
+        return columns[weight_var]
+
+    # Product of the factors that are the same for all variations
+    varied = [weight_var for weight_var in WEIGHT_VAR[skim]
+              if any(weight_var in variation for variation in variations.values())]
+    common = luminosity * 1000 / ak.to_numpy(events["sum_of_weights"]).astype(np.float64) # * 1000 to go from fb-1 to pb-1
+    for weight_var in WEIGHT_VAR[skim]:
+        if weight_var not in varied:
+            common *= column(weight_var)
+
+    # One row per variation, the nominal weight first
+    weights = np.empty((len(variations) + 1, len(events)))
+    for row, variation in zip(weights, [{}] + list(variations.values())):
+        row[:] = common
+        for weight_var in varied:
+            replacement = variation.get(weight_var)
+            if isinstance(replacement, str):
+                row *= column(replacement)
+            else:
+                row *= column(weight_var)
+                if replacement is not None:
+                    row *= replacement
+
+    if not weights[0].any(): # Assume real data
+        weights[:] = 1
+    return ak.zip(dict(zip([NOMINAL] + list(variations), weights)))
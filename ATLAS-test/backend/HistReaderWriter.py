@@ -0,0 +1,174 @@
+import os
+import json
+import datetime
+from zoneinfo import ZoneInfo
+import numpy as np
+import hist
+from hist.serialization import to_uhi, from_uhi
+
+# A histogram file holds many Hist objects in a compact binary form that can be read one at a time:
+#   MAGIC, header length (8 bytes, little endian), header (JSON), bin contents (raw arrays)
+# The header lists every histogram by name with its UHI description (axes, storage type, metadata),
+# in which each array of bin contents (values, variances, counts) is replaced by its position
+# {'offset', 'shape', 'dtype'} in the file (Mean and WeightedMean storages also keep their raw
+# accumulators as 'raw_view'). Arrays start at multiples of ALIGNMENT bytes so that
+# they can be memory-mapped
+MAGIC = b'ATLASHIST1\n'
+ALIGNMENT = 64
+# Separator of the sample key and the histogram name in the name of a nested histogram, e.g. 'Data/mass'
+SEPARATOR = '/'
+
+# Headers already read, keyed by (file path, mtime)
+_header_cache = {}
+
+# This function returns {name : Hist} for a dict of Hist objects, or a nested dict such as
+# {sample key : {histogram name : Hist}} returned by fill_histograms() (names joined with '/')
+def flatten_histograms(histograms, prefix=''):
+    flat = {}
+    for key, value in histograms.items():
+        key = str(key)
+        if SEPARATOR in key:
+            raise ValueError(f'Histogram and sample names must not contain "{SEPARATOR}". Got "{key}"')
+        if isinstance(value, dict):
+            flat.update(flatten_histograms(value, f'{prefix}{key}{SEPARATOR}'))
+        elif isinstance(value, hist.Hist):
+            flat[f'{prefix}{key}'] = value
+        else:
+            raise TypeError(f'Expect Hist objects or dicts of Hist objects. Got {type(value)} for "{prefix}{key}"')
+    return flat
+
+# This function rebuilds the nested dicts of flatten_histograms() from {name : Hist}
+def nest_histograms(flat):
+    histograms = {}
+    for name, h in flat.items():
+        *keys, last = name.split(SEPARATOR)
+        level = histograms
+        for key in keys:
+            level = level.setdefault(key, {})
+        level[last] = h
+    return histograms
+
+# Convert the NumPy values left in a UHI description (e.g. the edges of a variable axis) for JSON
+def json_default(value):
+    if isinstance(value, (np.ndarray, np.generic)):
+        return value.tolist()
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+# Number of padding bytes to reach the next multiple of ALIGNMENT
+def padding(position):
+    return -position % ALIGNMENT
+
+# This function writes Hist objects to a histogram file
+# histograms is a dict {name : Hist} or nested dicts of Hist objects (e.g. from fill_histograms())
+# filename can be set by user (without extension), otherwise a unique filename will be created using
+# current date and time, as for pkl_writer(). The file is written as <filename>.hist
+def hist_writer(histograms, output_filename=''):
+    if not isinstance(histograms, dict):
+        raise TypeError('histograms must be a dict of Hist objects.')
+    if not output_filename:
+        os.makedirs('output_hist', exist_ok=True)
+        # Use current time to create a unique filename
+        now = datetime.datetime.now(ZoneInfo("Europe/London"))
+        strf = now.strftime("%Y%m%d%H%M") # Set time format
+        output_filename = f'output_hist/hist_writer{strf}'
+    else: # Ensure folder exists if output_filename is provided manually
+        output_dir = os.path.dirname(output_filename)
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+
+    # Describe each histogram and lay out its arrays one after the other
+    entries = {}
+    arrays = []
+    position = 0 # Position of the next array, relative to the start of the bin contents
+    for name, h in flatten_histograms(histograms).items():
+        description = to_uhi(h)
+        description.pop('writer_info', None)
+        storage = description['storage']
+        if h.storage_type in (hist.storage.Mean, hist.storage.WeightedMean):
+            # UHI keeps the variance of the mean, not the accumulator itself, so bins with one entry
+            # can't be restored from it: keep the raw accumulators as well
+            view = h.view(flow=True).view(np.ndarray)
+            storage['raw_view'] = np.stack([view[field] for field in view.dtype.names], axis=-1)
+        for field, value in storage.items():
+            if isinstance(value, np.ndarray):
+                array = np.ascontiguousarray(value)
+                position += padding(position)
+                storage[field] = {'offset' : position, 'shape' : list(array.shape), 'dtype' : array.dtype.str}
+                arrays.append((position, array))
+                position += array.nbytes
+        entries[name] = description
+    try:
+        header = json.dumps({'histograms' : entries}, default=json_default).encode()
+    except TypeError as e:
+        raise TypeError(f'The metadata of the histograms must be JSON serialisable. {e}') from None
+
+    data_start = len(MAGIC) + 8 + len(header)
+    data_start += padding(data_start)
+    filename = f'{output_filename}.hist'
+    tmp_filename = f'{filename}.tmp{os.getpid()}'
+    with open(tmp_filename, 'wb') as f:
+        f.write(MAGIC)
+        f.write(len(header).to_bytes(8, 'little'))
+        f.write(header)
+        for offset, array in arrays:
+            f.write(b'\0' * (data_start + offset - f.tell()))
+            f.write(array.tobytes())
+    os.replace(tmp_filename, filename)
+    return output_filename
+
+# This function returns the header of a histogram file and the position of the bin contents
+# The header is read once per file version
+def read_header(filename):
+    path = os.path.abspath(filename)
+    key = (path, os.stat(path).st_mtime_ns)
+    if key not in _header_cache:
+        with open(path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f'"{filename}" is not a histogram file written by hist_writer().')
+            header_length = int.from_bytes(f.read(8), 'little')
+            header = json.loads(f.read(header_length))
+        data_start = len(MAGIC) + 8 + header_length
+        _header_cache[key] = (header, data_start + padding(data_start))
+    return _header_cache[key]
+
+# This function returns the names of the histograms in a histogram file, without reading any bin contents
+def hist_names(filename):
+    header, _ = read_header(filename)
+    return list(header['histograms'])
+
+# This function reads histograms from a histogram file
+# names is a histogram name, a list of names (see hist_names()) or None for all histograms
+# Only the bin contents of the requested histograms are read
+# Returns {name : Hist}, or the nested dicts given to hist_writer() if nested is True
+def hist_reader(filename, names=None, nested=False):
+    header, data_start = read_header(filename)
+    entries = header['histograms']
+    if names is None:
+        names = list(entries)
+    elif isinstance(names, str):
+        names = [names]
+    missing = [name for name in names if name not in entries]
+    if missing:
+        raise KeyError(f'Histogram(s) {missing} not found in "{filename}". Available histogram(s): {list(entries)}')
+
+    histograms = {}
+    with open(filename, 'rb') as f:
+        for name in names:
+            # Copy the storage description, the header is cached
+            description = dict(entries[name], storage=dict(entries[name]['storage']))
+            storage = description['storage']
+            for field, value in storage.items():
+                if isinstance(value, dict) and 'offset' in value:
+                    dtype = np.dtype(value['dtype'])
+                    count = int(np.prod(value['shape']))
+                    f.seek(data_start + value['offset'])
+                    storage[field] = np.fromfile(f, dtype=dtype, count=count).reshape(value['shape'])
+            raw_view = storage.pop('raw_view', None)
+            histograms[name] = from_uhi(description)
+            if raw_view is not None: # Write the accumulators directly (not through the setter of the view)
+                view = histograms[name].view(flow=True).view(np.ndarray)
+                for i, field in enumerate(view.dtype.names):
+                    view[field] = raw_view[..., i]
+    if nested:
+        return nest_histograms(histograms)
+    return histograms
@@ -0,0 +1,246 @@
+import time
+import awkward as ak
+import numpy as np
+import hist
+from hist import Hist
+from .RangeIndex import key_values
+from .Rebinning import fine_binning, MAX_FINE_BINS
+from .MaskedFill import fill_variations
+from .EventWeights import VARIATION_FIELD, NOMINAL
+
+# Default number of events converted to NumPy and filled at a time for each sample
+DEFAULT_CHUNK_SIZE = 1_000_000
+# Name of the variation axis of histograms booked with variations
+VARIATION_AXIS = 'variation'
+
+# Validate the binning of one axis
+def validate_binning(variable, num_bins, xmin, xmax):
+    if not isinstance(variable, str):
+        raise TypeError(f'variable must be a str. Got {variable}')
+    if not isinstance(num_bins, int) or isinstance(num_bins, bool):
+        raise TypeError(f'num_bins must be an int. Got {num_bins}')
+    if num_bins < 1:
+        raise ValueError(f'num_bins must be positive. Got {num_bins}')
+    if not all(isinstance(value, (int, float)) for value in (xmin, xmax)):
+        raise TypeError(f'xmin and xmax must be numbers. Got {xmin} and {xmax}')
+    if xmax <= xmin:
+        raise ValueError(f'xmax must be greater than xmin. Got xmin = {xmin}, xmax = {xmax}')
+
+# Validate the weight variations of a booking and return them as a list (None if no variations)
+def validate_variations(variations):
+    if variations is None:
+        return None
+    if isinstance(variations, str) or not isinstance(variations, (list, tuple)):
+        raise TypeError(f'variations must be a list of variation names. Got {variations}')
+    if not all(isinstance(name, str) for name in variations) or NOMINAL in variations \
+       or len(set(variations)) != len(variations):
+        raise ValueError(f'variations must be unique str other than "{NOMINAL}". Got {variations}')
+    return list(variations)
+
+# User call this function to book a 1D histogram of a variable (e.g. 'mass' or 'lep_pt[0]')
+# The booking is a dict used by fill_histograms(). weight is the column used as event weight
+# for MC samples (weight = 1 if None or not found). name defaults to the variable
+# variations is a list of weight variation names (see calculate_weight_variations()), e.g.
+# ['PILEUP_UP', 'PILEUP_DOWN']. The histogram then has a last axis 'variation' with the nominal
+# weight and each variation, filled from the 'weightVariations' field in the same pass over the events
+# Use select_variation() to get the histograms of one variation
+def book_histogram(variable, num_bins, xmin, xmax, weight='totalWeight', name=None, variations=None):
+    validate_binning(variable, num_bins, xmin, xmax)
+    return {'name' : str(name) if name is not None else variable,
+            'variables' : [variable],
+            'num_bins' : [num_bins],
+            'min_max' : [(xmin, xmax)],
+            'weight' : weight,
+            'variations' : validate_variations(variations)}
+
+# User call this function to book a fine-binned master histogram of a variable, filled once and
+# rebinned on demand. binnings = [(num_bins, xmin, xmax), ...] are the binnings to be plotted or
+# fitted, e.g. [(500, 0, 160), (200, 110, 160)]. The booking has the coarsest binning from which each
+# of them (and any other binning with aligned edges) can be derived exactly by rebin_histogram()
+def book_fine_histogram(variable, binnings, weight='totalWeight', name=None, max_bins=MAX_FINE_BINS, variations=None):
+    num_bins, xmin, xmax = fine_binning(binnings, max_bins)
+    return book_histogram(variable, num_bins, xmin, xmax, weight, name, variations)
+
+# User call this function to book a 2D histogram of two variables
+# variables, num_bins and min_max are tuples/lists for the x and y axes, as for histogram_2d()
+# name defaults to 'x_variable vs y_variable'. variations as for book_histogram()
+def book_histogram_2d(variables, num_bins, min_max, weight='totalWeight', name=None, variations=None):
+    if not all(isinstance(i, (list, tuple)) and len(i) == 2 for i in (variables, num_bins, min_max)):
+        raise ValueError('variables, num_bins and min_max must each have exactly two elements.')
+    for variable, bins, pair in zip(variables, num_bins, min_max):
+        if not isinstance(pair, (list, tuple)) or len(pair) != 2:
+            raise ValueError(f'Expect a tuple of two numbers for min_max. Got {pair}')
+        validate_binning(variable, bins, pair[0], pair[1])
+    return {'name' : str(name) if name is not None else f'{variables[0]} vs {variables[1]}',
+            'variables' : list(variables),
+            'num_bins' : list(num_bins),
+            'min_max' : [tuple(pair) for pair in min_max],
+            'weight' : weight,
+            'variations' : validate_variations(variations)}
+
+# Validate a list of bookings
+def validate_bookings(bookings):
+    if isinstance(bookings, dict):
+        bookings = [bookings]
+    if not isinstance(bookings, (list, tuple)) or not all(isinstance(i, dict) for i in bookings):
+        raise TypeError('bookings must be a list of bookings made by book_histogram() or book_histogram_2d().')
+    names = [booking['name'] for booking in bookings]
+    duplicated = {name for name in names if names.count(name) > 1}
+    if duplicated:
+        raise ValueError(f'Histogram names must be unique. Got duplicated name(s): {sorted(duplicated)}')
+    return list(bookings)
+
+# This function makes an empty Hist for a booking and a sample
+# Samples with 'Data' in the key get a .Double() storage (unweighted), the others a .Weight() storage,
+# as in plot_stacked_hist(). The axis of a 1D histogram is named after the sample key, as in plot_stacked_hist()
+def make_histogram(booking, key):
+    if len(booking['variables']) == 1:
+        names = [key]
+    else:
+        names = booking['variables']
+    axes = [hist.axis.Regular(bins, xmin, xmax, name=name, label=variable)
+            for name, variable, bins, (xmin, xmax) in zip(names, booking['variables'],
+                                                          booking['num_bins'], booking['min_max'])]
+    if booking.get('variations'):
+        axes.append(hist.axis.StrCategory([NOMINAL] + booking['variations'], name=VARIATION_AXIS,
+                                          label='Variation', overflow=False))
+    storage = hist.storage.Double() if 'Data' in key else hist.storage.Weight()
+    return Hist(*axes, storage=storage)
+
+# This function returns the values of a variable as a NumPy array, with None replaced by nan
+# Events without an entry at the index of e.g. 'lep_pt[2]' give nan (filled in the overflow bin)
+def booked_values(chunk, variable):
+    values = key_values(chunk, variable)
+    if values.ndim > 1:
+        raise ValueError(f'Invalid input variable format : {variable}. '
+                         f'Expect "{variable}[int]".')
+    return ak.to_numpy(ak.fill_none(values, np.nan))
+
+# This function makes the empty histograms of one sample, {histogram name : Hist}
+def make_sample_histograms(bookings, key):
+    return {booking['name'] : make_histogram(booking, key) for booking in bookings}
+
+# This function returns an empty cutflow for one sample
+def new_cutflow():
+    return {'Events read' : 0, 'Events after cut' : 0, 'Sum of weights after cut' : 0.0}
+
+# Add the events of one chunk to the cutflow of a sample
+# num_events_read is the number of events before the selection cut, chunk holds the events after it
+def update_cutflow(cutflow, num_events_read, chunk):
+    cutflow['Events read'] += num_events_read
+    cutflow['Events after cut'] += len(chunk)
+    if 'totalWeight' in chunk.fields:
+        cutflow['Sum of weights after cut'] += float(ak.sum(chunk['totalWeight']))
+    else: # assume totalWeight = 1 if 'totalWeight' not in field
+        cutflow['Sum of weights after cut'] += len(chunk)
+
+# This function fills the histograms of one sample with one chunk of events
+# Each variable and each weight is converted to NumPy once per chunk, whatever the number of
+# histograms using it. Histograms with a .Double() storage are filled without weights
+def fill_chunk(bookings, chunk, sample_hists):
+    values = {} # NumPy array of each variable
+    weights = {} # NumPy array of each weight column
+    for booking in bookings:
+        for variable in booking['variables']:
+            if variable not in values:
+                values[variable] = booked_values(chunk, variable)
+        args = [values[variable] for variable in booking['variables']]
+        h = sample_hists[booking['name']]
+        if booking.get('variations'):
+            fill_variations(h, args, variation_weights(chunk, booking, h, weights))
+        elif h.storage_type is hist.storage.Double:
+            h.fill(*args)
+        else:
+            weight = booking['weight']
+            if weight not in weights:
+                if weight is not None and weight in chunk.fields: # Events without a weight count 0
+                    weights[weight] = ak.to_numpy(ak.fill_none(chunk[weight], 0.0))
+                else: # assume weight = 1 if the weight column is not in field
+                    weights[weight] = np.ones(len(chunk))
+            h.fill(*args, weight=weights[weight])
+
+# This function returns the weight arrays of the nominal weight and the variations of a booking
+# (None for histograms with a .Double() storage, which count events in every variation)
+# weights holds the NumPy arrays already converted for this chunk
+def variation_weights(chunk, booking, h, weights):
+    if h.storage_type is hist.storage.Double:
+        return None
+    if VARIATION_FIELD not in chunk.fields:
+        raise KeyError(f'Histogram "{booking["name"]}" is booked with variations but the events have no '
+                       f'"{VARIATION_FIELD}" field. Pass weight_variations to analysis_uproot() or add the '
+                       'field with calculate_weight_variations().')
+    available = chunk[VARIATION_FIELD].fields
+    arrays = []
+    for name in [NOMINAL] + booking['variations']:
+        if name not in available:
+            raise KeyError(f'Variation "{name}" not found in "{VARIATION_FIELD}". Available variations: {available}')
+        key = (VARIATION_FIELD, name)
+        if key not in weights:
+            weights[key] = ak.to_numpy(ak.fill_none(chunk[VARIATION_FIELD][name], 0.0))
+        arrays.append(weights[key])
+    return arrays
+
+# User call this function to get the histograms of one variation from histograms booked with variations
+# histograms is {sample key : {histogram name : Hist}} (e.g. returned by fill_histograms()) or {name : Hist}
+# Returns the same dicts with the 'variation' axis removed, which can be plotted as any filled histograms
+# Histograms booked without variations are unchanged, histograms booked without this variation are left out
+def select_variation(histograms, variation=NOMINAL):
+    selected = variation_histograms(histograms, variation)
+    if selected is None:
+        raise KeyError(f'Variation "{variation}" not found in the histograms.')
+    return selected[0]
+
+# Return (histograms of one variation, whether any histogram has the variation) for select_variation()
+def variation_histograms(histograms, variation):
+    selected = {}
+    found = False
+    for key, value in histograms.items():
+        if isinstance(value, dict):
+            sub_selected = variation_histograms(value, variation)
+            if sub_selected is not None:
+                selected[key] = sub_selected[0]
+                found = True
+        elif VARIATION_AXIS not in value.axes.name:
+            selected[key] = value
+        elif variation in value.axes[VARIATION_AXIS]:
+            selected[key] = value[{VARIATION_AXIS : hist.loc(variation)}]
+            found = True
+    return (selected, found) if found else None
+
+# User call this function to fill all booked histograms in one pass over the events of each sample
+# data_dict = {sample key : Awkward Array or dict of arrays} (as for plot_histograms())
+# Events are filled chunk_size at a time. Pass the returned histograms back as histograms to keep
+# filling them with more events (e.g. one chunk of a sample at a time)
+# Returns {sample key : {histogram name : Hist}}, which can be given as data_dict to plot_stacked_hist()
+# and plot_histograms() (with the histogram names as the variables), or to histogram_2d()
+def fill_histograms(bookings, # List of bookings made by book_histogram() or book_histogram_2d()
+                    data_dict, # See above
+                    histograms=None, # Histograms to fill (returned by a previous call)
+                    chunk_size=DEFAULT_CHUNK_SIZE # Number of events filled at a time
+                   ):
+    bookings = validate_bookings(bookings)
+    if not isinstance(data_dict, dict):
+        raise TypeError('data_dict must be a dict.')
+    if not isinstance(chunk_size, int) or chunk_size < 1:
+        raise ValueError(f'chunk_size must be a positive int. Got {chunk_size}')
+    if histograms is None:
+        histograms = {}
+
+    time_start = time.time()
+    for key, value in data_dict.items():
+        if isinstance(value, dict):
+            value = ak.zip(value, depth_limit=1)
+        elif not isinstance(value, ak.Array):
+            raise TypeError(f'Key "{key}" : Unexpected type of dict value. Expect dict or Awkward Array.')
+
+        sample_hists = histograms.setdefault(key, {})
+        for booking in bookings:
+            if booking['name'] not in sample_hists:
+                sample_hists[booking['name']] = make_histogram(booking, key)
+
+        for start in range(0, len(value), chunk_size):
+            fill_chunk(bookings, value[start : start + chunk_size], sample_hists)
+
+    elapsed_time = time.time() - time_start
+    print("Elapsed time = " + str(round(elapsed_time, 1)) + "s") # Print the time elapsed
+    return histograms
@@ -0,0 +1,103 @@
+import hashlib
+import itertools
+import weakref
+from collections import OrderedDict
+import awkward as ak
+import numpy as np
+
+# Default byte limit of the histogram cache (256 MiB)
+DEFAULT_HISTOGRAM_CACHE_LIMIT = 256 * 1024**2
+
+# Filled histograms, keyed by (sample key, variable, binning, array fingerprints). The order of
+# the entries is the order of use, so the first entry is the least recently used one
+_histogram_cache = OrderedDict()
+# Hit/miss counters and the current size of the histogram cache
+_histogram_cache_stats = {'hits' : 0, 'misses' : 0, 'evictions' : 0,
+                          'bytes' : 0, 'limit' : DEFAULT_HISTOGRAM_CACHE_LIMIT}
+
+# Token of each buffer in use, keyed by id(buffer): (weak reference to the buffer, token)
+# The entry of a buffer is removed when the buffer is freed and a token is never given twice,
+# so a new buffer at the address of a freed one gets a new token
+_buffer_tokens = {}
+_next_token = itertools.count()
+
+# Remove the entry of a freed buffer (called by its weak reference)
+def forget_buffer(ref, buffer_id):
+    if buffer_id in _buffer_tokens and _buffer_tokens[buffer_id][0] is ref:
+        del _buffer_tokens[buffer_id]
+
+# This function returns the token of a NumPy buffer
+def buffer_token(buffer):
+    buffer_id = id(buffer)
+    if buffer_id in _buffer_tokens and _buffer_tokens[buffer_id][0]() is buffer:
+        return _buffer_tokens[buffer_id][1]
+    token = next(_next_token)
+    ref = weakref.ref(buffer, lambda ref: forget_buffer(ref, buffer_id))
+    _buffer_tokens[buffer_id] = (ref, token)
+    return token
+
+# This function returns a cheap fingerprint of an Awkward Array (or NumPy array)
+# The buffers of the array are not read: the fingerprint holds the layout, the length and the token
+# of each buffer. Selecting a field (e.g. data['mass']) gives the same buffers, hence the same
+# fingerprint, while an array read again from file gets new buffers and a new fingerprint
+# Awkward Arrays are immutable, but a NumPy array changed in place would keep its fingerprint
+def array_fingerprint(array):
+    if isinstance(array, np.ndarray):
+        form, length, buffers = 'numpy', len(array), {'data' : array}
+    else:
+        form, length, buffers = ak.to_buffers(array)
+    digest = hashlib.blake2b(f'{form}:{length}'.encode(), digest_size=16)
+    for name, buffer in sorted(buffers.items()):
+        digest.update(f'{name}:{buffer_token(buffer)}'.encode())
+    return digest.hexdigest()
+
+# Remove least recently used histograms until the cache fits in the byte limit
+def evict_histograms():
+    while _histogram_cache and _histogram_cache_stats['bytes'] > _histogram_cache_stats['limit']:
+        _, h = _histogram_cache.popitem(last=False)
+        _histogram_cache_stats['bytes'] -= histogram_nbytes(h)
+        _histogram_cache_stats['evictions'] += 1
+
+# Number of bytes held by the bins of a Hist
+def histogram_nbytes(h):
+    return h.view(flow=True).nbytes
+
+# This function returns a copy of the cached histogram of a key, or None if it is not cached
+# A copy is returned so that changing the histogram doesn't change the cache
+def cached_histogram(key):
+    if key not in _histogram_cache:
+        _histogram_cache_stats['misses'] += 1
+        return None
+    _histogram_cache.move_to_end(key) # Mark as most recently used
+    _histogram_cache_stats['hits'] += 1
+    return _histogram_cache[key].copy()
+
+# This function stores a copy of a filled histogram in the cache (unless it is larger than the limit on its own)
+def store_histogram(key, h):
+    nbytes = histogram_nbytes(h)
+    if nbytes > _histogram_cache_stats['limit']:
+        return
+    if key in _histogram_cache:
+        _histogram_cache_stats['bytes'] -= histogram_nbytes(_histogram_cache.pop(key))
+    _histogram_cache[key] = h.copy()
+    _histogram_cache_stats['bytes'] += nbytes
+    evict_histograms()
+
+# Set the byte limit of the histogram cache (0 turns the cache off). Least recently used
+# histograms are evicted straight away if the cache is already larger than the new limit
+def set_histogram_cache_limit(limit):
+    if not isinstance(limit, int) or limit < 0:
+        raise ValueError(f'limit must be a non-negative int (number of bytes). Got {limit}')
+    _histogram_cache_stats['limit'] = limit
+    evict_histograms()
+
+# Return the cache counters and size as a dict
+def histogram_cache_info():
+    info = dict(_histogram_cache_stats)
+    info['entries'] = len(_histogram_cache)
+    return info
+
+# Empty the histogram cache and reset the counters
+def clear_histogram_cache():
+    _histogram_cache.clear()
+    _histogram_cache_stats.update(hits=0, misses=0, evictions=0, bytes=0)
@@ -0,0 +1,167 @@
+import awkward as ak
+import numpy as np
+import hist
+
+# Number of entries filled at a time. Entries are only gathered (copied) block by block, so the
+# temporary arrays never hold more than this number of entries
+FILL_BLOCK_SIZE = 1_000_000
+
+# This function returns a function block(start, stop) that gives the values of a flat array
+# between start and stop and a bool mask of the valid (not None) values (None if all are valid)
+# The NumPy buffers of the Awkward Array are used directly: nothing is copied for an array
+# without None, and for an option array only the entries of one block are gathered
+def value_blocks(array):
+    if isinstance(array, np.ndarray) and array.ndim == 1:
+        return lambda start, stop: (array[start:stop], None)
+
+    layout = ak.to_layout(array)
+    if isinstance(layout, ak.contents.UnmaskedArray):
+        layout = layout.content
+    content = layout.content if isinstance(layout, (ak.contents.ByteMaskedArray,
+                                                    ak.contents.BitMaskedArray,
+                                                    ak.contents.IndexedOptionArray,
+                                                    ak.contents.IndexedArray)) else layout
+    if (isinstance(content, ak.contents.NumpyArray) and content.data.ndim == 1
+        and content.parameter('__array__') is None):
+        data = np.asarray(content.data)
+        if layout is content: # No None
+            return lambda start, stop: (data[start:stop], None)
+        if isinstance(layout, ak.contents.ByteMaskedArray):
+            # mask holds valid_when for valid entries
+            mask = np.asarray(layout.mask.data)
+            valid_when = layout.valid_when
+            return lambda start, stop: (data[start:stop], (mask[start:stop] != 0) == valid_when)
+        if isinstance(layout, ak.contents.BitMaskedArray):
+            # One bit per entry, only the bytes of the block are unpacked
+            mask = np.asarray(layout.mask.data)
+            valid_when = layout.valid_when
+            bitorder = 'little' if layout.lsb_order else 'big'
+            def bit_block(start, stop):
+                bits = np.unpackbits(mask[start // 8 : (stop + 7) // 8], bitorder=bitorder)
+                return data[start:stop], bits[start % 8 : start % 8 + stop - start] == valid_when
+            return bit_block
+        # IndexedOptionArray (index < 0 for None) or IndexedArray
+        index = np.asarray(layout.index.data)
+        def block(start, stop):
+            block_index = index[start:stop]
+            valid = block_index >= 0
+            if len(data) == 0: # Only None (e.g. ak.firsts after a cut that removed every object)
+                return np.zeros(len(block_index), dtype=data.dtype), valid
+            return data[np.where(valid, block_index, 0)], (None if valid.all() else valid)
+        return block
+
+    # Other layouts (e.g. nested option types): replace None with nan as before
+    values = ak.to_numpy(ak.fill_none(array, np.nan))
+    return lambda start, stop: (values[start:stop], None)
+
+# User call this function to fill a 1D Hist with an Awkward Array (or NumPy array) of values
+# and optional weights, without replacing None first
+# - A None value is counted in the overflow bin (with its weight), as a nan value would be
+# - A None weight counts as weight 0, i.e. the entry doesn't change the histogram
+# The bin contents are the same as filling ak.to_numpy(ak.fill_none(values, np.nan)) with
+# ak.to_numpy(ak.fill_none(weight, 0.0)), without the two full-size copies
+def fill_masked(h, values, weight=None, block_size=FILL_BLOCK_SIZE):
+    if weight is not None and len(weight) != len(values):
+        raise ValueError(f'weight has to have the same length as values. Got {len(weight)} and {len(values)}')
+    values_block = value_blocks(values)
+    weight_block = value_blocks(weight) if weight is not None else None
+    has_overflow = h.axes[0].traits.overflow
+
+    missing_count = 0 # Number (or sum of weights) of None values
+    missing_variance = 0 # Sum of squared weights of None values
+    for start in range(0, len(values), block_size):
+        stop = min(start + block_size, len(values))
+        x, x_valid = values_block(start, stop)
+        if weight_block is None:
+            if x_valid is None:
+                h.fill(x)
+            else:
+                h.fill(x[x_valid])
+                num_missing = len(x_valid) - np.count_nonzero(x_valid)
+                missing_count += num_missing
+                missing_variance += num_missing # Weight 1
+            continue
+
+        w, w_valid = weight_block(start, stop)
+        if w_valid is not None: # None weights count as 0
+            w = np.where(w_valid, w, 0)
+        if x_valid is None:
+            h.fill(x, weight=w)
+        else:
+            h.fill(x[x_valid], weight=w[x_valid])
+            missing_weights = w[~x_valid]
+            missing_count += missing_weights.sum()
+            missing_variance += np.square(missing_weights).sum()
+
+    # None values go to the overflow bin, like nan
+    if has_overflow and (missing_count or missing_variance):
+        view = h.view(flow=True)
+        if hasattr(view, 'variance'): # .Weight() storage
+            view.value[-1] += missing_count
+            view.variance[-1] += missing_variance
+        else:
+            view[-1] += missing_count
+    return h
+
+# User call this function to fill a Hist with several axes (e.g. a 2D Hist) with one array of values
+# per axis and optional weights, block by block as fill_masked()
+# An entry with None on any axis is filled as nan on that axis (counted in the flow bin if the axis has
+# one, dropped otherwise); a None weight counts as 0
+def fill_masked_nd(h, values, weight=None, block_size=FILL_BLOCK_SIZE):
+    if len(values) != len(h.axes):
+        raise ValueError(f'Expect one array of values per axis ({len(h.axes)}). Got {len(values)}')
+    length = len(values[0])
+    if any(len(i) != length for i in values) or (weight is not None and len(weight) != length):
+        raise ValueError('The arrays of values and weight must have the same length.')
+    values_blocks = [value_blocks(i) for i in values]
+    weight_block = value_blocks(weight) if weight is not None else None
+
+    for start in range(0, length, block_size):
+        stop = min(start + block_size, length)
+        args = []
+        for block in values_blocks:
+            x, x_valid = block(start, stop)
+            if x_valid is not None:
+                x = np.where(x_valid, x, np.nan)
+            args.append(x)
+        if weight_block is None:
+            h.fill(*args)
+        else:
+            w, w_valid = weight_block(start, stop)
+            if w_valid is not None: # None weights count as 0
+                w = np.where(w_valid, w, 0)
+            h.fill(*args, weight=w)
+    return h
+
+# User call this function to fill a Hist whose last axis is a category axis of variations (e.g. booked
+# with variations, see book_histogram()) with one NumPy array of values per other axis
+# weights is a list of weight arrays, one per category of the last axis (or None to fill counts)
+# The values are converted once for all variations, then each variation is filled with the same arrays
+# in a histogram with the other axes (reset between variations) and added to its slice of h
+# This is one pass over the values per variation. Computing the bin of each entry once and summing each
+# weight array with np.bincount was measured slower for chunks of 100k events or more (up to 3 times
+# with a few variations): the fill of boost-histogram is faster than np.bincount, and a .Weight()
+# storage needs a second bincount for the variances
+def fill_variations(h, values, weights=None):
+    axes, variation_axis = list(h.axes[:-1]), h.axes[-1]
+    if len(values) != len(axes):
+        raise ValueError(f'Expect one array of values per axis ({len(axes)}). Got {len(values)}')
+    if weights is not None and len(weights) != len(variation_axis):
+        raise ValueError(f'Expect one weight array per variation ({len(variation_axis)}). Got {len(weights)}')
+
+    view = h.view(flow=True)
+    offset = int(variation_axis.traits.underflow)
+    variation_hist = hist.Hist(*axes, storage=h.storage_type())
+    if weights is None: # Same counts in every variation
+        variation_hist.fill(*values)
+    for i in range(len(variation_axis)):
+        if weights is not None:
+            variation_hist.reset()
+            variation_hist.fill(*values, weight=weights[i])
+        variation_view = variation_hist.view(flow=True)
+        if h.storage_type is hist.storage.Weight:
+            view.value[..., offset + i] += variation_view.value
+            view.variance[..., offset + i] += variation_view.variance
+        else:
+            view[..., offset + i] += variation_view
+    return h
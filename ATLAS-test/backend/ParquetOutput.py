@@ -0,0 +1,133 @@
+import awkward as ak
+import pyarrow as pa
+import pyarrow.parquet as pq
+from .RangeIndex import parse_key, key_values, min_max, write_range_index
+
+# Default number of events per row group and per file written by a sample writer
+DEFAULT_ROW_GROUP_SIZE = 100_000
+DEFAULT_ROWS_PER_FILE = 1_000_000
+
+# This function creates a writer for one sample. The writer is a dict holding the state:
+# the open pq.ParquetWriter, the buffered events (less than one row group) and the footers
+# of the files already written (for the dataset-level _metadata file)
+# The min/max of each key in index_keys (e.g. 'mass' or 'photon_pt[0]') is recorded for
+# every row group in the range index of the sample directory
+def open_sample_writer(sample_out_dir, row_group_size=DEFAULT_ROW_GROUP_SIZE,
+                       max_rows_per_file=DEFAULT_ROWS_PER_FILE, index_keys=None):
+    if not isinstance(row_group_size, int) or row_group_size < 1:
+        raise ValueError(f'row_group_size must be a positive int. Got {row_group_size}')
+    if not isinstance(max_rows_per_file, int) or max_rows_per_file < row_group_size:
+        raise ValueError('max_rows_per_file must be an int not smaller than row_group_size. '
+                         f'Got {max_rows_per_file} and {row_group_size}')
+    return {
+        'directory' : sample_out_dir,
+        'row_group_size' : row_group_size,
+        'max_rows_per_file' : max_rows_per_file,
+        'writer' : None, # pq.ParquetWriter of the file being written
+        'schema' : None, # Schema of the file being written
+        'filename' : None, # Name of the file being written
+        'file_rows' : 0, # Number of events in the file being written
+        'file_count' : 0, # Number of files opened
+        'buffer' : [], # Arrow tables waiting to be written
+        'buffered_rows' : 0,
+        'footers' : [], # Metadata of the files written
+        'index_keys' : list(index_keys or []),
+        'range_index' : {key : {} for key in index_keys or []}, # Min/max of each key per row group
+    }
+
+# Close the file being written and keep its footer for the _metadata file
+def close_sample_file(state):
+    if state['writer'] is None:
+        return
+    state['writer'].close()
+    footer = pq.read_metadata(f"{state['directory']}/{state['filename']}")
+    footer.set_file_path(state['filename']) # Path relative to the _metadata file
+    state['footers'].append(footer)
+    state['writer'] = None
+    state['file_rows'] = 0
+
+# Open a new file with the given schema
+def open_sample_file(state, schema):
+    state['filename'] = f"chunk{state['file_count']}.parquet"
+    state['writer'] = pq.ParquetWriter(f"{state['directory']}/{state['filename']}", schema)
+    state['schema'] = schema
+    state['file_count'] += 1
+
+# Write one row group (an Arrow table) to the current file, rolling over to a new file when the
+# table would take the file over max_rows_per_file or when the schema of the table doesn't fit in it
+def write_row_group(state, table):
+    if state['writer'] is not None and not table.schema.equals(state['schema']):
+        try: # e.g. a field that has no None in this table is stored as not nullable
+            table = table.cast(state['schema'])
+        except (ValueError, pa.ArrowInvalid, pa.ArrowNotImplementedError):
+            close_sample_file(state) # e.g. None found in a field stored as not nullable
+    if state['writer'] is not None and state['file_rows'] + len(table) > state['max_rows_per_file']:
+        close_sample_file(state)
+    if state['writer'] is None:
+        open_sample_file(state, table.schema)
+    state['writer'].write_table(table, row_group_size=state['row_group_size'])
+    state['file_rows'] += len(table)
+
+    # Record the min/max of the index keys for this row group
+    for key in state['index_keys']:
+        base_var, _ = parse_key(key)
+        values = key_values(ak.from_arrow(table.select([base_var])), key)
+        state['range_index'][key].setdefault(state['filename'], []).append(min_max(values))
+
+# Write the buffered events as full row groups (all of them if final is True)
+def flush_sample_writer(state, final=False):
+    if not state['buffer']:
+        return
+    table = pa.concat_tables(state['buffer'], promote_options='permissive')
+    state['buffer'] = []
+    state['buffered_rows'] = 0
+    start = 0
+    while len(table) - start >= state['row_group_size']:
+        write_row_group(state, table.slice(start, state['row_group_size']))
+        start += state['row_group_size']
+    if start < len(table):
+        if final: # Last row group of the sample
+            write_row_group(state, table.slice(start))
+        else: # Keep the remaining events until there are enough for a full row group
+            state['buffer'].append(table.slice(start))
+            state['buffered_rows'] = len(table) - start
+
+# This function adds the events of an Arrow table to the sample. Events are written as soon
+# as there are enough of them to fill a row group, so at most one row group is held in memory
+def write_sample_table(state, table):
+    if len(table) == 0:
+        return
+    state['buffer'].append(table)
+    state['buffered_rows'] += len(table)
+    if state['buffered_rows'] >= state['row_group_size']:
+        flush_sample_writer(state)
+
+# This function adds the events of an Awkward Array to the sample
+def write_sample_chunk(state, arr):
+    if len(arr) == 0:
+        return
+    write_sample_table(state, ak.to_arrow_table(arr))
+
+# This function closes the file being written without writing the remaining events, the _metadata
+# file and the range index. Used when an exception stops the writing of a sample
+def abort_sample_writer(state):
+    if state is not None and state['writer'] is not None:
+        state['writer'].close()
+        state['writer'] = None
+
+# This function writes the remaining events, closes the last file and writes the dataset-level
+# _metadata file (schema and row group statistics of all files) and the range index (if any key
+# in index_keys). Returns the number of files written
+def close_sample_writer(state):
+    flush_sample_writer(state, final=True)
+    close_sample_file(state)
+    if state['index_keys']:
+        write_range_index(state['directory'], state['range_index'])
+    footers = state['footers']
+    if footers:
+        schemas = [footer.schema.to_arrow_schema() for footer in footers]
+        if all(schema.equals(schemas[0]) for schema in schemas):
+            pq.write_metadata(schemas[0], f"{state['directory']}/_metadata", metadata_collector=footers)
+        else: # Row groups of files with different schemas can't be combined in one footer
+            print(f"Files in {state['directory']} have different schemas. _metadata not written.")
+    return len(footers)
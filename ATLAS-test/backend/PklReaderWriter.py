@@ -1,15 +1,121 @@
 import os
+import time
 import pickle
+import struct
 import datetime
-from zoneinfo import ZoneInfo 
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from zoneinfo import ZoneInfo
+
+VALID_COMPRESSION = [None, 'zstd']
+# Compressed pickle files (compression='zstd') are written as <filename>.pklz:
+#   PKLZ_MAGIC, blocks of (segment, raw size, compressed size : 3 little-endian uint64, compressed data)
+# Blocks that don't get smaller (e.g. random kinematic values) are stored as they are (compressed size
+# equal to raw size), as decompressing them would cost more time than reading them
+# Segment 0 is the pickle stream and the next segments are the large buffers of the data (e.g. the
+# NumPy buffers of Awkward Arrays), pickled out-of-band so they are compressed straight from the
+# arrays without being copied into the pickle stream. Each segment is cut in blocks of block_size bytes
+# that are compressed and decompressed by several threads (zstd releases the GIL)
+PKLZ_MAGIC = b'ATLASPKLZ1\n'
+BLOCK_HEADER = struct.Struct('<QQQ')
+DEFAULT_BLOCK_SIZE = 16 * 1024**2 # 16 MiB
+DEFAULT_NUM_THREADS = 4
+
+# Return the zstd codec of pyarrow (used to read the parquet files)
+def zstd_codec(level=None):
+    import pyarrow as pa
+    return pa.Codec('zstd', compression_level=level)
+
+# This function yields (segment index, block) for the blocks of the pickle stream and out-of-band buffers
+# An empty segment gives one empty block, so that the reader knows about it
+def segment_blocks(segments, block_size):
+    for index, segment in enumerate(segments):
+        view = segment.raw() if isinstance(segment, pickle.PickleBuffer) else memoryview(segment).cast('B')
+        if not len(view):
+            yield index, view
+        for start in range(0, len(view), block_size):
+            yield index, view[start : start + block_size]
+
+# This function writes data to a compressed pickle file, compressing num_threads blocks at a time
+# At most 2 * num_threads blocks are held in memory, whatever the size of data
+# Returns the number of bytes before and after compression
+def write_compressed(data, f, level, num_threads, block_size):
+    buffers = []
+    stream = pickle.dumps(data, protocol=5, buffer_callback=buffers.append)
+    codec = zstd_codec(level)
+    raw_size = compressed_size = 0
+    f.write(PKLZ_MAGIC)
+    def write_block(index, block, future):
+        nonlocal raw_size, compressed_size
+        size = len(block)
+        compressed = future.result()
+        if len(compressed) >= size: # Store the block as it is
+            compressed = block
+        f.write(BLOCK_HEADER.pack(index, size, len(compressed)))
+        f.write(compressed)
+        raw_size += size
+        compressed_size += BLOCK_HEADER.size + len(compressed)
+
+    with ThreadPoolExecutor(max_workers=num_threads) as executor:
+        pending = deque()
+        for index, block in segment_blocks([stream] + buffers, block_size):
+            pending.append((index, block, executor.submit(codec.compress, block, asbytes=True)))
+            if len(pending) >= 2 * num_threads: # Write the oldest block, in order
+                write_block(*pending.popleft())
+        while pending:
+            write_block(*pending.popleft())
+    return raw_size, compressed_size + len(PKLZ_MAGIC)
+
+# This function reads a compressed pickle file (after PKLZ_MAGIC), decompressing the blocks with num_threads threads
+# The blocks are appended to their segment in file order as they are decompressed, with at most
+# 2 * num_threads blocks read ahead, so only the decompressed data and a few blocks are held in memory
+def read_compressed(f, num_threads):
+    codec = zstd_codec()
+    segments = [] # Blocks put together (writable, as the arrays of pickle.load())
+    def add_block(index, block):
+        if not isinstance(block, bytes):
+            block = block.result()
+        if index == len(segments): # First block of the next segment
+            segments.append(bytearray())
+        elif index != len(segments) - 1:
+            raise ValueError(f'Block of segment {index} found after segment {len(segments) - 1}. The file is corrupted.')
+        segments[index] += memoryview(block)
+
+    with ThreadPoolExecutor(max_workers=num_threads) as executor:
+        pending = deque() # (segment index, stored block or future of the decompressed block)
+        while True:
+            block_header = f.read(BLOCK_HEADER.size)
+            if not block_header:
+                break
+            index, size, compressed_size = BLOCK_HEADER.unpack(block_header)
+            compressed = f.read(compressed_size)
+            if compressed_size < size:
+                compressed = executor.submit(codec.decompress, compressed, size)
+            pending.append((index, compressed))
+            if len(pending) >= 2 * num_threads: # Add the oldest block, in order
+                add_block(*pending.popleft())
+        while pending:
+            add_block(*pending.popleft())
+    return pickle.loads(segments[0], buffers=segments[1:])
 
 # This function writes data to a pickle file
 # filename can be set by user, otherwise a unique filename will be created using
 # current date and time
-def pkl_writer(data, output_filename=''):
+# The file is written under a temporary name and renamed at the end, so a pickle file is never incomplete
+# Set compression='zstd' to compress the file (written as <filename>.pklz instead of <filename>.pkl)
+# with num_threads threads, level from 1 (fastest) to 22 (smallest). The throughput and compression
+# ratio are printed
+def pkl_writer(data, output_filename='', compression=None, level=3, num_threads=DEFAULT_NUM_THREADS,
+               block_size=DEFAULT_BLOCK_SIZE):
+    if compression not in VALID_COMPRESSION:
+        raise ValueError(f'Invalid compression "{compression}". Valid compression: {VALID_COMPRESSION}')
+    if not isinstance(num_threads, int) or num_threads < 1:
+        raise ValueError(f'num_threads must be a positive int. Got {num_threads}')
+    if not isinstance(block_size, int) or block_size < 1:
+        raise ValueError(f'block_size must be a positive int. Got {block_size}')
     if not output_filename:
-        os.makedirs('output_pkl', exist_ok=True) 
-        # Use current time to create a unique filename 
+        os.makedirs('output_pkl', exist_ok=True)
+        # Use current time to create a unique filename
         now = datetime.datetime.now(ZoneInfo("Europe/London"))
         strf = now.strftime("%Y%m%d%H%M") # Set time format
         output_filename = f'output_pkl/pkl_writer{strf}'
@@ -17,21 +123,43 @@ def pkl_writer(data, output_filename=''):
         # Extract the directory component of a path
         output_dir = os.path.dirname(output_filename)
         if output_dir:
-            os.makedirs(output_dir, exist_ok=True) 
-    # Dump data to a pickle file
-    with open(f"{output_filename}.pkl", "wb") as f: 
-        pickle.dump(data, f)
+            os.makedirs(output_dir, exist_ok=True)
+
+    filename = f"{output_filename}.pkl" if compression is None else f"{output_filename}.pklz"
+    tmp_filename = f'{filename}.tmp{os.getpid()}'
+    time_start = time.time()
+    try:
+        with open(tmp_filename, "wb") as f:
+            if compression is None:
+                # Dump data to a pickle file
+                pickle.dump(data, f)
+            else:
+                raw_size, compressed_size = write_compressed(data, f, level, num_threads, block_size)
+        os.replace(tmp_filename, filename)
+    finally:
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+
+    if compression is not None:
+        elapsed_time = time.time() - time_start
+        print(f'{raw_size / 1e6:.1f} MB written as {compressed_size / 1e6:.1f} MB '
+              f'(compression ratio {raw_size / max(compressed_size, 1):.2f}) in {elapsed_time:.1f}s '
+              f'({raw_size / 1e6 / max(elapsed_time, 1e-9):.0f} MB/s)')
     return output_filename
 
 # This function reads a pickle file
-def pkl_reader(filename):
+# Compressed files written by pkl_writer() are decompressed with num_threads threads
+def pkl_reader(filename, num_threads=DEFAULT_NUM_THREADS):
     try:
         # Load data from a pickle file
         with open(f"{filename}", "rb") as f:
-            data = pickle.load(f)
+            if f.read(len(PKLZ_MAGIC)) == PKLZ_MAGIC:
+                data = read_compressed(f, num_threads)
+            else:
+                f.seek(0)
+                data = pickle.load(f)
         return data
     except FileNotFoundError:
         print(f'Error: The file "{filename}" was not found.')
     except Exception as e:
         print(f'An unexpected error occured: {e}')
-    
\ No newline at end of file
@@ -5,6 +5,8 @@ import matplotlib.pyplot as plt # for plotting
 from matplotlib.ticker import AutoMinorLocator # for minor ticks
 import hist
 from hist import Hist
+from .MaskedFill import fill_masked
+from .Rebinning import rebin_histogram
 
 def plt_errorbar(main_axes, key, value, xmin, xmax, num_bins, marker):
 #  data =
@@ -24,13 +26,17 @@ def plt_errorbar(main_axes, key, value, xmin, xmax, num_bins, marker):
 
     txt = []
     
-    # Replace any None with nan then convert to numpy array
-    array = ak.to_numpy(ak.fill_none(array, np.nan))
-
-    if weight is not None: # Use storage.Weight() if weight provided by user
-        weight = ak.to_numpy(ak.fill_none(weight, 0.0))
+    if isinstance(array, hist.Hist): # Pre-filled histogram, rebinned if finer
+        h = rebin_histogram(array, num_bins, xmin, xmax)
+    elif weight is not None: # Use storage.Weight() if weight provided by user
         h = Hist.new.Reg(num_bins, xmin, xmax, name=key).Weight()
-        h.fill(array, weight=weight)
+        # None values go to the overflow bin, None weights count as 0
+        fill_masked(h, array, weight)
+    else: # Use storage.Double() if weight not given by user
+        h = Hist.new.Reg(num_bins, xmin, xmax, name=key).Double()
+        fill_masked(h, array) # None values go to the overflow bin
+
+    if h.storage_type is hist.storage.Weight:
         view = h.view(flow=False) # 2d array, need unpacking as below
         data_points = view.value # bin values
         data_err = np.sqrt(view.variance)
@@ -39,9 +45,7 @@ def plt_errorbar(main_axes, key, value, xmin, xmax, num_bins, marker):
                     f'variance = {h.sum().variance:.3e}),')
         txt.append(f'Underflow = {h.view()[0].value:.3e}, '
                    f'Overflow = {h.view()[-1].value:.3e}')
-    else: # Use storage.Double() if weight not given by user
-        h = Hist.new.Reg(num_bins, xmin, xmax, name=key).Double()
-        h.fill(array)
+    else:
         data_points =  h.view(flow=False) # flat array, no need unpacking
         data_err = np.sqrt(data_points)
         # Text annotations
@@ -60,6 +64,7 @@ def plt_errorbar(main_axes, key, value, xmin, xmax, num_bins, marker):
 # label1 : {array : Array[...], weight : Array[...], color : str},
 # label2 : {array : Array[...], weight : None, color : str},
 # }
+# array may also be a filled 1D Hist (with weight None), rebinned to num_bins from xmin to xmax if finer
 # This function aims to plot different variables on a single figure, or
 # plot histograms produced under different selection cut as data points
 # with errorbar for better visual comparison
@@ -113,6 +118,8 @@ def plot_errorbars(data_dict,
         
         if isinstance(array, str):
             raise TypeError(f'{key} dict : The value of the inner key "array" should be an array. Got a str instead')
+        if isinstance(array, hist.Hist) and weight is not None:
+            raise ValueError(f'{key} dict : The value of the inner key "weight" should be None when "array" is a filled Hist')
         if weight is not None:
             if isinstance(weight, (str, int, float)):
                 raise TypeError(f'{key} dict : The value of the inner key "weight" should be an array or None. Got a {type(weight)} instead')
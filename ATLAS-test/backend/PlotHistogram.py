@@ -1,67 +1,93 @@
-import re
 import time
 import awkward as ak
 import numpy as np # # for numerical calculations such as histogramming
 import matplotlib.pyplot as plt # for plotting
 from matplotlib.ticker import AutoMinorLocator # for minor ticks
+from matplotlib.container import BarContainer
 import hist
 from hist import Hist 
-
-# This function returns a flat Awkward array for a variable using dict key and value input
-def get_variable_data(variable, key, value, valid_var):
-    if variable in valid_var:
-        variable_data = value[variable] # Expect a flat array
-        # Check if the array is nested
-        type_str = str(ak.type(variable_data))
-        # Raise error if array is nested
-        if "var *" in type_str or re.search(r"\*\s*\d+\s*\*", type_str):
-            raise ValueError(f'Invalid input variable format : {variable}. '
-                             f'Expect "{variable}[int]".')
-    else:
-        # '[]' given in input. e.g. lep_pt[0]
-        if '[' in variable and ']' in variable:
+from .MaskedFill import fill_masked, fill_masked_nd
+from .Rebinning import rebin_histogram
+from .HistogramCache import array_fingerprint, cached_histogram, store_histogram
+from .DerivedColumns import cached_element_at
+
+# Ways of drawing the stacked MC histograms
+# 'bars' : one bar per bin and sample (matplotlib Rectangle artists)
+# 'stairs' : one filled step patch per sample and one for the uncertainty band, much faster to draw
+#            and save when there are many bins
+VALID_RENDER = ['bars', 'stairs']
+
+# Variables already parsed, e.g. {'lep_pt[0]' : ('lep_pt', 0)}
+_parsed_variables = {}
+
+# This function splits an input variable into the name of the array and the index, once per variable
+# e.g. 'lep_pt[0]' gives ('lep_pt', 0) and 'mass' gives ('mass', None)
+def parse_variable(variable):
+    if variable not in _parsed_variables:
+        if '[' in variable and variable.endswith(']'):
             base_var = variable.split('[')[0] # this will be 'lep_pt'
             try:
-                # Index starting and ending position in the str
-                idx_pos_start = variable.find('[') + 1 
-                idx_pos_end = variable.find(']')
                 # Extract the '0' from 'lep_pt[0]'
-                index = variable[idx_pos_start : idx_pos_end]
-                index = int(index) # Try converting str to int
-            except Exception as e:
-                print(f'Invalid input variable format : "{variable}". '
-                      f'Expect "variable" or "variable[int]".\nError: {e}')
-
-            # Check if this is a nest array
-            variable_data = value[base_var]
-            type_str = str(ak.type(value[base_var]))
-            is_nested = "var *" in type_str or re.search(r"\*\s*\d+\s*\*", type_str)
-            if is_nested:
-                # Find out the maximum length of variable array among all events
-                num = ak.num(variable_data)
-                max_num = ak.max(num)
-                if index >= max_num: # Index out of range
-                   raise IndexError(f'Invalid index for input variable "{variable}". '
-                                    f'Input index should be less than {max_num}.')
-                # If all events have the variable array of same length, no need padding with none
-                # because it takes up a lot memory
-                if not ak.all(num >= index + 1):
-                    data = ak.pad_none(data, index + 1, axis=-1)
-
-                variable_data = value[base_var][:, index] # Slice the array
-            else: # Raise error if user wants to slice a flat array with [:, index]
+                index = int(variable[variable.find('[') + 1 : -1])
+            except ValueError as e:
                 raise ValueError(f'Invalid input variable format : "{variable}". '
-                                 f'Did you mean "{base_var}"?')
-        # End of if statement (if '[' and ']' present in input variable)
+                                 f'Expect "variable" or "variable[int]".\nError: {e}') from None
+            _parsed_variables[variable] = (base_var, index)
         elif '[' in variable or ']' in variable:
             raise ValueError('Expect input variable to be "variable" or "variable[int]".'
                              'Perhaps you forgot a "[" or "]"?')
         else:
-            raise ValueError(f"Variable '{variable}' not found in sample '{key}'. Available variable(s):"
-                       f"{valid_var}")
-    return variable_data
+            _parsed_variables[variable] = (variable, None)
+    return _parsed_variables[variable]
+
+# Return True if an array holds a list (or a fixed-size array) per event
+def is_nested(array):
+    return ak.to_layout(array).purelist_depth > 1
+
+# This function returns a flat Awkward array for a variable using dict key and value input
+# The entries of e.g. 'lep_pt[0]' are extracted once per array (see cached_element_at())
+# Events that don't have an entry at the index give None
+def get_variable_data(variable, key, value, valid_var):
+    if variable in valid_var:
+        variable_data = value[variable] # Expect a flat array
+        # Raise error if array is nested
+        if is_nested(variable_data):
+            raise ValueError(f'Invalid input variable format : {variable}. '
+                             f'Expect "{variable}[int]".')
+        return variable_data
+
+    base_var, index = parse_variable(variable)
+    if index is None or base_var not in valid_var:
+        raise ValueError(f"Variable '{variable}' not found in sample '{key}'. Available variable(s):"
+                         f"{valid_var}")
+    # '[]' given in input. e.g. lep_pt[0]
+    variable_data = value[base_var]
+    if not is_nested(variable_data): # Raise error if user wants to slice a flat array with [:, index]
+        raise ValueError(f'Invalid input variable format : "{variable}". '
+                         f'Did you mean "{base_var}"?')
+    try:
+        return cached_element_at(variable_data, index, check_range=True)
+    except IndexError as e: # Index out of range
+        raise IndexError(f'Invalid index for input variable "{variable}". {e}') from None
 # End of get_variable_data() function
 
+# This function returns the pre-filled Hist of a sample for a variable (e.g. from fill_histograms())
+# or None if the sample holds arrays. A finer Hist (e.g. booked with book_fine_histogram()) is rebinned
+# to num_bins from xmin to xmax. Raise error if these bins can't be derived from the Hist
+def prefilled_histogram(key, value, variable, xmin, xmax, num_bins):
+    if not isinstance(value, dict) or not isinstance(value.get(variable), hist.Hist):
+        return None
+    h = value[variable]
+    if len(h.axes) != 1:
+        raise ValueError(f'Key "{key}" : Histogram "{variable}" has {len(h.axes)} axes. Expect a 1D histogram.')
+    try:
+        h = rebin_histogram(h, num_bins, xmin, xmax)
+    except ValueError as e:
+        raise ValueError(f'Key "{key}" : Histogram "{variable}" : {e}') from None
+    if 'Data' not in key and h.storage_type is not hist.storage.Weight:
+        raise TypeError(f'Key "{key}" : Histogram "{variable}" must have a Weight storage.')
+    return h
+
 # This function plots data points if 'Data' in the key, 
 # plots stacked histogram on top of background if 'Signal' in the key
 # Can plot stacked histograms for multiple Signal and Background entries
@@ -70,18 +96,19 @@ def get_variable_data(variable, key, value, valid_var):
 # 'Signal' : Ak.array(...),
 # 'Background' : Ak.array(...)
 #}
+# A value may also be a dict of pre-filled Hist objects (see fill_histograms()), used instead of filling
+# render chooses how the MC stacks are drawn (see VALID_RENDER). If rasterized is True, the stacks and
+# the uncertainty band are rasterized when the figure is saved in a vector format (e.g. pdf)
 def stacked_histogram(data_dict, color_list, variable, xmin, xmax, 
                       num_bins, main_axes, marker, show_back_unc, 
                       residual_axes, x_label, label_fontsize, 
-                      tick_labelsize, residual_plot_ylim):
-    background_x = [] # hold the MC background histogram entries
-    background_weights = [] # hold the MC background weights
+                      tick_labelsize, residual_plot_ylim, render='bars', rasterized=False):
+    background_hists = [] # hold the MC background histograms
     background_colors = [] # hold the colors of the MC bars
     background_labels = [] # hold the legend labels of the MC bar
 
     # Similarly, for MC signal
-    signal_x = []
-    signal_weights = []
+    signal_hists = []
     signal_colors = []
     signal_labels = []
 
@@ -109,20 +136,18 @@ def stacked_histogram(data_dict, color_list, variable, xmin, xmax,
             print(f'Key "{key}" : Unexpected type of dict value. Expect dict or Awkward Array.')
             raise TypeError
         
-        # Validate the input variable
-        variable_data = get_variable_data(variable, key, value, valid_var)
+        # Pre-filled, cached or newly filled histogram of the sample
+        h = sample_histogram(key, value, variable, valid_var, xmin, xmax, num_bins)
 
         # Plot data points
         if 'Data' in key:
-            hist_data = Hist.new.Reg(num_bins, xmin, xmax, name=key).Double()
-            # Fill values, replacing any None with nan first
-            hist_data.fill(ak.to_numpy(ak.fill_none(variable_data, np.nan)))
+            hist_data = h
             # For text annotation
-            text.append(f'({bullets}) {key}: Sum (value = {sum(hist_data.view(flow=False)):.3e}),')
-            text.append(f'Underflow = {hist_data.view(flow=True)[0]:.3e}, Overflow = {hist_data.view(flow=True)[-1]:.3e}\n')
+            text.append(f'({bullets}) {key}: Sum (value = {sum(hist_data.values(flow=False)):.3e}),')
+            text.append(f'Underflow = {hist_data.values(flow=True)[0]:.3e}, Overflow = {hist_data.values(flow=True)[-1]:.3e}\n')
             bullets += 1
             
-            data_x = hist_data.view(flow=False) # histogram bin values
+            data_x = hist_data.values(flow=False) # histogram bin values
             data_x_errors = np.sqrt(data_x) # statistical error on the data
             hists.append(hist_data)
             
@@ -131,38 +156,24 @@ def stacked_histogram(data_dict, color_list, variable, xmin, xmax,
                                 marker=marker, color=color, linestyle='none',
                                 label=key) 
         elif 'Signal' in key:
-            signal_x.append(ak.to_numpy(ak.fill_none(variable_data, np.nan)))
-            if 'totalWeight' in valid_var:
-                signal_weights.append(ak.to_numpy(value['totalWeight']))
-            else: # assume totalWeight = 1 if 'totalWeight' not in field
-                signal_weights.append(np.ones(len(variable_data)))
+            signal_hists.append(h)
             signal_colors.append(color) # bar color
             signal_labels.append(key) # legend label
             signal_input = True # MC signal present
         else:
-            background_x.append(ak.to_numpy(ak.fill_none(variable_data, np.nan)))
-            if 'totalWeight' in valid_var:
-                background_weights.append(ak.to_numpy(value['totalWeight']))
-            else: # assume totalWeight = 1 if 'totalWeight' not in field
-                background_weights.append(np.ones(len(variable_data)))
+            background_hists.append(h)
             background_colors.append(color)
             background_labels.append(key)
             background_input = True # Background signal present
         
     if background_input: # Background signal present
-        background_hists = []
-        # Make histograms
-        for back_data, back_weight, label in zip(background_x, background_weights, background_labels):
-            # hist.storage.Weight() for MC data
-            back_hist = Hist.new.Reg(num_bins, xmin, xmax, name=label).Weight()
-            back_hist.fill(back_data, weight=back_weight)
+        for back_hist, label in zip(background_hists, background_labels):
             # For text annotations
             text.append(f'({bullets}) {label}: Weighted Sum (value = {back_hist.sum().value:.3e}, '
                         f'variance = {back_hist.sum().variance:.3e}),')
             text.append(f'Underflow = {back_hist.view(flow=True)[0].value:.3e}, Overflow = {back_hist.view(flow=True)[-1].value:.3e}')
             bullets += 1
             
-            background_hists.append(back_hist)
             hists.append(back_hist)
 
         # Total count of background data and variance
@@ -173,26 +184,23 @@ def stacked_histogram(data_dict, color_list, variable, xmin, xmax,
         # Plot the MC bars
         # bottom for each histogram, will be updated in the loop to stack histograms
         bottom = np.zeros_like(back_stacked_counts)
-        for h, color, label in zip(background_hists, background_colors, background_labels):
-            # Plot stacked histogram bars
-            counts = h.view(flow=False).value
-            main_axes.bar(x=bin_centres, height=counts, width=widths, bottom=bottom, color=color, label=label, align='center')
-            bottom += counts # To stack histograms
+        bottom = draw_stack(main_axes, background_hists, background_colors, background_labels, bottom,
+                            bin_edges, bin_centres, widths, render, rasterized)
 
         if show_back_unc:
             # Plot the statistical uncertainty
-            main_axes.bar(x=bin_centres, height=stat_err*2, width=widths, bottom=bottom-stat_err, color='none', hatch="////", label='Stat. Unc.', align='center')
+            if render == 'stairs':
+                draw_stairs(main_axes, bottom + stat_err, bottom - stat_err, bin_edges, 'Stat. Unc.', rasterized,
+                            facecolor='none', edgecolor='black', linewidth=0, hatch='////')
+            else:
+                main_axes.bar(x=bin_centres, height=stat_err*2, width=widths, bottom=bottom-stat_err, color='none', hatch="////",
+                              label='Stat. Unc.', align='center', rasterized=rasterized)
         
     else: # No background MC present, Signal histogram will be stacked at y=0
         back_stacked_counts = np.zeros(len(bin_centres))
     
     if signal_input: # MC signal present
-        signal_hists = []
-        # Make histograms
-        for data, weight, label in zip(signal_x, signal_weights, signal_labels):
-            # hist.storage.Weight() for MC data
-            signal_hist = Hist.new.Reg(num_bins, xmin, xmax, name=label).Weight()
-            signal_hist.fill(data, weight=weight)
+        for signal_hist, label in zip(signal_hists, signal_labels):
             # For text annotations
             text.append(f'({bullets}) {label}: Weighted Sum (value = {signal_hist.sum().value:.3e}, '
                         f'Variance = {signal_hist.sum().variance:.3e}),')
@@ -200,7 +208,6 @@ def stacked_histogram(data_dict, color_list, variable, xmin, xmax,
                         f'Overflow = {signal_hist.view(flow=True)[-1].value:.3e}')
             bullets += 1
             
-            signal_hists.append(signal_hist)
             hists.append(signal_hist)
             
         # Total count of signal data
@@ -209,11 +216,8 @@ def stacked_histogram(data_dict, color_list, variable, xmin, xmax,
         # Plot the bars
         # bottom starts from the y-values of stacked background histogram bin values
         bottom = back_stacked_counts.copy() # Will be updated in the loop to stack Signal histogram
-        for h, color, label in zip(signal_hists, signal_colors, signal_labels):
-            counts = h.view(flow=False).value
-            main_axes.bar(x=bin_centres, height=counts, width=widths, bottom=bottom, color=color,
-                    label=label, align='center')
-            bottom += counts
+        draw_stack(main_axes, signal_hists, signal_colors, signal_labels, bottom,
+                   bin_edges, bin_centres, widths, render, rasterized)
     else: # No Signal present, no signal stacked
         stacked_counts = np.zeros(len(bin_centres))
 
@@ -249,6 +253,81 @@ def stacked_histogram(data_dict, color_list, variable, xmin, xmax,
                 residual_axes.set_ylim(residual_plot_ylim[0], residual_plot_ylim[1])
     return bin_centres, hists, text
 
+# This function draws the MC histograms stacked on top of bottom and returns the top of the stack
+# With render='stairs' each histogram is one filled step patch instead of one bar per bin
+def draw_stack(main_axes, hists, colors, labels, bottom, bin_edges, bin_centres, widths,
+               render, rasterized):
+    bottom = bottom.copy()
+    for h, color, label in zip(hists, colors, labels):
+        counts = h.view(flow=False).value
+        if render == 'stairs':
+            draw_stairs(main_axes, bottom + counts, bottom.copy(), bin_edges, label, rasterized, color=color)
+        else:
+            main_axes.bar(x=bin_centres, height=counts, width=widths, bottom=bottom, color=color,
+                          label=label, align='center', rasterized=rasterized)
+        bottom += counts # To stack histograms
+    return bottom
+
+# This function draws one filled step patch from baseline to top
+# The patch is put in a BarContainer so that the legend lists it in the same order as bars
+def draw_stairs(main_axes, top, baseline, bin_edges, label, rasterized, **kwargs):
+    patch = main_axes.stairs(top, bin_edges, baseline=baseline, fill=True,
+                             label='_nolegend_', rasterized=rasterized, **kwargs)
+    main_axes.add_container(BarContainer([patch], label=label))
+
+# This function returns the key of the histogram of a sample in the histogram cache, or None if
+# the variable is not found (get_variable_data() then raises the error). The key holds the
+# fingerprints of the column of the variable and of the weight column, and the binning, so that
+# re-plotting the same arrays with other colors, fonts, ylim etc. doesn't fill the histogram again
+def histogram_cache_key(key, value, variable, valid_var, xmin, xmax, num_bins):
+    column = variable if variable in valid_var else variable.split('[')[0]
+    if column not in valid_var:
+        return None
+    if 'Data' not in key and 'totalWeight' in valid_var:
+        weight_fingerprint = array_fingerprint(value['totalWeight'])
+    else:
+        weight_fingerprint = None
+    return (key, variable, num_bins, float(xmin), float(xmax),
+            array_fingerprint(value[column]), weight_fingerprint)
+
+# This function returns the histogram of a sample for a variable: the pre-filled Hist if any,
+# otherwise the cached histogram of the same arrays and binning, otherwise a new filled histogram
+def sample_histogram(key, value, variable, valid_var, xmin, xmax, num_bins):
+    prefilled = prefilled_histogram(key, value, variable, xmin, xmax, num_bins)
+    if prefilled is not None:
+        return prefilled
+    cache_key = histogram_cache_key(key, value, variable, valid_var, xmin, xmax, num_bins)
+    h = cached_histogram(cache_key) if cache_key is not None else None
+    if h is not None:
+        return h
+
+    variable_data = get_variable_data(variable, key, value, valid_var)
+    if 'Data' in key:
+        h = Hist.new.Reg(num_bins, xmin, xmax, name=key).Double()
+        # Fill values, None values go to the overflow bin
+        fill_masked(h, variable_data)
+    else:
+        h = mc_histogram(key, value, variable_data, valid_var, xmin, xmax, num_bins)
+    if cache_key is not None:
+        store_histogram(cache_key, h)
+    return h
+
+# This function fills the histogram of a MC sample (signal or background) for a variable
+def mc_histogram(key, value, variable_data, valid_var, xmin, xmax, num_bins):
+    if 'totalWeight' in valid_var:
+        weight = ak.to_numpy(value['totalWeight'])
+    else: # assume totalWeight = 1 if 'totalWeight' not in field
+        weight = np.ones(len(variable_data))
+    # hist.storage.Weight() for MC data
+    h = Hist.new.Reg(num_bins, xmin, xmax, name=key).Weight()
+    fill_masked(h, variable_data, weight)
+    return h
+
+# Validate the render input of plot_stacked_hist() and plot_histograms()
+def validate_render(render):
+    if render not in VALID_RENDER:
+        raise ValueError(f'Invalid render "{render}". Valid render: {VALID_RENDER}')
+
 # Helper function to plot_stacked_hist to validate input
 def validate_plotting_input(data_dict, color_list, num_bins, xmin, xmax, fig_size,
                             ylim, residual_plot_ylim):
@@ -336,11 +415,14 @@ def plot_stacked_hist(data_dict, # see above
                         fig_name=None, # Filename of the image. If not provided, save figure using the plot_variable
                                       # and the keys of data_dict
                         residual_plot=False, # Whether to plot residual plot
-                        residual_plot_ylim=None # A tuple of 2 numbers. Residual plot y-axis limit
+                        residual_plot_ylim=None, # A tuple of 2 numbers. Residual plot y-axis limit
+                        render='bars', # How to draw the MC stacks, 'bars' or 'stairs' (faster for many bins)
+                        rasterized=False # Whether to rasterize the MC stacks in vector output (e.g. pdf)
                    ):
 
     # Validate input
     validate_plotting_input(data_dict, color_list, num_bins, xmin, xmax, fig_size, ylim, residual_plot_ylim)
+    validate_render(render)
 
     time_start = time.time()
 
@@ -354,7 +436,8 @@ def plot_stacked_hist(data_dict, # see above
         residual_axes = None
 
     # Plot stacked histograms
-    bin_centres, hists, text = stacked_histogram(data_dict, color_list, plot_variable, xmin, xmax, num_bins, main_axes, marker, show_back_unc, residual_axes, x_label, label_fontsize, tick_labelsize, residual_plot_ylim)
+    bin_centres, hists, text = stacked_histogram(data_dict, color_list, plot_variable, xmin, xmax, num_bins, main_axes, marker, show_back_unc, residual_axes, x_label, label_fontsize, tick_labelsize, residual_plot_ylim,
+                                                 render, rasterized)
 
     # Plot fit
     if fit is not None:
@@ -422,21 +505,50 @@ def plot_stacked_hist(data_dict, # see above
 # End of plot_stacked_hist() function    
 
 # Plot 2D histogram
-def histogram_2d(data, # A tuple/list of two arrays for histogram along x and y axis
-                 num_bins, # A tuple/list of 2 numbers corresponding to the number of bins for
-                           # histogram along x and y axis
-                 min_max, # A tuple/list of 2 tuples, each with 2 numbers corresponding to the
-                          # bin range for histogram along x and y axis
-                 label, # A tuple/list of str
+# The histogram is filled block by block (None values are not counted) and drawn as an image,
+# so that maps of many events and fine grids stay fast. Pass the returned Hist back as histogram
+# to add more events (e.g. one chunk of a sample at a time) before plotting again
+def histogram_2d(data, # A tuple/list of two arrays for histogram along x and y axis,
+                       # or a pre-filled 2D Hist (e.g. from fill_histograms())
+                 num_bins=None, # A tuple/list of 2 numbers corresponding to the number of bins for
+                                # histogram along x and y axis (not used for a pre-filled Hist)
+                 min_max=None, # A tuple/list of 2 tuples, each with 2 numbers corresponding to the
+                               # bin range for histogram along x and y axis (not used for a pre-filled Hist)
+                 label=None, # A tuple/list of str (the axis labels of a pre-filled Hist if not given)
                  label_fontsize=12, 
                  tick_labelsize=10,
                  title_fontsize=13, 
                  title='', 
-                 colorbar_label='' # Label for colorbar
+                 colorbar_label='', # Label for colorbar
+                 weight=None, # Array of weights with the same length as the arrays (storage .Weight())
+                 histogram=None, # 2D Hist returned by a previous call, filled with the arrays
+                 dpi=None # Figure resolution (matplotlib default if None)
                 ):
+    # Plot a pre-filled histogram
+    if isinstance(data, hist.Hist):
+        if len(data.axes) != 2:
+            raise ValueError(f'Expect a 2D histogram. Got {len(data.axes)} axes.')
+        if label is None:
+            label = [axis.label for axis in data.axes]
+        if isinstance(label, str) or len(label) != 2:
+            raise ValueError('label must be a list or tuple of two str.')
+        return plot_histogram_2d(data, str(label[0]), str(label[1]), label_fontsize,
+                                 tick_labelsize, title_fontsize, title, colorbar_label, dpi)
+
+    h, label_x, label_y = fill_histogram_2d(data, num_bins, min_max, label, weight, histogram)
+    return plot_histogram_2d(h, label_x, label_y, label_fontsize, tick_labelsize,
+                             title_fontsize, title, colorbar_label, dpi)
+
+# Helper function to histogram_2d() to validate the input arrays and fill the 2D histogram
+# If histogram is given, the arrays are added to it (it must have the same binning)
+# Returns the Hist and the x and y axis labels
+def fill_histogram_2d(data, num_bins, min_max, label, weight=None, histogram=None):
+    if num_bins is None or min_max is None or label is None:
+        raise ValueError('num_bins, min_max and label must be provided to fill the histogram from arrays.')
+
     # Validate variable
     if (not isinstance(data, (list, tuple)) or
-        not all(isinstance(i, ak.Array) for i in data)
+        not all(isinstance(i, (ak.Array, np.ndarray)) for i in data)
        ):
         raise TypeError("data must be a list or tuple of two awkward arrays.")
         
@@ -447,6 +559,8 @@ def histogram_2d(data, # A tuple/list of two arrays for histogram along x and y
         or len(label) != 2
         ):
         raise ValueError('Each input must have exactly two elements.')
+    if len(data[0]) != len(data[1]):
+        raise ValueError(f'The arrays for x and y must have the same length. Got {len(data[0])} and {len(data[1])}')
 
     # Validate the number of bins
     if not all(isinstance(i, int) for i in num_bins): # Must be an int
@@ -463,36 +577,63 @@ def histogram_2d(data, # A tuple/list of two arrays for histogram along x and y
         if not (pair[1] - pair[0]) > 0:
             raise ValueError('The second number in each tuple/list of min_max must be larger than the first.')
 
+    # Validate weight
+    if weight is not None:
+        if isinstance(weight, (str, int, float)):
+            raise TypeError(f'weight found to be {type(weight)}. It should be None or an array that has the same length as the arrays in data')
+        if len(weight) != len(data[0]):
+            raise ValueError(f'weight has to have the same length as the arrays in data. Got {len(weight)} and {len(data[0])}')
+
     # Label of axes
     if isinstance(label, str):
         raise TypeError(f'label must be a list or tuple of two str. Got a str instead.')
     # Convert tuple input into list for assignment
     if isinstance(label, tuple):
         label = [label[0], label[1]]
-    # Assign variable to label if label for x or/and y is an empty string
+    # Use 'x' or 'y' as the label if label for x or/and y is an empty string
     for i, j in enumerate(label):
         if j:
             label[i] = str(j)
         else:
-            label[i] = variable[i]
+            label[i] = ['x', 'y'][i]
 
     # Extract values for x and y from inputs
-    data_x, data_y = data
     num_bins_x, num_bins_y = num_bins
     (xmin, xmax), (ymin, ymax) = min_max
     label_x, label_y = label
 
     # 2D Histogram
-    h = Hist(
-        hist.axis.Regular(num_bins_x, xmin, xmax, name=label_x, label=label_x, flow=False),
-        hist.axis.Regular(num_bins_y, ymin, ymax, name=label_y, label=label_y, flow=False)
-    )
-    h.fill(ak.to_numpy(data_x), ak.to_numpy(data_y))
-
+    if histogram is None:
+        h = Hist(
+            hist.axis.Regular(num_bins_x, xmin, xmax, name=label_x, label=label_x, flow=False),
+            hist.axis.Regular(num_bins_y, ymin, ymax, name=label_y, label=label_y, flow=False),
+            storage=hist.storage.Weight() if weight is not None else hist.storage.Double()
+        )
+    else:
+        h = histogram
+        if (len(h.axes) != 2
+            or any(len(axis.edges) != bins + 1 or not np.isclose(axis.edges[0], low) or not np.isclose(axis.edges[-1], high)
+                   for axis, bins, (low, high) in zip(h.axes, num_bins, min_max))):
+            raise ValueError('histogram must be a 2D Hist with num_bins from min_max on each axis.')
+        if weight is not None and h.storage_type is not hist.storage.Weight:
+            raise TypeError('histogram must have a Weight storage to be filled with weights.')
+    # Fill block by block. Entries with None on either axis are not counted (the axes have no flow bins)
+    fill_masked_nd(h, data, weight)
+    return h, label_x, label_y
+
+# Helper function to histogram_2d() to plot a filled 2D histogram
+# Regular axes are drawn as one image (resampled to the size of the figure), other axes with pcolormesh
+def plot_histogram_2d(h, label_x, label_y, label_fontsize, tick_labelsize,
+                      title_fontsize, title, colorbar_label, dpi=None):
     # Plot 2D histogram
-    fig, ax = plt.subplots(figsize=(8, 5), dpi=500)
-    values, x_bin_edges, y_bin_edges = h.to_numpy()
-    mesh = ax.pcolormesh(x_bin_edges, y_bin_edges, values.T, cmap="viridis")
+    fig, ax = plt.subplots(figsize=(8, 5), dpi=dpi)
+    values = h.values(flow=False)
+    x_bin_edges, y_bin_edges = h.axes[0].edges, h.axes[1].edges
+    if all(isinstance(axis, hist.axis.Regular) and not axis.transform for axis in h.axes):
+        mesh = ax.imshow(values.T, origin='lower', aspect='auto', cmap="viridis",
+                         extent=(x_bin_edges[0], x_bin_edges[-1], y_bin_edges[0], y_bin_edges[-1]))
+    else:
+        mesh = ax.pcolormesh(x_bin_edges, y_bin_edges, values.T, cmap="viridis")
     # Set axes label, ticks, and title
     ax.set_xlabel(label_x, fontsize=label_fontsize)
     ax.set_ylabel(label_y, fontsize=label_fontsize)
@@ -807,7 +948,9 @@ def plot_histograms(
         show_text=False, # Bool - whether to show the text that displays histogram info
         show_back_unc=True, # Bool - whether to show the background uncertainty
         residual_plot=False,
-        residual_ylim_list=None # Tuple of 2 numbers or list of tuples for residual plot y-axis limit
+        residual_ylim_list=None, # Tuple of 2 numbers or list of tuples for residual plot y-axis limit
+        render='bars', # How to draw the MC stacks, 'bars' or 'stairs' (faster for many bins)
+        rasterized=False # Whether to rasterize the MC stacks in vector output (e.g. pdf)
     ):
     if not isinstance(data_dict, dict):
         raise TypeError('data_dict must be a dict.')
@@ -828,6 +971,8 @@ def plot_histograms(
     if len(fig_size) != 2 or not all(value > 0 for value in fig_size):
         raise ValueError("fig_size must be a tuple of two positive numbers.")
 
+    validate_render(render)
+
     time_start = time.time()
 
     # Validate plot_variables
@@ -875,7 +1020,7 @@ def plot_histograms(
         _, hists, text = stacked_histogram(data_dict, color_list, variable, xmin, xmax, 
                                            num_bins, main_axes, marker, show_back_unc, 
                                            residual_axes, x_label, label_fontsize, 
-                                           tick_labelsize, residual_ylim)
+                                           tick_labelsize, residual_ylim, render, rasterized)
 
         # Text annotations
         if show_text:
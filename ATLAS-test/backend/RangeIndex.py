@@ -0,0 +1,108 @@
+import os
+import json
+import awkward as ak
+import numpy as np
+from .ColumnCache import read_metadata, read_schema_names, read_row_group
+from .DerivedColumns import element_at
+
+# Name of the file in a sample directory that records the per-row-group min/max of index keys
+RANGE_INDEX_FILE = '_range_index.json'
+
+# This function splits an index key into the column name and the index
+# e.g. 'photon_pt[0]' gives ('photon_pt', 0) and 'mass' gives ('mass', None)
+def parse_key(key):
+    if '[' in key and key.endswith(']'):
+        base_var = key.split('[')[0]
+        try:
+            index = int(key[key.find('[') + 1 : -1])
+        except ValueError:
+            raise ValueError(f'Invalid key format : {key}. Expect "variable" or "variable[int]".')
+        return base_var, index
+    return key, None
+
+# This function returns the values of an index key for each event of a record Awkward Array
+# Events that don't have an entry at the index give None
+def key_values(arr, key):
+    base_var, index = parse_key(key)
+    if base_var not in arr.fields:
+        raise ValueError(f'Key column "{base_var}" not found. Available variable(s): {arr.fields}')
+    values = arr[base_var]
+    if index is not None:
+        values = element_at(values, index)
+    return values
+
+# This function returns [min, max] of key values ([None, None] if there is no value)
+def min_max(values):
+    if len(values) == 0 or ak.all(ak.is_none(values)):
+        return [None, None]
+    return [float(ak.min(values)), float(ak.max(values))]
+
+# This function writes the range index of a sample directory
+# range_index = {key : {filename : [[min, max] of each row group]}}
+def write_range_index(directory, range_index):
+    tmp_filename = f'{directory}/{RANGE_INDEX_FILE}.tmp{os.getpid()}'
+    with open(tmp_filename, 'w') as f:
+        json.dump(range_index, f)
+    os.replace(tmp_filename, f'{directory}/{RANGE_INDEX_FILE}')
+
+# This function reads the range index of a sample directory ({} if there is none)
+def read_range_index(directory):
+    filename = f'{directory}/{RANGE_INDEX_FILE}'
+    if not os.path.exists(filename):
+        return {}
+    with open(filename) as f:
+        return json.load(f)
+
+# This function returns [min, max] of a key for each row group of a parquet file, using the range
+# index of its directory or, for flat columns, the statistics in the parquet footer
+# Returns None if the min/max of the key is not recorded
+def row_group_ranges(file, key):
+    directory, filename = os.path.split(os.path.abspath(file))
+    range_index = read_range_index(directory)
+    if key in range_index and filename in range_index[key]:
+        return range_index[key][filename]
+
+    base_var, index = parse_key(key)
+    if index is not None or base_var not in read_schema_names(file):
+        return None
+    metadata = read_metadata(file)
+    ranges = []
+    for group in range(metadata.num_row_groups):
+        row_group = metadata.row_group(group)
+        statistics = None
+        for i in range(row_group.num_columns):
+            if row_group.column(i).path_in_schema == base_var:
+                statistics = row_group.column(i).statistics
+        if statistics is None or not statistics.has_min_max:
+            return None
+        ranges.append([float(statistics.min), float(statistics.max)])
+    return ranges
+
+# This function returns a bool for each row group of a parquet file: whether the row group may hold
+# events with lower <= key < upper. All True if the min/max of the key is not recorded
+def overlapping_row_groups(file, key, lower, upper):
+    num_row_groups = read_metadata(file).num_row_groups
+    ranges = row_group_ranges(file, key)
+    if ranges is None:
+        return [True] * num_row_groups
+    return [key_min is not None and key_min < upper and key_max >= lower
+            for key_min, key_max in ranges]
+
+# This function returns a mask of the events of one row group with lower <= key < upper
+def range_mask(file, row_group, key, lower, upper):
+    base_var, _ = parse_key(key)
+    values = key_values(read_row_group(file, [base_var], row_group), key)
+    return ak.to_numpy(ak.fill_none((values >= lower) & (values < upper), False))
+
+# This function returns the values of a key to sort the events of a record Awkward Array by, as a
+# NumPy array. Events without a key value (or with NaN) get inf, so that they are put at the end
+def sort_values(arr, key):
+    values = ak.to_numpy(ak.fill_none(key_values(arr, key), np.inf))
+    if values.dtype.kind == 'f':
+        values = np.where(np.isnan(values), np.inf, values)
+    return values
+
+# This function returns the order that sorts the events of a record Awkward Array by a key
+# (events without a key value are put at the end)
+def sort_order(arr, key):
+    return np.argsort(sort_values(arr, key), kind='stable')
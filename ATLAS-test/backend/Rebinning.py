@@ -0,0 +1,80 @@
+import math
+from fractions import Fraction
+import numpy as np
+import hist
+
+# Largest number of bins of a fine binning made by fine_binning()
+MAX_FINE_BINS = 100_000
+
+# Convert a bin edge or width to an exact fraction (e.g. 0.32 -> 8/25)
+def to_fraction(value):
+    return Fraction(value).limit_denominator(10**6)
+
+# This function returns the coarsest regular binning (num_bins, xmin, xmax) from which every
+# binning in a list can be derived exactly by rebinning and slicing
+# binnings = [(num_bins, xmin, xmax), ...], e.g. [(500, 0, 160), (200, 110, 160)] gives (16000, 0, 160)
+# Raise error if that binning would need more than max_bins bins
+def fine_binning(binnings, max_bins=MAX_FINE_BINS):
+    if not binnings:
+        raise ValueError('binnings must hold at least one (num_bins, xmin, xmax) tuple.')
+    for binning in binnings:
+        if not isinstance(binning, (list, tuple)) or len(binning) != 3:
+            raise ValueError(f'Expect a tuple (num_bins, xmin, xmax). Got {binning}')
+        num_bins, xmin, xmax = binning
+        if not isinstance(num_bins, int) or num_bins < 1 or xmax <= xmin:
+            raise ValueError(f'Invalid binning {binning}. Expect a positive int num_bins and xmax > xmin.')
+
+    xmin = min(to_fraction(binning[1]) for binning in binnings)
+    xmax = max(to_fraction(binning[2]) for binning in binnings)
+    # The bin width must divide the width of every binning and the distance of every range to xmin
+    width = Fraction(0)
+    for num_bins, low, high in binnings:
+        low, high = to_fraction(low), to_fraction(high)
+        for length in ((high - low) / num_bins, low - xmin):
+            width = fraction_gcd(width, length)
+    num_bins = (xmax - xmin) / width
+    if num_bins > max_bins:
+        raise ValueError(f'The common fine binning of {binnings} needs {num_bins} bins, more than {max_bins}. '
+                         'Choose binnings with aligned edges or increase max_bins.')
+    return int(num_bins), float(xmin), float(xmax)
+
+# Greatest common divisor of two fractions (gcd(0, x) = x)
+def fraction_gcd(a, b):
+    a, b = abs(a), abs(b)
+    if a == 0 or b == 0:
+        return a or b
+    denominator = a.denominator * b.denominator // math.gcd(a.denominator, b.denominator)
+    return Fraction(math.gcd(int(a * denominator), int(b * denominator)), denominator)
+
+# This function returns the index of the edge of an axis at value, or None if no edge is there
+def edge_index(edges, value):
+    index = int(np.argmin(np.abs(edges - value)))
+    # Edges are compared with a tolerance of a small fraction of the bin width
+    if abs(edges[index] - value) > 1e-6 * (edges[1] - edges[0]):
+        return None
+    return index
+
+# This function returns True if num_bins bins from xmin to xmax can be derived exactly from a 1D Hist
+def can_rebin(h, num_bins, xmin, xmax):
+    edges = h.axes[0].edges
+    start, stop = edge_index(edges, xmin), edge_index(edges, xmax)
+    return start is not None and stop is not None and stop > start and (stop - start) % num_bins == 0
+
+# User call this function to derive num_bins bins from xmin to xmax from a finer 1D Hist
+# (e.g. a master histogram booked with book_fine_histogram() and filled once with fill_histograms())
+# Bins outside xmin and xmax are added to the underflow and overflow bins, and each new bin is the
+# sum of the fine bins it covers, so the result is the same as filling the new binning from the events
+# The Hist is returned as is if it already has this binning
+# Raise error if xmin, xmax or the new bin edges are not edges of the Hist
+def rebin_histogram(h, num_bins, xmin, xmax):
+    if len(h.axes) != 1:
+        raise ValueError(f'Expect a 1D histogram. Got {len(h.axes)} axes.')
+    edges = h.axes[0].edges
+    if len(edges) == num_bins + 1 and np.isclose(edges[0], xmin) and np.isclose(edges[-1], xmax):
+        return h
+    if not can_rebin(h, num_bins, xmin, xmax):
+        raise ValueError(f'Cannot derive {num_bins} bins from {xmin} to {xmax} from a histogram of '
+                         f'{len(edges) - 1} bins from {edges[0]} to {edges[-1]}: the new bin edges '
+                         'must be edges of the histogram.')
+    start, stop = edge_index(edges, xmin), edge_index(edges, xmax)
+    return h[start : stop : hist.rebin((stop - start) // num_bins)]
@@ -0,0 +1,180 @@
+import os
+import json
+import hashlib
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from .ColumnCache import read_metadata
+from .ParquetDict import directory as DATASET_DIRECTORY
+
+# Catalogues are written to a cache directory of the user, not into the dataset directory (which may be
+# read-only or tracked by git). Set the ATLAS_TEST_CACHE environment variable to use another directory
+CACHE_DIRECTORY = os.environ.get('ATLAS_TEST_CACHE', os.path.join(os.path.expanduser('~'), '.cache', 'atlas-test'))
+# End of the name of the catalogue files
+CATALOGUE_FILE = '_catalogue.json'
+# Partition keys of the dataset layout, from the top directory down
+# e.g. <dataset>/skim=GamGam/process=ggF_Hyy/did=343981/chunk0.parquet
+PARTITION_KEYS = ['skim', 'process', 'did']
+
+# Catalogues already loaded, keyed by (catalogue file, mtime)
+_catalogues = {}
+
+# This function returns the catalogue file of a dataset directory (an absolute path)
+# e.g. ~/.cache/atlas-test/parquet_<hash of the path>_catalogue.json
+def catalogue_filename(dataset_directory):
+    path_hash = hashlib.sha1(dataset_directory.encode()).hexdigest()[:16]
+    return f'{CACHE_DIRECTORY}/{os.path.basename(dataset_directory)}_{path_hash}{CATALOGUE_FILE}'
+
+# This function returns the directory of a partition relative to the dataset directory
+# did is optional, as samples written before partitioning don't record their dataset identifier
+def partition_path(skim, process, did=None):
+    path = f'skim={skim}/process={process}'
+    if did is not None:
+        path += f'/did={did}'
+    return path
+
+# This function returns the partition values of a directory relative to the dataset directory
+# Directories named 'key=value' give the partition values, e.g. 'skim=GamGam/process=GamGam'
+# gives {'skim' : 'GamGam', 'process' : 'GamGam', 'did' : None}
+# Directories of the old layout (<dataset>/<string code>) give the string code as the process
+def parse_partition(relative_directory):
+    partition = dict.fromkeys(PARTITION_KEYS)
+    parts = relative_directory.replace(os.sep, '/').split('/')
+    if not any('=' in part for part in parts):
+        partition['process'] = parts[-1]
+        return partition
+    for part in parts:
+        key, _, value = part.partition('=')
+        if key in PARTITION_KEYS:
+            partition[key] = value
+    return partition
+
+# Return [mtime, number of entries] of a directory. Adding, removing or renaming a file or a directory
+# changes the mtime of the directory holding it; the number of entries catches the changes made within
+# the resolution of the mtime
+def directory_version(directory):
+    with os.scandir(directory) as entries:
+        num_entries = sum(1 for _ in entries)
+    return [os.stat(directory).st_mtime_ns, num_entries]
+
+# Return the catalogue entry of one parquet file
+def catalogue_entry(dataset_directory, file):
+    metadata = read_metadata(file)
+    relative_path = os.path.relpath(file, dataset_directory).replace(os.sep, '/')
+    entry = parse_partition(os.path.dirname(relative_path))
+    entry.update(path=relative_path,
+                 num_rows=metadata.num_rows,
+                 num_row_groups=metadata.num_row_groups,
+                 size=os.path.getsize(file))
+    return entry
+
+# User call this function to scan a dataset directory and write its catalogue (in CACHE_DIRECTORY)
+# The catalogue lists every parquet file with its partition values, number of events and number of
+# row groups, so that selecting the files of a string code (or a combination of string codes)
+# takes one read of the catalogue instead of one glob per sample directory
+# Footers are read in parallel (num_workers threads)
+def build_catalogue(dataset_directory=DATASET_DIRECTORY, num_workers=8):
+    dataset_directory = os.path.abspath(dataset_directory)
+    if not os.path.isdir(dataset_directory):
+        raise FileNotFoundError(f"Folder '{dataset_directory}' does not exist")
+
+    files = []
+    directories = {} # [mtime, number of entries] of each directory, to find files added or removed later
+    for root, dirs, filenames in os.walk(dataset_directory):
+        dirs.sort()
+        directories[os.path.relpath(root, dataset_directory).replace(os.sep, '/')] = directory_version(root)
+        files.extend(f'{root}/{filename}' for filename in sorted(filenames)
+                     if filename.endswith('.parquet'))
+
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        entries = list(executor.map(lambda file: catalogue_entry(dataset_directory, file), files))
+    catalogue = {'partition_keys' : PARTITION_KEYS, 'directories' : directories, 'files' : entries}
+
+    filename = catalogue_filename(dataset_directory)
+    tmp_filename = f'{filename}.tmp{os.getpid()}'
+    try:
+        os.makedirs(CACHE_DIRECTORY, exist_ok=True)
+        with open(tmp_filename, 'w') as f:
+            json.dump(catalogue, f, indent=1)
+        os.replace(tmp_filename, filename)
+        _catalogues[(filename, os.stat(filename).st_mtime_ns)] = catalogue
+    except OSError: # e.g. read-only cache directory - keep the catalogue in memory only
+        print(f'Could not write {filename}. The catalogue is kept in memory.')
+        _catalogues[(filename, None)] = catalogue
+    return catalogue
+
+# This function returns the catalogue of a dataset directory, building it if there is none
+def load_catalogue(dataset_directory=DATASET_DIRECTORY):
+    filename = catalogue_filename(os.path.abspath(dataset_directory))
+    if not os.path.exists(filename):
+        if (filename, None) in _catalogues:
+            return _catalogues[(filename, None)]
+        return build_catalogue(dataset_directory)
+    key = (filename, os.stat(filename).st_mtime_ns)
+    if key not in _catalogues:
+        with open(filename) as f:
+            _catalogues[key] = json.load(f)
+    return _catalogues[key]
+
+# This function returns True if no file was added to or removed from the dataset directory since its
+# catalogue was written, i.e. every directory still has the version recorded in the catalogue
+def catalogue_is_current(catalogue, dataset_directory):
+    if 'directories' not in catalogue: # Written before directory versions were recorded
+        return False
+    for relative_directory, version in catalogue['directories'].items():
+        try:
+            if directory_version(f'{dataset_directory}/{relative_directory}') != version:
+                return False
+        except FileNotFoundError:
+            return False
+    return True
+
+# This function returns the parquet files of some processes (string codes in PARQUET_STR_CODES), in the
+# order of processes. Only the partitions of the processes (and of skim, if given) are listed
+# Returns {process : [files]}, with an empty list for processes that have no file
+# Raise error if a process has files in more than one skim and skim is not given
+# If files were added or removed since the catalogue was written, the dataset is scanned again
+# (set rescan to False to use the catalogue as it is)
+def select_files(processes, skim=None, dataset_directory=DATASET_DIRECTORY, rescan=True):
+    dataset_directory = os.path.abspath(dataset_directory)
+    catalogue = load_catalogue(dataset_directory)
+    if rescan and not catalogue_is_current(catalogue, dataset_directory):
+        catalogue = build_catalogue(dataset_directory)
+    selected = {process : [] for process in processes}
+    skims = {process : set() for process in processes}
+    for entry in catalogue['files']:
+        if entry['process'] not in selected or (skim is not None and entry['skim'] != skim):
+            continue
+        selected[entry['process']].append(f"{dataset_directory}/{entry['path']}")
+        skims[entry['process']].add(entry['skim'])
+
+    for process in processes:
+        if len(skims[process]) > 1:
+            raise ValueError(f"The string code '{process}' is found in the skims {sorted(skims[process], key=str)}. "
+                             'Set skim to choose one.')
+    return selected
+
+# User call this function to move sample directories of the old layout (<dataset>/<string code>)
+# to the partitioned layout (<dataset>/skim=<skim>/process=<string code>), then rebuild the catalogue
+# skim_dict = {string code : skim}, e.g. {'GamGam' : 'GamGam', 'Zee' : '2to4lep'}
+def partition_dataset(skim_dict, dataset_directory=DATASET_DIRECTORY):
+    dataset_directory = os.path.abspath(dataset_directory)
+    for process, skim in skim_dict.items():
+        source = f'{dataset_directory}/{process}'
+        if not os.path.isdir(source):
+            print(f"Skipping '{process}' - folder '{source}' does not exist")
+            continue
+        destination = f'{dataset_directory}/{partition_path(skim, process)}'
+        if os.path.exists(destination):
+            raise FileExistsError(f"Folder '{destination}' already exists")
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        os.rename(source, destination)
+        print(f'Moved {source} to {destination}')
+    return build_catalogue(dataset_directory)
+
+# Command line usage: python -m backend.SampleCatalogue [<dataset_directory>]
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the catalogue of a parquet dataset.')
+    parser.add_argument('dataset_directory', nargs='?', default=DATASET_DIRECTORY)
+    args = parser.parse_args()
+    catalogue = build_catalogue(args.dataset_directory)
+    print(f"{len(catalogue['files'])} file(s) catalogued in {args.dataset_directory}")
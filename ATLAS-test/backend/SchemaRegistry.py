@@ -0,0 +1,131 @@
+import os
+import json
+import hashlib
+from .ColumnCache import read_metadata
+from .SampleCatalogue import CACHE_DIRECTORY
+
+# End of the name of the schema registry files. Registries are written to CACHE_DIRECTORY (see
+# SampleCatalogue.py), not into the sample directories. Older versions wrote <sample directory>/_schema.json
+SCHEMA_FILE = '_schema.json'
+
+# Registries already loaded, keyed by sample directory: (registry, mtime of the sample directory)
+_registries = {}
+
+# This function returns the schema registry file of a sample directory (an absolute path)
+# e.g. ~/.cache/atlas-test/GamGam_<hash of the path>_schema.json
+def registry_filename(sample_directory):
+    path_hash = hashlib.sha1(sample_directory.encode()).hexdigest()[:16]
+    return f'{CACHE_DIRECTORY}/{os.path.basename(sample_directory)}_{path_hash}{SCHEMA_FILE}'
+
+# Return [size, mtime] of each parquet file, used to know whether a registry is out of date
+def file_versions(files):
+    versions = {}
+    for file in files:
+        stat = os.stat(file)
+        versions[os.path.basename(file)] = [stat.st_size, stat.st_mtime_ns]
+    return versions
+
+# This function reads the schema of every parquet file in a list and returns the registry
+# {'files' : {filename : [size, mtime]}, 'columns' : {column : type}, 'common' : [columns],
+#  'inconsistent' : {column : reason}}
+# 'columns' is the unified schema (all columns found in any file, in order of first appearance)
+# 'common' holds the columns found in every file with the same type
+def build_registry(files):
+    columns = {} # Type of each column, from the first file that has it
+    found_in = {} # Number of files that have each column
+    inconsistent = {}
+    for file in files:
+        schema = read_metadata(file).schema.to_arrow_schema()
+        for field in schema:
+            field_type = str(field.type)
+            if field.name not in columns:
+                columns[field.name] = field_type
+                found_in[field.name] = 0
+            elif columns[field.name] != field_type and field.name not in inconsistent:
+                inconsistent[field.name] = (f'type {field_type} in {os.path.basename(file)}, '
+                                            f'{columns[field.name]} in other file(s)')
+            found_in[field.name] += 1
+    for column, count in found_in.items():
+        if count < len(files) and column not in inconsistent:
+            inconsistent[column] = f'found in {count} of {len(files)} file(s)'
+    return {'files' : file_versions(files),
+            'columns' : columns,
+            'common' : [column for column in columns if column not in inconsistent],
+            'inconsistent' : inconsistent}
+
+# User call this function to build the schema registry of a sample directory and write it to
+# CACHE_DIRECTORY. Inconsistent columns are listed in registry['inconsistent']
+def build_schema_registry(sample_directory):
+    sample_directory = os.path.abspath(sample_directory)
+    directory_mtime = os.stat(sample_directory).st_mtime_ns
+    files = sorted(f'{sample_directory}/{filename}' for filename in os.listdir(sample_directory)
+                   if filename.endswith('.parquet'))
+    if not files:
+        raise FileNotFoundError(f'No .parquet files found in {sample_directory}')
+    registry = build_registry(files)
+
+    filename = registry_filename(sample_directory)
+    tmp_filename = f'{filename}.tmp{os.getpid()}'
+    try:
+        os.makedirs(CACHE_DIRECTORY, exist_ok=True)
+        with open(tmp_filename, 'w') as f:
+            json.dump(registry, f, indent=1)
+        os.replace(tmp_filename, filename)
+    except OSError: # e.g. read-only cache directory - keep the registry in memory only
+        print(f'Could not write {filename}. The schema registry is kept in memory.')
+    _registries[sample_directory] = (registry, directory_mtime)
+    return registry
+
+# This function returns the schema registry of the sample directory of some parquet files
+# The registry is read from CACHE_DIRECTORY (or built if there is none) once, then served from memory
+# while the mtime of the sample directory is unchanged (parquet files added, removed or replaced)
+# When it changed, the parquet files are compared with the registry (by size and mtime) and it is
+# rebuilt if any of them changed. A file rewritten in place without a rename is not noticed until
+# then; call build_schema_registry() for it
+def load_schema_registry(files):
+    sample_directory = os.path.dirname(os.path.abspath(files[0]))
+    directory_mtime = os.stat(sample_directory).st_mtime_ns
+    registry, registry_mtime = _registries.get(sample_directory, (None, None))
+    if registry is not None and registry_mtime == directory_mtime:
+        return registry
+    if registry is None:
+        filename = registry_filename(sample_directory)
+        if os.path.exists(filename):
+            with open(filename) as f:
+                registry = json.load(f)
+    if registry is None or registry['files'] != file_versions(
+            f'{sample_directory}/{filename}' for filename in os.listdir(sample_directory)
+            if filename.endswith('.parquet')):
+        return build_schema_registry(sample_directory)
+    _registries[sample_directory] = (registry, directory_mtime)
+    return registry
+
+# This function returns the registry of parquet files that may be in several sample directories
+# (e.g. the did=<id> partitions of one process), combining the registry of each directory
+def files_schema(files):
+    directories = {} # Files in each sample directory, in order
+    for file in files:
+        directories.setdefault(os.path.dirname(os.path.abspath(file)), []).append(file)
+    registries = [load_schema_registry(directory_files) for directory_files in directories.values()]
+    if len(registries) == 1:
+        return registries[0]
+
+    columns = {}
+    inconsistent = {}
+    for registry in registries:
+        inconsistent.update(registry['inconsistent'])
+        for column, column_type in registry['columns'].items():
+            if column not in columns:
+                columns[column] = column_type
+            elif columns[column] != column_type:
+                inconsistent.setdefault(column, f'type {column_type} and {columns[column]} in different directories')
+    for column in columns:
+        if column not in inconsistent and not all(column in registry['columns'] for registry in registries):
+            inconsistent[column] = 'not found in every directory'
+    return {'columns' : columns,
+            'common' : [column for column in columns if column not in inconsistent],
+            'inconsistent' : inconsistent}
+
+# Forget the registries loaded in memory (the registry files in CACHE_DIRECTORY are kept)
+def clear_schema_registry():
+    _registries.clear()
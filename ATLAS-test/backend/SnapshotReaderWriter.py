@@ -0,0 +1,193 @@
+import os
+import io
+import json
+import mmap
+import time
+import datetime
+import contextlib
+from zoneinfo import ZoneInfo
+import awkward as ak
+import numpy as np
+from .HistReaderWriter import padding
+from .PklReaderWriter import pkl_writer, pkl_reader
+
+# A snapshot file holds a dict {sample key : Awkward Array} (e.g. returned by analysis_parquet())
+# as the raw buffers of the arrays (ak.to_buffers()), so that it can be memory-mapped:
+#   MAGIC, header length (8 bytes, little endian), header (JSON), buffers
+# The header lists every sample with its form, length and the position {'offset', 'dtype', 'count'}
+# of each buffer in the file, and the buffers of each field. Buffers start at multiples of 64 bytes
+SNAPSHOT_MAGIC = b'ATLASSNAP1\n'
+
+# Headers already read, keyed by (file path, mtime)
+_snapshot_header_cache = {}
+
+# This function writes a dict {sample key : Awkward Array or dict of arrays} to a snapshot file
+# filename can be set by user (without extension), otherwise a unique filename will be created using
+# current date and time, as for pkl_writer(). The file is written as <filename>.snap
+# The file is written under a temporary name and renamed at the end, so a snapshot file is never incomplete
+def snapshot_writer(data_dict, output_filename=''):
+    if not isinstance(data_dict, dict):
+        raise TypeError('data_dict must be a dict {sample key : Awkward Array}.')
+    if not output_filename:
+        os.makedirs('output_snapshot', exist_ok=True)
+        # Use current time to create a unique filename
+        now = datetime.datetime.now(ZoneInfo("Europe/London"))
+        strf = now.strftime("%Y%m%d%H%M") # Set time format
+        output_filename = f'output_snapshot/snapshot_writer{strf}'
+    else: # Ensure folder exists if output_filename is provided manually
+        output_dir = os.path.dirname(output_filename)
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+
+    # Lay out the buffers of each sample one after the other (to_buffers() doesn't copy them)
+    samples = {}
+    buffers = []
+    position = 0 # Position of the next buffer, relative to the start of the buffers
+    for key, value in data_dict.items():
+        if isinstance(value, dict):
+            value = ak.zip(value, depth_limit=1)
+        elif not isinstance(value, ak.Array):
+            raise TypeError(f'Key "{key}" : Unexpected type of dict value. Expect dict or Awkward Array.')
+        # Only store the selected entries of a cut or reordered array (e.g. data['Zee'][cut]), not the whole parent
+        value = ak.to_packed(value)
+        form, length, container = ak.to_buffers(value)
+        entries = {}
+        for name, buffer in container.items():
+            buffer = np.ascontiguousarray(buffer)
+            position += padding(position)
+            entries[name] = {'offset' : position, 'dtype' : buffer.dtype.str, 'count' : int(buffer.size)}
+            buffers.append((position, buffer))
+            position += buffer.nbytes
+        # Buffers of each field, to report and read fields separately. The records of an option array
+        # (e.g. ak.firsts of records) are inside the option form, whose index is shared by all fields
+        record_form = form
+        while not isinstance(record_form, ak.forms.RecordForm) and hasattr(record_form, 'content'):
+            record_form = record_form.content
+        fields = {field : sorted(record_form.content(field).expected_from_buffers()) for field in value.fields}
+        samples[str(key)] = {'form' : form.to_dict(), 'length' : length, 'buffers' : entries, 'fields' : fields}
+    header = json.dumps({'samples' : samples}).encode()
+
+    data_start = len(SNAPSHOT_MAGIC) + 8 + len(header)
+    data_start += padding(data_start)
+    filename = f'{output_filename}.snap'
+    tmp_filename = f'{filename}.tmp{os.getpid()}'
+    try:
+        with open(tmp_filename, 'wb') as f:
+            f.write(SNAPSHOT_MAGIC)
+            f.write(len(header).to_bytes(8, 'little'))
+            f.write(header)
+            for offset, buffer in buffers:
+                f.write(b'\0' * (data_start + offset - f.tell()))
+                f.write(memoryview(buffer).cast('B')) # Write the buffer without copying it
+        os.replace(tmp_filename, filename)
+    finally:
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+    return output_filename
+
+# This function returns the header of a snapshot file and the position of the buffers
+# The header is read once per file version
+def read_snapshot_header(filename):
+    path = os.path.abspath(filename)
+    key = (path, os.stat(path).st_mtime_ns)
+    if key not in _snapshot_header_cache:
+        with open(path, 'rb') as f:
+            if f.read(len(SNAPSHOT_MAGIC)) != SNAPSHOT_MAGIC:
+                raise ValueError(f'"{filename}" is not a snapshot file written by snapshot_writer().')
+            header_length = int.from_bytes(f.read(8), 'little')
+            header = json.loads(f.read(header_length))
+        data_start = len(SNAPSHOT_MAGIC) + 8 + header_length
+        _snapshot_header_cache[key] = (header, data_start + padding(data_start))
+    return _snapshot_header_cache[key]
+
+# Return a function that gives one buffer of a memory-mapped snapshot file (no copy)
+def buffer_getter(mapped, data_start, entry):
+    return lambda: np.frombuffer(mapped, dtype=np.dtype(entry['dtype']), count=entry['count'],
+                                 offset=data_start + entry['offset'])
+
+# This function reads a snapshot file lazily
+# Returns {sample key : Awkward Array}. The file is memory-mapped and the arrays are made of virtual
+# buffers: nothing is read when the file is opened, and e.g. snapshot['Zee']['lep_pt'] only reads the
+# buffers of lep_pt (once) when its values are used. The arrays are read-only views of the file
+# samples is a sample key, a list of keys or None for all samples
+def snapshot_reader(filename, samples=None):
+    header, data_start = read_snapshot_header(filename)
+    entries = header['samples']
+    if samples is None:
+        samples = list(entries)
+    elif isinstance(samples, str):
+        samples = [samples]
+    missing = [key for key in samples if key not in entries]
+    if missing:
+        raise KeyError(f'Sample(s) {missing} not found in "{filename}". Available sample(s): {list(entries)}')
+
+    with open(filename, 'rb') as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) # Stays open while the arrays use it
+    snapshot = {}
+    for key in samples:
+        entry = entries[key]
+        container = {name : buffer_getter(mapped, data_start, buffer) for name, buffer in entry['buffers'].items()}
+        snapshot[key] = ak.from_buffers(ak.forms.from_dict(entry['form']), entry['length'], container)
+    return snapshot
+
+# This function returns {sample key : {'length' : number of events, 'fields' : {field : number of bytes}}}
+# for a snapshot file, without reading any buffer
+def snapshot_info(filename):
+    header, _ = read_snapshot_header(filename)
+    info = {}
+    for key, entry in header['samples'].items():
+        buffers = entry['buffers']
+        nbytes = {field : sum(buffers[name]['count'] * np.dtype(buffers[name]['dtype']).itemsize for name in names)
+                  for field, names in entry['fields'].items()}
+        info[key] = {'length' : entry['length'], 'fields' : nbytes}
+    return info
+
+# Read every value of some Awkward Arrays (sum of each buffer)
+def read_values(arrays):
+    for array in arrays:
+        for buffer in ak.to_buffers(array)[2].values():
+            np.sum(np.asarray(buffer).view(np.uint8))
+
+# User call this function to compare snapshot files with pickle files (pkl_writer()/pkl_reader()) for
+# a dict {sample key : Awkward Array}: time to save, to load, and to load one field of one sample
+# (sample and field default to the first ones). The files are written to output_filename.pkl/.snap
+# Returns {measurement : seconds} and prints the throughput of each
+def benchmark_snapshot(data_dict, output_filename, sample=None, field=None):
+    sample = sample if sample is not None else next(iter(data_dict))
+    field = field if field is not None else data_dict[sample].fields[0]
+    nbytes = sum(value.layout.nbytes for value in data_dict.values())
+    timings = {}
+    with contextlib.redirect_stdout(io.StringIO()):
+        time_start = time.time()
+        pkl_writer(data_dict, output_filename)
+        timings['pickle save'] = time.time() - time_start
+        time_start = time.time()
+        snapshot_writer(data_dict, output_filename)
+        timings['snapshot save'] = time.time() - time_start
+
+        # Loading includes reading every value once, as the pages of a snapshot are only read when used
+        time_start = time.time()
+        loaded = pkl_reader(f'{output_filename}.pkl')
+        read_values(loaded.values())
+        timings['pickle load'] = time.time() - time_start
+        time_start = time.time()
+        read_values([loaded[sample][field]])
+        timings['pickle load one field'] = timings['pickle load'] + time.time() - time_start
+        del loaded
+
+        time_start = time.time()
+        snapshot = snapshot_reader(f'{output_filename}.snap')
+        read_values(snapshot.values())
+        timings['snapshot load'] = time.time() - time_start
+        time_start = time.time()
+        snapshot = snapshot_reader(f'{output_filename}.snap', sample)
+        read_values([snapshot[sample][field]])
+        timings['snapshot load one field'] = time.time() - time_start
+
+    print(f'{nbytes / 1e9:.2f} GB in {len(data_dict)} sample(s). File sizes: '
+          f'pickle {os.path.getsize(f"{output_filename}.pkl") / 1e9:.2f} GB, '
+          f'snapshot {os.path.getsize(f"{output_filename}.snap") / 1e9:.2f} GB')
+    for measurement, seconds in timings.items():
+        rate = '' if 'one field' in measurement else f' ({nbytes / 1e9 / max(seconds, 1e-9):.2f} GB/s)'
+        print(f'{measurement} : {seconds:.3f} s{rate}')
+    return timings
@@ -1,15 +1,16 @@
-import os
-import glob
-import pyarrow.parquet as pq
-from .ParquetDict import PARQUET_DICT, STR_CODE_COMBO, VALID_STR_CODE
+from .ParquetDict import PARQUET_STR_CODES, STR_CODE_COMBO, VALID_STR_CODE
+from .SampleCatalogue import select_files
+from .SchemaRegistry import files_schema
 
 # Get valid variables for a given string code. If string codes combined with '+',
-# the string codes will be split and used to get the fields of its first parquet file 
-# (the valid variables). Data in all parquet files should have the same fields
+# the string codes will be split and the first string code is used to get the valid variables
+# The valid variables are the columns found with the same type in all parquet files of the string
+# code, taken from the schema registry of its sample directory (no parquet file is opened once the
+# registry is written). Columns missing from some files or with different types are printed
 def get_valid_variables(string_code):
     if not isinstance(string_code, str):
         raise TypeError(f'string_code must be a str. Got {type(string_code)}')
-    if string_code not in PARQUET_DICT:
+    if string_code not in PARQUET_STR_CODES:
         if string_code in STR_CODE_COMBO:
             string_code = STR_CODE_COMBO[string_code]
         # Split the string codes that are combined with '+'
@@ -18,38 +19,38 @@ def get_valid_variables(string_code):
         string_code = physics_processes[0] 
         print(f'Validate variables using the string code {string_code}')
         
-    if string_code not in PARQUET_DICT:
+    if string_code not in PARQUET_STR_CODES:
         raise ValueError(f'{string_code} not found. Available string codes: {VALID_STR_CODE}')
         
-    read_directory = PARQUET_DICT[string_code]
-    if not os.path.isdir(read_directory):
-        raise FileNotFoundError(f"Folder '{read_directory}' does not exist")
+    # Get parquet files for string_code from the catalogue of the parquet directory
+    files = select_files([string_code])[string_code]
+    if not files:
+        raise FileNotFoundError(f"No .parquet files found with the string code '{string_code}'")
+    print(f'Variables validated using the schema of {len(files)} file(s) for {string_code}')
 
-    # Get parquet files for string_code
-    files = sorted(glob.glob(f'{read_directory}/*.parquet'))
-    print(f'Variables validated using {files[0]}')
-
-    # Use the schema of the first parquet file to give valid variable list
-    parquet_file = pq.ParquetFile(files[0])
-    schema = parquet_file.schema.to_arrow_schema()
-    var_list = [field.name for field in schema]
+    registry = files_schema(files)
+    for column, reason in registry['inconsistent'].items():
+        print(f"Skipping '{column}' for string code '{string_code}' - inconsistent schema: {reason}")
+    var_list = list(registry['common'])
     return var_list
-        
+
 
 # Return list of variables that are in read_variables and are valid for
 # all entries in string_code_list
 def validate_read_variables(string_code_list, read_variables):
     validated = []
+    validated_set = set() # For membership tests, validated keeps the order
     
     for string_code in string_code_list:
-        valid_var_list = get_valid_variables(string_code)
+        valid_var_set = set(get_valid_variables(string_code))
 
         # Skip invalid and duplicated entry
         for variable_input in read_variables:
-            if variable_input not in valid_var_list:
+            if variable_input not in valid_var_set:
                 print(f"Skipping '{variable_input}' - invalid input for string code '{string_code}'")
-            elif variable_input in validated:
+            elif variable_input in validated_set:
                 continue
             else:
                 validated.append(variable_input)
+                validated_set.add(variable_input)
     return validated
@@ -1,9 +1,24 @@
 from .ValidateReadVar import validate_read_variables, get_valid_variables
-from .StackedHistogram import plot_stacked_hist, plot_histograms, histogram_2d
+from .PlotHistogram import plot_stacked_hist, plot_histograms, histogram_2d
 from .GetHistogram import get_histogram
 from .PlotErrorBar import plot_errorbars
-from .AnalysisParquet import analysis_parquet
+from .AnalysisParquet import analysis_parquet, warm_arrow_cache
 from .AnalysisUproot import analysis_uproot
 from .DataSetsMagic import DIDS_DICT, VALID_SKIMS
 from .ParquetDict import VALID_STR_CODE
-
+from .ColumnCache import clear_column_cache, column_cache_info, set_column_cache_limit
+from .ArrowCache import enable_arrow_cache, disable_arrow_cache, arrow_cache_info, clear_arrow_cache
+from .CompactSample import compact_sample
+from .SampleCatalogue import build_catalogue, partition_dataset
+from .SchemaRegistry import build_schema_registry, clear_schema_registry
+from .HistogramBooking import book_histogram, book_histogram_2d, book_fine_histogram, fill_histograms, select_variation
+from .Accumulators import Accumulator, merge_accumulators, accumulator_to_bytes, accumulator_from_bytes, analysis_accumulator
+from .MaskedFill import fill_masked, fill_variations
+from .HistogramCache import set_histogram_cache_limit, histogram_cache_info, clear_histogram_cache
+from .Rebinning import rebin_histogram, fine_binning
+from .BatchExport import export_plots
+from .DerivedColumns import set_derived_cache_limit, derived_cache_info, clear_derived_cache
+from .BinnedFit import polynomial, gaussian, exponential, crystal_ball, composite_model, fit_histograms, benchmark_fit
+from .Bootstrap import bootstrap_histogram, fill_bootstrap, bootstrap_errors, replica_data
+from .EventWeights import calculate_weight_variations
+from .AnalysisPlanner import plan_analysis_parquet, plan_analysis_uproot
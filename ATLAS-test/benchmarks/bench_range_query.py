@@ -0,0 +1,59 @@
+# Benchmark of the row-group range index of analysis_parquet (range_query)
+# The GamGam sample is copied to a temporary directory, compacted sorted by the leading photon pT
+# (the sample has no stored mass column) and queried for one pT window. Prints the number of row
+# groups and uncompressed bytes read, and checks the events are the same as a full read then the cut
+# Usage (from ATLAS-test): python benchmarks/bench_range_query.py [lower] [upper]
+import os
+import sys
+import time
+import shutil
+import tempfile
+import awkward as ak
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from backend.AnalysisParquet import analysis_parquet, get_str_code_files, plan_row_groups
+from backend.ColumnCache import read_metadata
+from backend.CompactSample import compact_sample
+
+KEY = 'photon_pt[0]'
+ROW_GROUP_SIZE = 5000
+
+# Return the number of row groups and their uncompressed size in bytes for a list of (file, row group)
+def row_group_bytes(row_groups):
+    return len(row_groups), sum(read_metadata(file).row_group(group).total_byte_size for file, group in row_groups)
+
+def bench_range_query(lower=50, upper=60): # GeV
+    _, files = get_str_code_files('GamGam')
+    with tempfile.TemporaryDirectory() as read_directory:
+        sample_directory = f'{read_directory}/GamGam'
+        os.makedirs(sample_directory)
+        for i, file in enumerate(files):
+            shutil.copy(file, f'{sample_directory}/file{i}.parquet')
+        compact_sample(sample_directory, row_group_size=ROW_GROUP_SIZE, sort_by=KEY)
+        sample_files = sorted(f'{sample_directory}/{name}' for name in os.listdir(sample_directory)
+                              if name.endswith('.parquet'))
+
+        all_row_groups = [(file, group) for file in sample_files
+                          for group in range(read_metadata(file).num_row_groups)]
+        plan = plan_row_groups(sample_files, float('inf'), range_query=(KEY, lower, upper))
+        num_read, bytes_read = row_group_bytes([(file, group) for file, group, _ in plan])
+        num_total, bytes_total = row_group_bytes(all_row_groups)
+
+        time_start = time.time()
+        data = analysis_parquet([KEY], read_directory=read_directory, range_query=(KEY, lower, upper))
+        elapsed_time = time.time() - time_start
+        full = analysis_parquet([KEY], read_directory=read_directory)
+
+    events = data['GamGam x1'][KEY]
+    full_events = full['GamGam x1'][KEY]
+    full_events = full_events[ak.fill_none((full_events >= lower) & (full_events < upper), False)]
+    if ak.to_list(events) != ak.to_list(full_events):
+        raise RuntimeError('range_query did not return the same events as a full read followed by the cut')
+
+    print(f'{KEY} in [{lower:g}, {upper:g}): read {num_read} of {num_total} row groups '
+          f'({bytes_read / 1e6:.2f} MB of {bytes_total / 1e6:.2f} MB uncompressed), '
+          f'{len(events)} events in {elapsed_time:.2f}s')
+    return num_read, num_total, bytes_read, bytes_total
+
+if __name__ == '__main__':
+    bench_range_query(*[float(arg) for arg in sys.argv[1:3]])
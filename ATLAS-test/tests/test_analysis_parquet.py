@@ -0,0 +1,52 @@
+import awkward as ak
+import pyarrow.parquet as pq
+from backend.AnalysisParquet import analysis_parquet
+
+# Write a sample directory with two row groups: the first one has photon_n from 1 to 4 but no event
+# with photon_n == 3, the second one only has events with photon_n == 3
+def write_sample(directory):
+    sample_directory = directory / 'sample'
+    sample_directory.mkdir()
+    arr = ak.Array({'photon_n' : [1, 4, 3, 3],
+                    'photon_pt' : [[50.0], [60.0, 40.0, 30.0, 20.0], [70.0, 50.0, 20.0], [80.0, 60.0, 10.0]]})
+    pq.write_table(ak.to_arrow_table(arr), sample_directory / 'chunk0.parquet', row_group_size=2)
+    return str(directory)
+
+# A row group with no event in the range used to crash when reading an indexed variable
+def test_range_query_no_event_in_row_group(tmp_path):
+    read_directory = write_sample(tmp_path)
+    data = analysis_parquet(['photon_pt[0]', 'photon_n'], read_directory=read_directory,
+                            range_query=('photon_n', 2.5, 3.5))
+    assert ak.to_list(data['sample x1']['photon_pt[0]']) == [70.0, 80.0]
+
+def test_range_query_no_event_in_range(tmp_path):
+    read_directory = write_sample(tmp_path)
+    data = analysis_parquet(['photon_pt[0]', 'photon_n'], read_directory=read_directory,
+                            range_query=('photon_n', 2.2, 2.8))
+    assert data['sample x1'] is None
+
+# Same with a fraction of the clustered output of analysis_parquet
+def test_range_query_clustered_output(tmp_path):
+    read_directory = write_sample(tmp_path)
+    output_directory = str(tmp_path / 'output')
+    analysis_parquet(['photon_pt', 'photon_n'], read_directory=read_directory, write_parquet=True,
+                     output_directory=output_directory, return_output=False, cluster_by='photon_pt[0]',
+                     row_group_size=2, max_rows_per_file=4)
+    data = analysis_parquet(['photon_pt[1]', 'photon_n'], read_directory=output_directory, fraction=0.5,
+                            range_query=('photon_n', 2.2, 2.8))
+    assert data['sample x1 x0_5'] is None
+
+# Clustering the output of an MC sample (with a 'totalWeight' column)
+def test_clustered_output_weighted_sample(tmp_path):
+    sample_directory = tmp_path / 'sample'
+    sample_directory.mkdir()
+    arr = ak.Array({'photon_n' : [1, 4, 3, 3], 'photon_pt' : [[50.0], [60.0, 40.0], [70.0], [30.0, 10.0]],
+                    'totalWeight' : [0.5, 1.0, 1.5, 2.0]})
+    pq.write_table(ak.to_arrow_table(arr), sample_directory / 'chunk0.parquet', row_group_size=2)
+    output_directory = str(tmp_path / 'output')
+    analysis_parquet(['photon_pt', 'photon_n'], read_directory=str(tmp_path), write_parquet=True,
+                     output_directory=output_directory, return_output=False, cluster_by='photon_pt[0]',
+                     row_group_size=2, max_rows_per_file=4)
+    data = analysis_parquet(['photon_pt[0]', 'photon_n'], read_directory=output_directory)
+    assert ak.to_list(data['sample x1 x1']['photon_pt[0]']) == [30.0, 50.0, 60.0, 70.0]
+    assert ak.sum(data['sample x1 x1']['totalWeight']) == 5.0
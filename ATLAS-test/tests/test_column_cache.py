@@ -0,0 +1,43 @@
+import awkward as ak
+import pyarrow.parquet as pq
+from backend.AnalysisParquet import analysis_parquet
+from backend import ColumnCache
+from backend.ColumnCache import read_row_group, clear_column_cache, column_cache_info
+
+def write_sample(directory, num_files=1):
+    sample_directory = directory / 'sample'
+    sample_directory.mkdir()
+    arr = ak.Array({'photon_n' : [1, 4, 3, 3], 'photon_pt' : [[50.0], [60.0, 40.0], [70.0], [80.0]]})
+    for i in range(num_files):
+        pq.write_table(ak.to_arrow_table(arr), sample_directory / f'chunk{i}.parquet', row_group_size=2)
+    return sample_directory
+
+def test_no_column_in_file(tmp_path):
+    sample_directory = write_sample(tmp_path)
+    arr = read_row_group(str(sample_directory / 'chunk0.parquet'), ['lep_pt', 'lep_n'], 0)
+    assert len(arr) == 0 and arr.fields == []
+
+# Reading every event once doesn't fill the cache, reading a fraction does
+def test_cache_only_for_fraction(tmp_path):
+    write_sample(tmp_path)
+    clear_column_cache()
+    analysis_parquet(['photon_pt'], read_directory=str(tmp_path))
+    assert column_cache_info()['entries'] == 0
+    analysis_parquet(['photon_pt'], read_directory=str(tmp_path), fraction=1, return_output=False, write_parquet=True,
+                     output_directory=str(tmp_path / 'output'))
+    assert column_cache_info()['entries'] == 0
+    analysis_parquet(['photon_pt'], read_directory=str(tmp_path), fraction=0.5)
+    assert column_cache_info()['entries'] > 0
+    clear_column_cache()
+    analysis_parquet(['photon_pt'], read_directory=str(tmp_path), column_cache=True)
+    assert column_cache_info()['entries'] > 0
+    clear_column_cache()
+
+def test_metadata_cache_bound(tmp_path, monkeypatch):
+    sample_directory = write_sample(tmp_path, num_files=5)
+    monkeypatch.setattr(ColumnCache, 'MAX_METADATA_ENTRIES', 3)
+    clear_column_cache()
+    for i in range(5):
+        ColumnCache.read_schema_names(str(sample_directory / f'chunk{i}.parquet'))
+    assert len(ColumnCache._metadata_cache) == 3
+    clear_column_cache()
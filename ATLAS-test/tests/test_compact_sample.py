@@ -0,0 +1,38 @@
+import glob
+import awkward as ak
+import numpy as np
+import pyarrow.parquet as pq
+from backend.AnalysisParquet import analysis_parquet
+from backend.CompactSample import compact_sample
+
+# Write a weighted sample directory (as the MC samples, with a 'totalWeight' column)
+def write_weighted_sample(directory, num_files=3, num_events=50):
+    sample_directory = directory / 'sample'
+    sample_directory.mkdir()
+    rng = np.random.default_rng(1)
+    for i in range(num_files):
+        arr = ak.Array({'mass' : rng.random(num_events) * 100, 'totalWeight' : rng.random(num_events)})
+        pq.write_table(ak.to_arrow_table(arr), sample_directory / f'chunk{i}.parquet')
+    return str(directory)
+
+# Read all events of a sample directory, in file order
+def read_sample(sample_directory):
+    files = sorted(glob.glob(f'{sample_directory}/chunk*.parquet'),
+                   key=lambda file: int(file.split('chunk')[-1].split('.')[0]))
+    return ak.concatenate([ak.from_parquet(file) for file in files])
+
+# The output of analysis_parquet stores totalWeight with an Awkward extension type
+def test_compact_weighted_analysis_parquet_output(tmp_path):
+    read_directory = write_weighted_sample(tmp_path)
+    output_directory = str(tmp_path / 'output')
+    analysis_parquet(['mass'], read_directory=read_directory, write_parquet=True,
+                     output_directory=output_directory, return_output=False,
+                     row_group_size=20, max_rows_per_file=40)
+    sample_directory = f'{output_directory}/sample x1'
+    before = read_sample(sample_directory)
+
+    compact_sample(sample_directory, row_group_size=50, max_rows_per_file=100, sort_by='mass')
+    after = read_sample(sample_directory)
+    assert len(after) == len(before) == 150
+    assert np.all(np.diff(ak.to_numpy(after['mass'])) >= 0)
+    assert np.isclose(ak.sum(after['totalWeight']), ak.sum(before['totalWeight']))
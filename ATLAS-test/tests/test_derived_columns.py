@@ -0,0 +1,24 @@
+import awkward as ak
+import numpy as np
+from backend.DerivedColumns import element_at, cached_element_at, derived_cache_info, clear_derived_cache
+
+def photon_pt():
+    return ak.Array([[50.0, 20.0], [], [70.0], [90.0, 10.0, 5.0]])
+
+def test_element_at_as_pad_none():
+    array = photon_pt()
+    for index in [0, 1, 2, 3]:
+        assert ak.to_list(element_at(array, index)) == ak.to_list(ak.pad_none(array, index + 1)[:, index])
+    assert ak.to_list(element_at(array, -1)) == [20.0, None, 70.0, 5.0]
+    assert ak.to_list(element_at(array[[1, 1]], 0)) == [None, None]
+
+# The cached column holds one value and one mask byte per event, not the jagged content
+def test_cached_column_owns_its_values():
+    num_events = 10_000
+    counts = np.arange(num_events) % 50
+    array = ak.unflatten(np.random.default_rng(1).random(int(counts.sum())), counts)
+    clear_derived_cache()
+    leading = cached_element_at(array, 0)
+    assert ak.to_list(ak.is_none(leading)) == list(counts == 0)
+    assert derived_cache_info()['bytes'] == leading.layout.nbytes == num_events * 9
+    clear_derived_cache()
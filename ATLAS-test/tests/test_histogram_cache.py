@@ -0,0 +1,22 @@
+import awkward as ak
+import numpy as np
+from backend.HistogramCache import array_fingerprint
+
+# Selecting the same field twice gives the same fingerprint (the histogram cache is hit)
+def test_same_buffers_same_fingerprint():
+    data = ak.Array({'mass' : np.linspace(0, 1, 1000), 'photon_pt' : [[1.0, 2.0]] * 1000})
+    assert array_fingerprint(data['mass']) == array_fingerprint(data['mass'])
+    assert array_fingerprint(data['photon_pt']) == array_fingerprint(data['photon_pt'])
+    assert array_fingerprint(data['mass']) != array_fingerprint(data['photon_pt'])
+
+# A new array allocated at the address of a freed one, with the same size, must not get the
+# fingerprint of the freed array (the cache would return the histogram of the freed array)
+def test_reused_address_new_fingerprint():
+    fingerprints = set()
+    for i in range(20):
+        values = np.zeros(100_000)
+        values[1] = i # Only one entry differs between the arrays
+        array = ak.Array(values)
+        fingerprints.add(array_fingerprint(array))
+        del values, array
+    assert len(fingerprints) == 20
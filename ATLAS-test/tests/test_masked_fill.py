@@ -0,0 +1,53 @@
+import awkward as ak
+import hist
+import numpy as np
+import pyarrow as pa
+from backend.MaskedFill import fill_masked
+
+# Fill by replacing None first, as before fill_masked()
+def fill_none_hist(values, weight=None):
+    h = hist.Hist(hist.axis.Regular(10, 0, 100), storage=hist.storage.Weight())
+    x = ak.to_numpy(ak.fill_none(values, np.nan))
+    if weight is None:
+        return h.fill(x)
+    return h.fill(x, weight=ak.to_numpy(ak.fill_none(weight, 0.0)))
+
+def assert_same_bins(values, weight=None, block_size=4):
+    h = hist.Hist(hist.axis.Regular(10, 0, 100), storage=hist.storage.Weight())
+    fill_masked(h, values, weight=weight, block_size=block_size)
+    expected = fill_none_hist(values, weight)
+    assert np.allclose(h.view(flow=True).value, expected.view(flow=True).value)
+    assert np.allclose(h.view(flow=True).variance, expected.view(flow=True).variance)
+
+def test_indexed_option():
+    pt = ak.Array([[50.0, 20.0], [], [70.0], [], [90.0, 10.0], [5.0]])
+    assert_same_bins(ak.firsts(pt))
+    assert_same_bins(ak.firsts(pt), weight=ak.Array([1.0, 2.0, None, 0.5, 3.0, 1.5]))
+
+# ak.firsts after a cut that removed every object: no content, only None
+def test_indexed_option_all_none():
+    pt = ak.Array([[50.0, 20.0], [], [70.0]])
+    leading = ak.firsts(pt[pt > 100])
+    assert len(leading.layout.content) == 0
+    assert_same_bins(leading)
+    assert_same_bins(leading, weight=np.array([1.0, 2.0, 0.5]))
+
+# Arrays read from Arrow with nulls have a bit mask
+def test_bit_masked():
+    values = ak.from_arrow(pa.array([15.0, None, 35.0, 95.0, None, 150.0, 55.0, None, 5.0, 65.0, None]))
+    weight = ak.from_arrow(pa.array([1.0, 2.0, None, 0.5, 1.5, 2.5, None, 1.0, 3.0, 0.25, 1.0]))
+    assert isinstance(values.layout, ak.contents.BitMaskedArray)
+    for block_size in [3, 8, 100]:
+        assert_same_bins(values, block_size=block_size)
+        assert_same_bins(values, weight=weight, block_size=block_size)
+
+def test_bit_masked_msb_order():
+    data = np.array([10.0, 20.0, 30.0, 40.0, 50.0, 60.0, 70.0, 80.0, 90.0, 5.0])
+    valid = np.array([True, False, True, True, False, False, True, True, False, True])
+    mask = np.packbits(~valid, bitorder='big') # valid_when=False
+    layout = ak.contents.BitMaskedArray(ak.index.IndexU8(mask), ak.contents.NumpyArray(data),
+                                        valid_when=False, length=len(data), lsb_order=False)
+    values = ak.Array(layout)
+    assert ak.to_list(ak.is_none(values)) == list(~valid)
+    for block_size in [3, 8, 100]:
+        assert_same_bins(values, block_size=block_size)
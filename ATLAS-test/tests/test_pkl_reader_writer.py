@@ -0,0 +1,32 @@
+import awkward as ak
+import numpy as np
+from backend import PklReaderWriter
+from backend.PklReaderWriter import pkl_writer, pkl_reader
+
+def sample_data():
+    rng = np.random.default_rng(3)
+    return {'Zee' : ak.Array({'mass' : rng.normal(91, 5, 20_000), 'lep_n' : np.full(20_000, 2)}),
+            'empty' : np.zeros(0),
+            'repeated' : np.arange(50_000) % 7}
+
+# Blocks are smaller than the buffers, some compress (lep_n) and some are stored as they are (mass)
+def test_compressed_round_trip(tmp_path):
+    data = sample_data()
+    filename = pkl_writer(data, str(tmp_path / 'data'), compression='zstd', num_threads=2, block_size=4096)
+    loaded = pkl_reader(f'{filename}.pklz', num_threads=2)
+    assert ak.to_list(loaded['Zee']) == ak.to_list(data['Zee'])
+    assert len(loaded['empty']) == 0
+    assert np.array_equal(loaded['repeated'], data['repeated'])
+
+# Only 2 * num_threads blocks are read ahead of the segments being put together
+def test_read_ahead_bounded(tmp_path, monkeypatch):
+    filename = pkl_writer(sample_data(), str(tmp_path / 'data'), compression='zstd', num_threads=2, block_size=4096)
+    max_pending = []
+    class RecordingDeque(PklReaderWriter.deque):
+        def append(self, item):
+            super().append(item)
+            max_pending.append(len(self))
+    monkeypatch.setattr(PklReaderWriter, 'deque', RecordingDeque)
+    loaded = pkl_reader(f'{filename}.pklz', num_threads=2)
+    assert np.array_equal(loaded['repeated'], sample_data()['repeated'])
+    assert max(max_pending) == 4
@@ -0,0 +1,28 @@
+import os
+import awkward as ak
+import pyarrow.parquet as pq
+from backend import SampleCatalogue
+from backend.SampleCatalogue import select_files, partition_path
+
+def write_file(directory, name):
+    os.makedirs(directory, exist_ok=True)
+    pq.write_table(ak.to_arrow_table(ak.Array({'photon_n' : [1, 2, 3]})), f'{directory}/{name}')
+
+# Files added or removed after the catalogue was written are found without rebuilding it by hand
+def test_select_files_after_changes(tmp_path, monkeypatch):
+    monkeypatch.setattr(SampleCatalogue, 'CACHE_DIRECTORY', str(tmp_path / 'cache'))
+    dataset_directory = str(tmp_path / 'parquet')
+    process_directory = f'{dataset_directory}/{partition_path("GamGam", "GamGam")}'
+    write_file(process_directory, 'chunk0.parquet')
+    assert [os.path.basename(file) for file in select_files(['GamGam'], dataset_directory=dataset_directory)['GamGam']] == ['chunk0.parquet']
+
+    write_file(process_directory, 'chunk1.parquet')
+    files = select_files(['GamGam'], dataset_directory=dataset_directory)['GamGam']
+    assert [os.path.basename(file) for file in files] == ['chunk0.parquet', 'chunk1.parquet']
+
+    os.remove(files[0])
+    write_file(f'{dataset_directory}/{partition_path("GamGam", "ggF_Hyy")}', 'chunk0.parquet')
+    selected = select_files(['GamGam', 'ggF_Hyy'], dataset_directory=dataset_directory)
+    assert [os.path.basename(file) for file in selected['GamGam']] == ['chunk1.parquet']
+    assert len(selected['ggF_Hyy']) == 1
+    assert os.listdir(tmp_path / 'cache')
@@ -0,0 +1,31 @@
+import awkward as ak
+from backend.SnapshotReaderWriter import snapshot_writer, snapshot_reader, snapshot_info
+
+def events():
+    return ak.Array({'lep_n' : [2, 0, 1, 3],
+                     'lep_pt' : [[40.0, 30.0], [], [25.0], [60.0, 50.0, 10.0]]})
+
+# Write and read back a dict of arrays
+def round_trip(tmp_path, data_dict):
+    filename = snapshot_writer(data_dict, str(tmp_path / 'snapshot'))
+    snapshot = snapshot_reader(f'{filename}.snap')
+    info = snapshot_info(f'{filename}.snap')
+    for key, value in data_dict.items():
+        assert ak.to_list(snapshot[key]) == ak.to_list(value)
+        assert info[key]['length'] == len(value)
+        assert set(info[key]['fields']) == set(value.fields)
+    return snapshot
+
+def test_round_trip(tmp_path):
+    round_trip(tmp_path, {'Zee' : events()})
+
+# Cut and reordered record arrays have an indexed layout
+def test_round_trip_masked(tmp_path):
+    data = events()
+    round_trip(tmp_path, {'cut' : data[data['lep_n'] > 0], 'reordered' : data[[2, 0]]})
+
+# Option record arrays, as ak.firsts of records
+def test_round_trip_option(tmp_path):
+    data = events()
+    leptons = ak.zip({'pt' : data['lep_pt'], 'charge' : ak.ones_like(data['lep_pt'])})
+    round_trip(tmp_path, {'leading' : ak.firsts(leptons), 'masked' : ak.mask(data, data['lep_n'] > 1)})